@@ -0,0 +1,84 @@
+from dataclasses import dataclass
+
+import pandas as pd
+
+from adapters.historial_sharepoint import adaptar_historial_sharepoint
+
+
+def _limpiar(s: pd.Series) -> pd.Series:
+    return s.fillna("").astype(str).str.strip()
+
+
+def _opciones_por(df: pd.DataFrame) -> dict[str, list[str]]:
+    # Respeta el orden de filas de la tabla dentro de cada responsable
+    return {r: g["__opt"].tolist() for r, g in df.groupby("responsable_institucional", sort=False)}
+
+
+def _filas_por(df: pd.DataFrame) -> dict[str, dict[str, dict]]:
+    # Primera fila de cada opción dentro de cada responsable (como filtrar por responsable y tomar iloc[0])
+    return {
+        r: {rec["__opt"]: rec for rec in g.drop_duplicates("__opt").to_dict("records")}
+        for r, g in df.groupby("responsable_institucional", sort=False)
+    }
+
+
+@dataclass(frozen=True)
+class CatalogoUE:
+    """
+    Catálogo de unidades ejecutoras con PEI (PEI == "S") listo para los selectores.
+    Se construye una vez por snapshot de table_name_ue; en cada rerun solo hay lookups.
+    """
+    df: pd.DataFrame                                   # filas PEI == "S", columnas limpias + "__opt"
+    responsables: list[str]
+    opciones_por_responsable: dict[str, list[str]]
+    opciones_en_proceso_por_responsable: dict[str, list[str]]
+    filas_por_responsable: dict[str, dict[str, dict]]
+    filas_en_proceso_por_responsable: dict[str, dict[str, dict]]
+    tiene_estado_pei: bool
+
+    @classmethod
+    def desde_tabla(cls, df_raw: pd.DataFrame) -> "CatalogoUE":
+        df = adaptar_historial_sharepoint(df_raw)
+
+        if "PEI" not in df.columns:
+            raise ValueError("Falta la columna 'PEI' en la tabla de Unidades Ejecutoras (table_name_ue).")
+        df["PEI"] = _limpiar(df["PEI"]).str.upper()
+        df = df[df["PEI"] == "S"].copy()
+
+        if "responsable_institucional" not in df.columns:
+            raise ValueError("Falta la columna 'responsable_institucional' en la tabla de Unidades Ejecutoras (table_name_ue).")
+        df["responsable_institucional"] = _limpiar(df["responsable_institucional"])
+
+        tiene_estado_pei = "Estado_PEI" in df.columns
+        if tiene_estado_pei:
+            df["Estado_PEI"] = _limpiar(df["Estado_PEI"])
+
+        departamento = _limpiar(df["nombre_departamento"]) if "nombre_departamento" in df.columns else ""
+        df["__opt"] = (
+            df["codigo"].astype(str).str.strip()
+            + " - "
+            + _limpiar(df["nombre"])
+            + " - "
+            + departamento
+        )
+
+        en_proceso = df[df["Estado_PEI"].str.lower() == "en proceso"] if tiene_estado_pei else df.iloc[:0]
+
+        return cls(
+            df=df,
+            responsables=sorted(r for r in df["responsable_institucional"].unique() if r),
+            opciones_por_responsable=_opciones_por(df),
+            opciones_en_proceso_por_responsable=_opciones_por(en_proceso),
+            filas_por_responsable=_filas_por(df),
+            filas_en_proceso_por_responsable=_filas_por(en_proceso),
+            tiene_estado_pei=tiene_estado_pei,
+        )
+
+    def opciones(self, responsable: str, solo_en_proceso: bool = False) -> list[str]:
+        por_resp = self.opciones_en_proceso_por_responsable if solo_en_proceso else self.opciones_por_responsable
+        return por_resp.get(responsable, [])
+
+    def fila(self, responsable: str, opcion: str, solo_en_proceso: bool = False) -> dict | None:
+        """Fila de la UE elegida entre las del responsable (la misma lista que opciones())."""
+        por_resp = self.filas_en_proceso_por_responsable if solo_en_proceso else self.filas_por_responsable
+        return por_resp.get(responsable, {}).get(opcion)
@@ -1,4 +1,9 @@
 import re
+import threading
+import weakref
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
 from sharepoint_excel import norm_key
 
@@ -48,15 +53,75 @@ EXCEL_NORM_TO_APP = {
     "updatedby": "updated_by",
 }
 
-def adaptar_historial_sharepoint(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-
+def columnas_excel_para(app_cols) -> tuple[str, ...]:
+    """
+    Headers normalizados del Excel que terminan en esas columnas de la app
+    (para pedir solo esas columnas con read_table_columns_as_df).
+    """
+    wanted = {norm_key(c) for c in app_cols}
+    cols = {excel_norm for excel_norm, app_col in EXCEL_NORM_TO_APP.items() if norm_key(app_col) in wanted}
+    return tuple(sorted(cols | wanted))
+
+def normalizar_codigo_valor(x) -> str:
+    """Código de pliego como texto: 1314, 1314.0 y " 1314 " -> "1314"."""
+    if pd.isna(x) or x is None:
+        return ""
+    try:
+        return str(int(float(x)))
+    except Exception:
+        return str(x).strip()
+
+def _normalizar_codigos(s: pd.Series) -> np.ndarray:
+    valores = s.to_numpy(dtype=object)
+    texto = s.astype("string").str.strip().fillna("")
+    num = pd.to_numeric(texto, errors="coerce").astype("float64").to_numpy()
+
+    # Van por normalizar_codigo_valor los casos donde la conversión por columna no da lo
+    # mismo: bools (True -> "1"), números fuera del rango de int64 y textos que float()
+    # acepta pero to_numeric no (dígitos no ASCII como "١٢٣", separadores "1_000").
+    escalar = (
+        np.fromiter((isinstance(v, (bool, np.bool_)) for v in valores), dtype=bool, count=len(valores))
+        | (np.isfinite(num) & (np.abs(num) >= 2.0 ** 63))
+        | (~texto.str.isascii() | texto.str.contains("_", regex=False)).to_numpy(dtype=bool)
+    )
+    enteros = np.isfinite(num) & ~escalar
+
+    out = texto.to_numpy(dtype=object, na_value="")
+    if enteros.any():
+        # int() trunca hacia cero, igual que astype(int64)
+        out[enteros] = num[enteros].astype(np.int64).astype(str)
+    if escalar.any():
+        out[escalar] = [normalizar_codigo_valor(v) for v in valores[escalar]]
+    return out
+
+def normalizar_codigo(s: pd.Series) -> pd.Series:
+    """
+    Versión vectorizada de normalizar_codigo_valor para una columna completa.
+    Devuelve una columna categórica (pocos códigos distintos, muchas filas): se normalizan
+    solo los valores distintos y las filas se resuelven con sus códigos enteros.
+    """
+    codes, uniques = pd.factorize(s)
+    norm = _normalizar_codigos(pd.Series(np.asarray(uniques, dtype=object)))
+    # "" al final: los nulos (código -1) caen justo en esa posición
+    categorias, inversa = np.unique(np.append(norm, "").astype(str), return_inverse=True)
+    return pd.Series(
+        pd.Categorical.from_codes(inversa[codes], categories=categorias),
+        index=s.index,
+        name=s.name,
+    )
+
+@lru_cache(maxsize=64)
+def _plan_columnas(columns: tuple) -> tuple[tuple[int, ...] | None, tuple[str, ...]]:
+    """
+    Plan de adaptación para una tupla de headers (se compila una vez por tupla distinta):
+    posiciones a conservar (None = todas) y nombres finales de esas columnas.
+    """
     # 1) Limpia headers (quita espacios laterales) y elimina columnas Unnamed
-    df.columns = [str(c).strip() for c in df.columns]
-    df = df.loc[:, ~df.columns.str.startswith("Unnamed")]
+    limpios = [str(c).strip() for c in columns]
+    keep = [i for i, c in enumerate(limpios) if not c.startswith("Unnamed")]
 
     # 2) Construye mapa normalizado -> nombre real
-    norm_to_real = {norm_key(c): c for c in df.columns}
+    norm_to_real = {norm_key(limpios[i]): limpios[i] for i in keep}
 
     # 3) Prepara renombrado usando equivalencias
     rename_map = {}
@@ -64,7 +129,16 @@ def adaptar_historial_sharepoint(df: pd.DataFrame) -> pd.DataFrame:
         if excel_norm in norm_to_real:
             rename_map[norm_to_real[excel_norm]] = app_col
 
-    df = df.rename(columns=rename_map)
+    names = tuple(rename_map.get(limpios[i], limpios[i]) for i in keep)
+    return (None if len(keep) == len(limpios) else tuple(keep)), names
+
+def adaptar_historial_sharepoint(df: pd.DataFrame) -> pd.DataFrame:
+    # Sin df.copy(): con copy-on-write (pandas >= 3) set_axis/iloc no copian los datos
+    # y asignar una columna en el resultado no toca el DataFrame original.
+    keep, names = _plan_columnas(tuple(df.columns))
+    if keep is not None:
+        df = df.iloc[:, list(keep)]
+    df = df.set_axis(list(names), axis=1)
 
     # 4) Validación columna clave
     if "codigo" not in df.columns:
@@ -73,7 +147,50 @@ def adaptar_historial_sharepoint(df: pd.DataFrame) -> pd.DataFrame:
             f"Columnas detectadas: {df.columns.tolist()}"
         )
 
-    # 5) Limpieza de código
-    df["codigo"] = df["codigo"].astype(str).str.strip()
+    # 5) Limpieza de código (vectorizada, categórica)
+    df["codigo"] = normalizar_codigo(df["codigo"])
 
     return df
+
+# Historial adaptado + índice codigo -> posiciones, por snapshot crudo. Los backends
+# devuelven el mismo objeto mientras la tabla no cambia, así que basta con su identidad.
+_indexados: dict[int, tuple] = {}
+_indexados_lock = threading.Lock()
+
+def historial_indexado(df_raw: pd.DataFrame) -> tuple[pd.DataFrame, dict[str, np.ndarray]]:
+    """
+    (historial adaptado, {codigo: posiciones}) para ese snapshot. Se calcula una sola vez
+    por snapshot; elegir un pliego es un lookup: historial.iloc[indice.get(codigo, [])].
+    """
+    key = id(df_raw)
+    with _indexados_lock:
+        hit = _indexados.get(key)
+        if hit is not None and hit[0]() is df_raw:
+            return hit[1], hit[2]
+
+    historial = adaptar_historial_sharepoint(df_raw)
+    indice = historial.groupby("codigo", observed=True, sort=False).indices
+
+    with _indexados_lock:
+        for k in [k for k, v in _indexados.items() if v[0]() is None]:
+            del _indexados[k]
+        _indexados[key] = (weakref.ref(df_raw), historial, indice)
+    return historial, indice
+
+def ultimas_posiciones(historial: pd.DataFrame, posiciones, limit: int = 5) -> list[int]:
+    """
+    De las filas `posiciones` (posiciones en la tabla) de un historial adaptado, las `limit`
+    más recientes por fecha_recepcion (sin fecha = más antiguas; empate = la fila posterior).
+    Se devuelven en el orden de la tabla.
+    """
+    posiciones = np.asarray(posiciones, dtype=np.int64)
+    if len(posiciones) <= limit:
+        return posiciones.tolist()
+    if "fecha_recepcion" not in historial.columns:
+        return posiciones[-limit:].tolist()
+
+    fechas = pd.to_datetime(historial["fecha_recepcion"].iloc[posiciones], errors="coerce")
+    orden = pd.DataFrame({"fecha": fechas.to_numpy(), "pos": posiciones}).sort_values(
+        ["fecha", "pos"], na_position="first", kind="stable"
+    )
+    return np.sort(orden["pos"].to_numpy()[-limit:]).tolist()
@@ -9,38 +9,92 @@ import pandas as pd
 from uuid import uuid4
 
 from sharepoint_excel import (
-    _graph_get_token,
-    _graph_get_site_id,
-    _graph_get_drive_item_id,
-    read_table_from_sharepoint_as_df_with_ids,
-    append_row_to_sharepoint_excel,
-    update_row_in_table_by_idregistro,
+    APPKEY_TO_EXCELNORM,
+    UpdateConflictError,
 )
 
 from adapters.historial_sharepoint import (
     adaptar_historial_sharepoint,
+    columnas_excel_para,
+)
+
+from adapters.catalogo_ue import (
+    CatalogoUE,
+)
+
+from historial_prefetch import (
+    HistorialPrefetcher,
+)
+
+from shared_table_cache import (
+    SharedTableCache,
+)
+
+from storage_backends import (
+    get_backend,
 )
 
 from validators import (
     validar_formulario,
 )
 
-@st.cache_data(ttl=50 * 60)  # 50 min (token suele durar ~1h)
-def cached_graph_token(sp: dict) -> str:
-    # sp debe ser "hashable": Streamlit lo serializa; si falla, conviértelo a tuple(sorted(sp.items()))
-    return _graph_get_token(sp)
-
-@st.cache_data(ttl=24 * 60 * 60)  # 1 día (casi no cambia)
-def cached_site_id(token: str, site_hostname: str, site_path: str) -> str:
-    return _graph_get_site_id(token, site_hostname, site_path)
+from write_behind import (
+    WriteBehindQueue,
+)
 
-@st.cache_data(ttl=24 * 60 * 60)  # 1 día (casi no cambia)
-def cached_item_id(token: str, site_id: str, file_path: str) -> str:
-    return _graph_get_drive_item_id(token, site_id, file_path)
+# Copy-on-write (default en pandas 3): las cachés compartidas entregan vistas sin copiar
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# Columnas de table_name_ue que usa la app (nombres estándar, ya adaptados)
+UE_COLUMNS = (
+    "codigo",
+    "nombre",
+    "NG",
+    "PEI",
+    "Estado_PEI",
+    "responsable_institucional",
+    "nombre_departamento",
+    "nombre_sector",
+)
 
-@st.cache_data(ttl=180, show_spinner=False)
-def cached_table_df(token: str, site_id: str, item_id: str, table_name: str) -> pd.DataFrame:
-    return read_table_from_sharepoint_as_df_with_ids(token, site_id, item_id, table_name)
+@st.cache_resource
+def get_storage_backend():
+    # SharePoint (Graph) o libros locales de data/, según secrets["sharepoint"]["backend"]
+    backend = get_backend(st.secrets)
+    backend.warm_up()    # versión del archivo + headers de las tablas, en paralelo
+    return backend
+
+@st.cache_resource
+def get_write_queue() -> WriteBehindQueue | None:
+    # Opcional (secrets["sharepoint"]["write_behind"] = true): los guardados se registran en
+    # un journal local y se envían en segundo plano. El journal vive en el disco del proceso.
+    if not st.secrets.get("sharepoint", {}).get("write_behind", False):
+        return None
+    return WriteBehindQueue(get_storage_backend(), appkey_to_excelnorm=APPKEY_TO_EXCELNORM).start()
+
+@st.cache_resource
+def get_table_cache() -> SharedTableCache:
+    # Una caché para todas las sesiones: una sola descarga por tabla aunque varias sesiones
+    # la pidan a la vez, y al vencer el TTL se sirve el snapshot anterior mientras se refresca.
+    return SharedTableCache(get_storage_backend().read_table, ttl=180)
+
+def cached_table_df(table_name_key: str, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+    # columns: solo las columnas pedidas (payload y parseo proporcionales a lo que se usa).
+    # En SharePoint sirve el snapshot en disco si existe y lo revalida en segundo plano por eTag.
+    # Devuelve el DataFrame compartido (copy-on-write): modificarlo no afecta a otras sesiones.
+    return get_table_cache().get(table_name_key, columns)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _catalogo_ue(version: int, _df_ue: pd.DataFrame) -> CatalogoUE:
+    # La clave es la versión del snapshot (_df_ue no se hashea)
+    return CatalogoUE.desde_tabla(_df_ue)
+
+def cached_catalogo_ue() -> CatalogoUE:
+    # Un objeto por snapshot de table_name_ue (sin copiar en cada rerun: no modificarlo);
+    # se rearma cuando la caché de tablas carga un snapshot nuevo
+    version, df_ue = get_table_cache().get_versioned("table_name_ue", columnas_excel_para(UE_COLUMNS))
+    return _catalogo_ue(version, df_ue)
 
 
 # =====================================
@@ -233,50 +287,45 @@ st.markdown(
 )
 
 # =====================================
-# 🔐 Preparar conexión SharePoint (UNA VEZ POR RERUN)
+# 🔐 Backend de almacenamiento (uno por proceso)
 # =====================================
-sp = dict(st.secrets["sharepoint"])  # convertir a dict normal
-
-token = cached_graph_token(sp)
-site_id = cached_site_id(token, sp["site_hostname"], sp["site_path"])
-item_id = cached_item_id(token, site_id, sp["file_path"])
+backend = get_storage_backend()
+write_queue = get_write_queue()
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = str(uuid4())
+
+# Estado de los guardados en segundo plano de esta sesión
+if write_queue is not None:
+    ESTADO_ESCRITURA = {
+        "pending": "⏳ pendiente",
+        "sending": "⏳ enviando",
+        "committed": "✅ guardado",
+        "failed": "❌ falló",
+        "conflict": "⚠️ conflicto",
+    }
+    escrituras = write_queue.session_writes(st.session_state["session_id"])
+    if escrituras:
+        with st.sidebar:
+            st.markdown("**Guardados de esta sesión**")
+            for w in escrituras:
+                accion = "Nuevo registro" if w["kind"] == "append" else "Actualización"
+                st.caption(f"{ESTADO_ESCRITURA.get(w['status'], w['status'])} · {accion} {w['id_registro'][:8]}")
+                if w["status"] in ("failed", "conflict") and w["error"]:
+                    st.caption(f"↳ {w['error']}")
+                if w["status"] == "failed" and st.button("Reintentar", key=f"retry_{w['id']}"):
+                    write_queue.retry(w["id"])
+                    st.rerun()
 
 # =====================================
 # 🏛️ Carga y búsqueda de unidades ejecutoras
 # =====================================
 
-df_ue_raw = cached_table_df(token, site_id, item_id, sp["table_name_ue"])
-
-# 2) Adaptar columnas SharePoint -> estándar de la app
-df_ue = adaptar_historial_sharepoint(df_ue_raw)
-
-# ================================
-# 2.0) FILTRO BASE: solo filas con PEI = "S"
-# ================================
-if "PEI" not in df_ue.columns:
-    st.error("❌ Falta la columna 'PEI' en la tabla de Unidades Ejecutoras (table_name_ue).")
-    st.stop()
-
-df_ue["PEI"] = df_ue["PEI"].fillna("").astype(str).str.strip().str.upper()
-
-df_ue = df_ue[df_ue["PEI"] == "S"].copy()
-
-# ================================
-# 1) Validar y preparar responsables
-# ================================
-if "responsable_institucional" not in df_ue.columns:
-    st.error("❌ Falta la columna 'responsable_institucional' en unidades_ejecutoras.xlsx")
+try:
+    catalogo = cached_catalogo_ue()
+except ValueError as e:
+    st.error(f"❌ {e}")
     st.stop()
 
-df_ue["responsable_institucional"] = (
-    df_ue["responsable_institucional"]
-    .fillna("")
-    .astype(str)
-    .str.strip()
-)
-
-responsables = sorted([r for r in df_ue["responsable_institucional"].unique() if r])
-
 # ================================
 # 2) Filtro 1: Responsable Institucional
 # ================================
@@ -284,12 +333,18 @@ responsables = sorted([r for r in df_ue["responsable_institucional"].unique() if
 
 resp_sel = st.selectbox(
     "Escriba o seleccione el responsable institucional",
-    options=responsables,
+    options=catalogo.responsables,
     index=None,
     placeholder="Escribe el nombre del responsable..."
 )
 
+# Precarga del historial por sesión (un hilo propio; se cancela al cambiar la selección)
+prefetcher = st.session_state.get("historial_prefetcher")
+if prefetcher is None:
+    prefetcher = st.session_state["historial_prefetcher"] = HistorialPrefetcher(backend)
+
 if not resp_sel:
+    prefetcher.cancel()
     st.info("Selecciona un responsable para habilitar la búsqueda de Pliegos.")
     st.stop()
 
@@ -301,46 +356,25 @@ solo_en_proceso = st.checkbox(
     value=False,
 )
 
-# Normaliza Estado_PEI si existe
-if "Estado_PEI" in df_ue.columns:
-    df_ue["Estado_PEI"] = (
-        df_ue["Estado_PEI"]
-        .fillna("")
-        .astype(str)
-        .str.strip()
-    )
-else:
+if solo_en_proceso and not catalogo.tiene_estado_pei:
     # Si no existe la columna, no se puede aplicar el filtro
-    if solo_en_proceso:
-        st.warning("No se puede filtrar por Estado_PEI porque no existe la columna 'Estado_PEI' en el origen.")
+    st.warning("No se puede filtrar por Estado_PEI porque no existe la columna 'Estado_PEI' en el origen.")
     solo_en_proceso = False
 
 # ================================
-# 3) Filtrar df_ue por responsable + Filtro 2: UE (código o nombre)
+# 3) Pliegos del responsable + Filtro 2: UE (código o nombre)
 # ================================
-df_ue_filtrado = df_ue[df_ue["responsable_institucional"] == resp_sel].copy() 
+opciones = catalogo.opciones(resp_sel, solo_en_proceso)
 
-if solo_en_proceso:
-    df_ue_filtrado = df_ue_filtrado[
-        df_ue_filtrado["Estado_PEI"].str.lower() == "en proceso"
-    ].copy()
+st.caption(f"Pliegos asignados: {len(opciones)}") 
 
-st.caption(f"Pliegos asignados: {len(df_ue_filtrado)}") 
-
-if df_ue_filtrado.empty: 
+if not opciones: 
     st.warning("No hay pliegos asociadas a este responsable.") 
     st.stop() 
 
-# Crear opciones combinadas para búsqueda (solo del filtrado) 
-df_ue_filtrado["__opt"] = (
-    df_ue_filtrado["codigo"].astype(str).str.strip()
-    + " - "
-    + df_ue_filtrado["nombre"].astype(str).str.strip()
-    + " - "
-    + df_ue_filtrado["nombre_departamento"].astype(str).str.strip()
-)
+# Historial de los pliegos de este responsable, en segundo plano
+prefetcher.start((resp_sel, solo_en_proceso), [op.split(" - ")[0].strip() for op in opciones])
 
-opciones = df_ue_filtrado["__opt"].tolist()
 seleccion = st.selectbox( 
     "Escriba o seleccione el código ue o nombre de la entidad", 
     opciones, 
@@ -355,13 +389,13 @@ seleccion = st.selectbox(
 if seleccion:
     codigo = seleccion.split(" - ")[0].strip()
 
-    # 4) Ajuste: usar df_ue_filtrado en vez de df_ue
-    fila = df_ue_filtrado[df_ue_filtrado["codigo"] == codigo]
+    # 4) Fila de la UE seleccionada (lookup en el catálogo)
+    fila = catalogo.fila(resp_sel, seleccion, solo_en_proceso)
 
-    if not fila.empty:
-        sector = fila["nombre_sector"].iloc[0] if "nombre_sector" in fila.columns else ""
-        nivel_gob = fila["NG"].iloc[0]
-        responsable = fila["responsable_institucional"].iloc[0] if "responsable_institucional" in fila.columns else "No registrado"
+    if fila is not None:
+        sector = fila.get("nombre_sector", "")
+        nivel_gob = fila.get("NG", "")
+        responsable = fila.get("responsable_institucional", "No registrado")
 
         st.markdown(
             f"""
@@ -406,47 +440,26 @@ if "modo" in st.session_state and seleccion:
     # ================================
     if st.session_state["modo"] == "historial":
         try:
-            # 1) Leer historial desde SharePoint
-            historial_raw = read_table_from_sharepoint_as_df_with_ids(
-                token,
-                site_id,
-                item_id,
-                sp["table_name_hist"],
-            )
+            # 1) Últimos registros del pliego (solo esas filas, no la tabla completa)
+            historial_raw, total_pliego = backend.query_historial(codigo, limit=5)
 
             #st.write("Columnas RAW (SharePoint):", historial_raw.columns.tolist())
             #st.write("Columnas RAW normalizadas:", [norm_key(c) for c in historial_raw.columns.astype(str)])
 
             # 2) Adaptar columnas SharePoint -> estándar de la app
-            historial = adaptar_historial_sharepoint(historial_raw)
+            df_historial = adaptar_historial_sharepoint(historial_raw)
     
             # 3) Validación mínima
-            if "codigo" not in historial.columns:
+            if "codigo" not in df_historial.columns:
                 st.error("❌ El historial no tiene la columna clave 'codigo' (Id_UE).")
-                st.write("Columnas detectadas:", historial.columns.tolist())
+                st.write("Columnas detectadas:", df_historial.columns.tolist())
                 st.stop()
     
-            # 4) Normalizador de código (robusto)
-            def normalizar_codigo(x):
-                if pd.isna(x) or x is None:
-                    return ""
-                try:
-                    return str(int(float(x)))
-                except Exception:
-                    return str(x).strip()
-    
         except Exception as e:
             st.error(f"❌ Error al leer el historial desde SharePoint: {e}")
             st.stop()
     
-        # 5) Filtrar historial por el código seleccionado (SIN crear columna extra)
-        codigo_norm = normalizar_codigo(codigo)
-    
-        df_historial = historial[
-            historial["codigo"].apply(normalizar_codigo) == codigo_norm
-        ].copy()
-    
-        st.write("Filas encontradas para este pliego:", len(df_historial))
+        st.write("Filas encontradas para este pliego:", total_pliego)
     
         if df_historial.empty:
             st.info("No existe historial para este pliego (según la clave de comparación).")
@@ -477,6 +490,10 @@ if "modo" in st.session_state and seleccion:
 
             # 8.5) Se agrega esta columna id_registro para fines de actualizar un registro             
             st.session_state["id_registro"] = str(ultimo.get("id_registro", "")).strip()
+
+            # LastUpdated leído: al actualizar se verifica que nadie lo haya cambiado (compare-and-set)
+            last_updated = ultimo.get("last_updated")
+            st.session_state["last_updated"] = None if last_updated is None else ("" if pd.isna(last_updated) else last_updated)
             
             # 9) Cargar último registro al formulario
             colx, coly = st.columns([1, 2])
@@ -536,8 +553,8 @@ if "modo" in st.session_state and seleccion:
                     value=form["fecha_recepcion"] if form["fecha_recepcion"] else datetime.now().date()
                 )
 
-                # 4) Ajuste: nivel desde df_ue_filtrado
-                nivel = df_ue_filtrado.loc[df_ue_filtrado["codigo"] == codigo, "NG"].values[0]
+                # 4) Ajuste: nivel desde el catálogo de UE
+                nivel = (catalogo.fila(resp_sel, seleccion, solo_en_proceso) or {}).get("NG", "")
 
                 if nivel == "Gobierno regional":
                     opciones_articulacion = ["PEDN 2050", "PDRC"]
@@ -706,14 +723,22 @@ if "modo" in st.session_state and seleccion:
                             "updated_by": nuevo_sharepoint["updated_by"],
                         }
             
-                        update_row_in_table_by_idregistro(
-                            st.secrets,
-                            updates_by_app_key=updates,
-                            id_registro=st.session_state["id_registro"],
-                            appkey_to_excelnorm=APPKEY_TO_EXCELNORM,  # Debe existir en sharepoint_excel.py
-                        )
-                        st.success("✅ Registro actualizado (sin crear fila nueva).")
-                        cached_table_df.clear()
+                        if write_queue is not None:
+                            write_queue.submit_update(
+                                st.session_state["id_registro"],
+                                updates,
+                                expected_last_updated=st.session_state.get("last_updated"),
+                                session_id=st.session_state["session_id"],
+                            )
+                            st.success("⏳ Actualización registrada; se guarda en segundo plano.")
+                        else:
+                            backend.update_row_by_idregistro(
+                                updates_by_app_key=updates,
+                                id_registro=st.session_state["id_registro"],
+                                appkey_to_excelnorm=APPKEY_TO_EXCELNORM,
+                                expected_last_updated=st.session_state.get("last_updated"),
+                            )
+                            st.success("✅ Registro actualizado (sin crear fila nueva).")
 
                     else:
                         errores = validar_formulario({
@@ -730,14 +755,20 @@ if "modo" in st.session_state and seleccion:
 
                         # Crear nuevo: asigna UUID
                         nuevo_sharepoint["id_registro"] = str(uuid4())
-                        append_row_to_sharepoint_excel(st.secrets, nuevo_sharepoint)
-                        st.success("✅ Registro guardado como fila nueva.")
-                        cached_table_df.clear()
+                        if write_queue is not None:
+                            write_queue.submit_append(nuevo_sharepoint, session_id=st.session_state["session_id"])
+                            st.success("⏳ Registro nuevo registrado; se guarda en segundo plano.")
+                        else:
+                            backend.append_row(nuevo_sharepoint)
+                            st.success("✅ Registro guardado como fila nueva.")
 
                     # Limpieza y volver a historial
                     st.session_state["modo"] = "historial"
                     st.rerun()
             
+                except UpdateConflictError as e:
+                    st.error(f"❌ {e} Vuelve a abrir el historial para cargar la versión actual antes de actualizar.")
+
                 except Exception as e:
                     st.error(f"❌ Error al guardar/actualizar en SharePoint: {e}")
 
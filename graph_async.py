@@ -0,0 +1,179 @@
+"""
+Cliente asíncrono (asyncio + httpx) para Microsoft Graph.
+
+Sirve para los flujos con varias llamadas independientes (headers de varias tablas,
+versión del archivo, columnas...): se lanzan a la vez con un límite de concurrencia,
+en vez de una tras otra. Streamlit ejecuta el script de forma síncrona, así que el
+cliente vive en un event loop propio (un hilo de fondo) y se usa con run_sync().
+
+Si httpx no está instalado, graph_get_many() hace las mismas llamadas en secuencia con
+el GraphClient síncrono.
+"""
+import asyncio
+import random
+import threading
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from sharepoint_excel import (
+    GRAPH_BASE_URL,
+    TableSchema,
+    get_graph_client,
+    set_table_schema,
+    _workbook_session_headers,
+)
+
+_RETRY_STATUS = (429, 503)
+
+
+class AsyncGraphClient:
+    """
+    Igual que GraphClient (pool keep-alive, reintentos de 429/503 respetando Retry-After),
+    pero asíncrono y con un semáforo que limita los requests simultáneos.
+    Debe usarse siempre desde el mismo event loop (el de run_sync).
+    """
+
+    def __init__(
+        self,
+        base_url: str = GRAPH_BASE_URL,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        timeout: float = 60,
+    ):
+        if httpx is None:
+            raise RuntimeError("AsyncGraphClient requiere httpx (pip install httpx).")
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+        )
+        self._sem = asyncio.Semaphore(max_concurrency)
+
+    def url(self, path: str) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    async def request(self, method: str, path: str, token: str, headers: dict | None = None, **kwargs) -> "httpx.Response":
+        h = {"Authorization": f"Bearer {token}"}
+        if headers:
+            h.update(headers)
+        for attempt in range(self.max_retries + 1):
+            async with self._sem:
+                r = await self.client.request(method, self.url(path), headers=h, **kwargs)
+            if r.status_code not in _RETRY_STATUS or attempt == self.max_retries:
+                break
+            retry_after = r.headers.get("Retry-After")
+            try:
+                delay = float(retry_after)
+            except (TypeError, ValueError):
+                delay = self.backoff_factor * (2 ** attempt) * (1 + random.random() * 0.1)
+            await asyncio.sleep(delay)
+        r.raise_for_status()
+        return r
+
+    async def get_json(self, path: str, token: str, **kwargs) -> dict:
+        r = await self.request("GET", path, token, **kwargs)
+        return r.json() if r.content else {}
+
+    async def get_many(self, token: str, paths_by_key: dict, headers: dict | None = None) -> dict:
+        """GET concurrentes. Devuelve {key: json}; si alguno falla se propaga el primer error."""
+        keys = list(paths_by_key)
+        results = await asyncio.gather(*(self.get_json(paths_by_key[k], token, headers=headers) for k in keys))
+        return dict(zip(keys, results))
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+# -----------------------------
+# Event loop de fondo + wrapper síncrono
+# -----------------------------
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="graph-async", daemon=True).start()
+        return _loop
+
+
+def run_sync(coro, timeout: float | None = None):
+    """Ejecuta una corrutina en el loop de fondo y espera su resultado (llamable desde Streamlit)."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result(timeout)
+
+
+_async_client: AsyncGraphClient | None = None
+
+
+def get_async_graph_client() -> AsyncGraphClient:
+    """AsyncGraphClient del proceso (creado dentro del loop de fondo)."""
+    global _async_client
+    if _async_client is None:
+        async def _create():
+            return AsyncGraphClient()
+        client = run_sync(_create())
+        with _loop_lock:
+            if _async_client is None:
+                _async_client = client
+    return _async_client
+
+
+def set_async_graph_client(client: AsyncGraphClient | None) -> AsyncGraphClient | None:
+    """Reemplaza el cliente del proceso (p. ej. para apuntar a otro base_url). Devuelve el anterior."""
+    global _async_client
+    with _loop_lock:
+        prev, _async_client = _async_client, client
+    return prev
+
+
+def new_async_graph_client(**kwargs) -> AsyncGraphClient:
+    """Crea un AsyncGraphClient dentro del loop de fondo (los kwargs van al constructor)."""
+    async def _create():
+        return AsyncGraphClient(**kwargs)
+    return run_sync(_create())
+
+
+def graph_get_many(token: str, paths_by_key: dict, headers: dict | None = None) -> dict:
+    """
+    Versión síncrona de AsyncGraphClient.get_many: todos los GET a la vez (con el límite
+    de concurrencia del cliente). Sin httpx se hacen en secuencia con GraphClient.
+    """
+    if not paths_by_key:
+        return {}
+    if httpx is None:
+        client = get_graph_client()
+        return {k: client.get(p, token, headers=headers).json() for k, p in paths_by_key.items()}
+    return run_sync(get_async_graph_client().get_many(token, paths_by_key, headers=headers))
+
+
+def warm_table_schemas(token: str, site_id: str, item_id: str, table_names: list[str]) -> dict[str, TableSchema]:
+    """
+    Carga a la vez la versión del archivo y los headers de varias tablas, y deja los
+    esquemas en la caché de sharepoint_excel (los usan lecturas y guardados).
+    """
+    base = f"/sites/{site_id}/drive/items/{item_id}"
+    paths = {"__versions__": f"{base}?$select=eTag,cTag"}
+    for t in table_names:
+        paths[t] = f"{base}/workbook/tables/{t}/columns?$select=name"
+
+    data = graph_get_many(token, paths, headers=_workbook_session_headers(token, site_id, item_id))
+    etag = data.pop("__versions__").get("eTag")
+
+    schemas = {}
+    for t, payload in data.items():
+        headers = [str(c.get("name", "")).strip() for c in payload.get("value", [])]
+        if headers:
+            schemas[t] = TableSchema.from_headers(headers, etag)
+            set_table_schema(item_id, t, schemas[t])
+    return schemas
@@ -0,0 +1,55 @@
+"""
+Precarga en segundo plano del historial de los pliegos de un responsable.
+
+Cada sesión de Streamlit tiene su HistorialPrefetcher (un hilo propio). Al elegir un
+responsable se lanza la precarga de todos sus pliegos; si la selección cambia, la
+precarga anterior se cancela (las tareas pendientes no empiezan y la que corre se
+detiene en el siguiente grupo de pliegos).
+"""
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class HistorialPrefetcher:
+    def __init__(self, backend, limit: int = 5):
+        self.backend = backend
+        self.limit = limit
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="historial-prefetch")
+        self._key = None
+        self._cancel: threading.Event | None = None
+        self._future: Future | None = None
+        self._lock = threading.Lock()
+        # si la sesión se descarta, se libera el hilo
+        weakref.finalize(self, self._executor.shutdown, wait=False, cancel_futures=True)
+
+    def start(self, key, codigos: list[str]) -> None:
+        """Precarga esos pliegos (no hace nada si `key` es la selección que ya se está precargando)."""
+        with self._lock:
+            if key == self._key:
+                return
+            self._cancel_current()
+            self._key = key
+            self._cancel = cancel = threading.Event()
+            self._future = self._executor.submit(self._run, list(codigos), cancel)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancel_current()
+            self._key = None
+
+    def _cancel_current(self) -> None:
+        if self._cancel is not None:
+            self._cancel.set()
+        if self._future is not None:
+            self._future.cancel()
+
+    def _run(self, codigos: list[str], cancel: threading.Event) -> int:
+        try:
+            return self.backend.prefetch_historial(codigos, self.limit, cancelled=cancel.is_set)
+        except Exception:
+            return 0    # es solo una precarga: el clic en "Historial" vuelve a consultar
+
+    @property
+    def running(self) -> bool:
+        return self._future is not None and not self._future.done()
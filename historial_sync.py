@@ -0,0 +1,307 @@
+import threading
+import time
+
+import pandas as pd
+
+from sharepoint_excel import (
+    TableSchema,
+    app_row_to_excel_norm,
+    norm_key,
+    resolve_graph_context,
+    read_table_from_sharepoint_as_df_with_ids,
+    read_table_columns_as_df,
+    get_table_rows_by_index,
+    get_table_schema,
+    _graph_get_item_versions,
+)
+from adapters.historial_sharepoint import (
+    columnas_excel_para,
+    historial_indexado,
+    normalizar_codigo_valor,
+    ultimas_posiciones,
+)
+from table_disk_cache import (
+    load_table_snapshot,
+    store_table_snapshot_async,
+)
+
+# Si cambió más de esta fracción de filas, conviene recargar la tabla completa
+FULL_RELOAD_RATIO = 0.2
+
+# Consultas por pliego sin snapshot: cada cuánto se revisa la versión del archivo y
+# cuántos pliegos se precargan por $batch
+VERSION_CHECK_S = 10
+PREFETCH_CHUNK = 8
+
+
+def _replace_rows(df: pd.DataFrame, rows_by_pos: dict[int, list]) -> pd.DataFrame:
+    # Nuevo DataFrame con esas filas reemplazadas (el anterior no se toca; los dtypes se
+    # amplían si hace falta, igual que en una lectura completa)
+    n = len(df.columns)
+    patch = pd.DataFrame(
+        [(list(r) + [""] * n)[:n] for r in rows_by_pos.values()],
+        columns=df.columns,
+        index=list(rows_by_pos),
+    )
+    keep = df.drop(index=df.index[list(rows_by_pos)])
+    return pd.concat([keep, patch]).sort_index()
+
+
+class HistorialSync:
+    """
+    Copia local (snapshot) de la tabla de historial que se sincroniza por incrementos.
+
+    En cada refresh se consulta primero el eTag/cTag del archivo; si no cambió no hay
+    más llamadas. Si cambió, se leen solo las columnas IdRegistro y LastUpdated y se
+    comparan con el snapshot: se traen únicamente las filas nuevas del final y las que
+    cambiaron su LastUpdated. Si las IdRegistro ya no calzan (borrado, orden, inserción
+    en medio) se recarga todo.
+
+    Los guardados de la app se aplican al snapshot en el momento (write-through) con
+    apply_local_append / apply_local_update, en vez de invalidarlo.
+    """
+
+    def __init__(self, sp: dict, table_name_key: str = "table_name_hist"):
+        self.sp = sp
+        self.table_name = sp.get(table_name_key)
+        if not self.table_name:
+            raise ValueError(f"Falta secrets['sharepoint'].{table_name_key}")
+
+        self.df: pd.DataFrame | None = None
+        self.etag: str | None = None
+        self.ctag: str | None = None
+        self.version = 0               # sube con cada cambio del snapshot (para cachés derivadas)
+        self._lock = threading.RLock()
+
+        # Consulta por pliego sin snapshot: columnas clave (codigo, fecha) + índice por
+        # codigo, vigentes mientras no cambie el cTag, y las últimas respuestas
+        self._claves: tuple[str, pd.DataFrame, dict] | None = None
+        self._claves_checked_at = 0.0
+        self._consultas: dict[tuple[str, int], tuple[pd.DataFrame, int]] = {}
+
+    # -----------------------------
+    # Lectura
+    # -----------------------------
+    def snapshot(self) -> pd.DataFrame:
+        """Snapshot actual (sincronizado si hace falta). No se debe modificar in-place."""
+        return self.refresh()
+
+    def refresh(self, force_full: bool = False) -> pd.DataFrame:
+        with self._lock:
+            token, site_id, item_id = resolve_graph_context(self.sp)
+
+            # arranque en frío: parte del snapshot en disco y sincroniza solo la diferencia
+            if self.df is None and not force_full:
+                hit = load_table_snapshot(item_id, self.table_name)
+                if hit is not None:
+                    self._set(hit[0])
+                    self.ctag = hit[1]
+
+            version_before = self.version
+            versions = _graph_get_item_versions(token, site_id, item_id)
+
+            if self.df is not None and not force_full and versions["cTag"] and versions["cTag"] == self.ctag:
+                self.etag = versions["eTag"]
+                return self.df
+
+            if self.df is None or force_full or not self._apply_incremental(token, site_id, item_id):
+                self._set(read_table_from_sharepoint_as_df_with_ids(token, site_id, item_id, self.table_name))
+
+            self.etag, self.ctag = versions["eTag"], versions["cTag"]
+            if self.version != version_before:
+                store_table_snapshot_async(item_id, self.table_name, self.ctag or self.etag, self.df)
+            return self.df
+
+    def query(self, codigo: str, limit: int = 5) -> tuple[pd.DataFrame, int]:
+        """
+        Últimos `limit` registros del pliego (por fecha_recepcion), con los headers reales e
+        índice = posición en la tabla, y cuántos registros tiene en total.
+
+        Si el snapshot completo ya está en memoria se responde con su índice por codigo.
+        Si no, no se descarga la tabla: se leen solo las columnas codigo/fecha (una vez por
+        versión del archivo) y luego únicamente las filas pedidas.
+        """
+        cod = normalizar_codigo_valor(codigo)
+        with self._lock:
+            if self.df is not None:
+                df = self.refresh()
+                historial, indice = historial_indexado(df)
+                pos = indice.get(cod, [])
+                return df.iloc[ultimas_posiciones(historial, pos, limit)], len(pos)
+
+            token, site_id, item_id = resolve_graph_context(self.sp)
+            self._claves_vigentes(token, site_id, item_id)
+            if (cod, limit) not in self._consultas:
+                self._fetch_consultas(token, site_id, item_id, [cod], limit)
+            return self._consultas[(cod, limit)]
+
+    def prefetch(self, codigos: list[str], limit: int = 5, cancelled=None) -> int:
+        """
+        Deja listas en memoria las consultas de varios pliegos (de a PREFETCH_CHUNK, cada
+        grupo con un solo $batch de filas). cancelled() se revisa entre grupos.
+        Devuelve cuántos pliegos se cargaron.
+        """
+        cods = list(dict.fromkeys(normalizar_codigo_valor(c) for c in codigos))
+        done = 0
+        for start in range(0, len(cods), PREFETCH_CHUNK):
+            if cancelled is not None and cancelled():
+                break
+            with self._lock:
+                if self.df is not None:
+                    break     # con el snapshot en memoria las consultas ya son locales
+                token, site_id, item_id = resolve_graph_context(self.sp)
+                self._claves_vigentes(token, site_id, item_id)
+                pending = [c for c in cods[start:start + PREFETCH_CHUNK] if (c, limit) not in self._consultas]
+                if pending:
+                    self._fetch_consultas(token, site_id, item_id, pending, limit)
+                done += len(pending)
+        return done
+
+    def _claves_vigentes(self, token: str, site_id: str, item_id: str) -> None:
+        # Columnas codigo/fecha + índice; la versión del archivo se revisa como mucho cada VERSION_CHECK_S
+        now = time.monotonic()
+        if self._claves is not None and now - self._claves_checked_at < VERSION_CHECK_S:
+            return
+
+        versions = _graph_get_item_versions(token, site_id, item_id)
+        tag = versions["cTag"] or versions["eTag"]
+        if self._claves is None or not tag or self._claves[0] != tag:
+            schema = get_table_schema(token, site_id, item_id, self.table_name)
+            wanted = set(columnas_excel_para(("codigo", "fecha_recepcion")))
+            cols = [h for h in schema.headers if norm_key(h) in wanted]
+            claves, indice = historial_indexado(read_table_columns_as_df(token, site_id, item_id, self.table_name, cols))
+            self._claves = (tag, claves, indice)
+            self._consultas.clear()
+        self._claves_checked_at = now
+
+    def _fetch_consultas(self, token: str, site_id: str, item_id: str, cods: list[str], limit: int) -> None:
+        # Trae en un solo $batch las filas elegidas de todos esos pliegos
+        _, claves, indice = self._claves
+        elegidas = {}
+        for cod in cods:
+            pos = indice.get(cod, [])
+            elegidas[cod] = (ultimas_posiciones(claves, pos, limit), len(pos))
+
+        wanted = sorted({i for sel, _ in elegidas.values() for i in sel})
+        rows = get_table_rows_by_index(token, site_id, item_id, self.table_name, wanted) if wanted else {}
+        if len(rows) != len(wanted):
+            raise RuntimeError("No se pudieron leer las filas del historial.")
+
+        headers = get_table_schema(token, site_id, item_id, self.table_name).headers
+        n = len(headers)
+        for cod, (sel, total) in elegidas.items():
+            out = pd.DataFrame([(rows[i] + [""] * n)[:n] for i in sel], columns=headers, index=sel)
+            self._consultas[(cod, limit)] = (out, total)
+
+    def _cols(self) -> tuple[str | None, str | None]:
+        by_norm = {norm_key(c): c for c in self.df.columns}
+        return by_norm.get("idregistro"), by_norm.get("lastupdated")
+
+    def _apply_incremental(self, token: str, site_id: str, item_id: str) -> bool:
+        """Aplica solo las diferencias. Devuelve False si hay que recargar la tabla completa."""
+        id_col, lu_col = self._cols()
+        if id_col is None:
+            return False
+
+        keys = read_table_columns_as_df(token, site_id, item_id, self.table_name, [c for c in (id_col, lu_col) if c])
+        if list(keys.columns) != [c for c in (id_col, lu_col) if c]:
+            return False     # cambiaron los headers
+
+        n_old = len(self.df)
+        remote_ids = keys[id_col].astype(str).str.strip().tolist()
+        local_ids = self.df[id_col].astype(str).str.strip().tolist()
+        if len(remote_ids) < n_old or remote_ids[:n_old] != local_ids:
+            return False
+
+        changed = []
+        if lu_col is not None:
+            remote_lu = keys[lu_col].astype(str).tolist()[:n_old]
+            local_lu = self.df[lu_col].astype(str).tolist()
+            changed = [i for i, (a, b) in enumerate(zip(remote_lu, local_lu)) if a != b]
+
+        n_new = len(remote_ids) - n_old
+        if not changed and not n_new:
+            return True
+        if len(changed) + n_new > FULL_RELOAD_RATIO * max(len(remote_ids), 1):
+            return False
+
+        df = self.df
+        if changed:
+            rows = get_table_rows_by_index(token, site_id, item_id, self.table_name, changed)
+            if len(rows) != len(changed):
+                return False
+            df = _replace_rows(df, rows)
+
+        if n_new:
+            tail = read_table_columns_as_df(token, site_id, item_id, self.table_name, None, row_start=n_old)
+            if list(tail.columns) != list(df.columns):
+                return False
+            df = pd.concat([df, tail], ignore_index=True)
+
+        self._set(df)
+        return True
+
+    def _set(self, df: pd.DataFrame) -> None:
+        self.df = df.reset_index(drop=True)
+        self.version += 1
+
+    # -----------------------------
+    # Write-through (guardados hechos por la app)
+    # -----------------------------
+    def apply_local_append(self, row_by_app_key: dict, appkey_to_excelnorm: dict | None = None) -> None:
+        with self._lock:
+            if self.df is None:
+                # consulta por pliego: no se espera a que cambie el cTag (puede tardar, p. ej.
+                # con sesión de libro); la próxima consulta relee las columnas clave con la fila
+                self._claves = None
+                self._consultas.clear()
+                return
+            schema = TableSchema.from_headers(list(self.df.columns))
+            row_norm = app_row_to_excel_norm(row_by_app_key, appkey_to_excelnorm)
+            id_col, _ = self._cols()
+            rid = str(row_norm.get("idregistro", "")).strip()
+            if id_col is not None and rid and (self.df[id_col].astype(str).str.strip() == rid).any():
+                return      # un refresh ya trajo la fila
+            new = pd.DataFrame([schema.row_from_norm(row_norm)], columns=self.df.columns)
+            self._set(pd.concat([self.df, new], ignore_index=True))
+
+    def apply_local_update(self, id_registro: str, updates_by_app_key: dict, appkey_to_excelnorm: dict | None = None) -> None:
+        with self._lock:
+            if self.df is None:
+                self._forget_consultas(str(id_registro).strip(), app_row_to_excel_norm(updates_by_app_key, appkey_to_excelnorm))
+                return
+            id_col, _ = self._cols()
+            if id_col is None:
+                return
+            pos = (self.df[id_col].astype(str).str.strip() == str(id_registro).strip()).to_numpy().nonzero()[0]
+            if not len(pos):
+                return
+            schema = TableSchema.from_headers(list(self.df.columns))
+            i = int(pos[0])
+            row = schema.apply_updates(self.df.iloc[i].tolist(), app_row_to_excel_norm(updates_by_app_key, appkey_to_excelnorm))
+            self._set(_replace_rows(self.df, {i: row}))
+
+    def _forget_consultas(self, id_registro: str, updates_norm: dict) -> None:
+        # Consulta por pliego: se descartan las respuestas que traen esa fila (se releen con
+        # el valor nuevo); si cambió el código o la fecha, también el índice de claves
+        if self._claves is not None and set(updates_norm) & set(columnas_excel_para(("codigo", "fecha_recepcion"))):
+            self._claves = None
+            self._consultas.clear()
+            return
+        for key, (df, _) in list(self._consultas.items()):
+            id_col = next((c for c in df.columns if norm_key(c) == "idregistro"), None)
+            if id_col is None or (df[id_col].astype(str).str.strip() == id_registro).any():
+                del self._consultas[key]
+
+
+_syncs: dict[tuple, HistorialSync] = {}
+_syncs_lock = threading.Lock()
+
+def get_historial_sync(sp: dict, table_name_key: str = "table_name_hist") -> HistorialSync:
+    """HistorialSync compartido del proceso para ese archivo/tabla."""
+    key = (sp.get("site_hostname"), sp.get("site_path"), sp.get("file_path"), sp.get(table_name_key))
+    with _syncs_lock:
+        sync = _syncs.get(key)
+        if sync is None:
+            sync = _syncs[key] = HistorialSync(sp, table_name_key)
+        return sync
@@ -0,0 +1,74 @@
+"""
+Costo de filtrar el historial por pliego: apply(normalizar_codigo) por clic vs. columna
+codigo normalizada (vectorizada) + índice codigo -> filas calculado una vez por snapshot.
+
+Usa data/historial_it_pei.xlsx replicado N veces:
+    python scripts/bench_codigo_index.py --factors 1 10 100 --clicks 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage_backends import LocalWorkbookBackend
+from adapters.historial_sharepoint import (
+    adaptar_historial_sharepoint,
+    historial_indexado,
+    normalizar_codigo_valor,
+)
+
+
+def filtro_anterior(historial_raw: pd.DataFrame, codigo: str) -> pd.DataFrame:
+    # Como app.py antes: adaptar en cada rerun y filtrar con apply fila por fila
+    historial = adaptar_historial_sharepoint(historial_raw)
+    historial["codigo"] = historial["codigo"].astype(str)
+    return historial[historial["codigo"].apply(normalizar_codigo_valor) == normalizar_codigo_valor(codigo)].copy()
+
+
+def filtro_indexado(historial_raw: pd.DataFrame, codigo: str) -> pd.DataFrame:
+    historial, indice = historial_indexado(historial_raw)
+    return historial.iloc[indice.get(normalizar_codigo_valor(codigo), [])].copy()
+
+
+def medir(fn, df: pd.DataFrame, codigos: list[str]) -> tuple[float, float]:
+    """(ms del primer clic, ms promedio de los siguientes)."""
+    t0 = time.perf_counter()
+    fn(df, codigos[0])
+    primero = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    for c in codigos[1:]:
+        fn(df, c)
+    resto = (time.perf_counter() - t0) * 1000 / max(len(codigos) - 1, 1)
+    return primero, resto
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--factors", type=int, nargs="+", default=[1, 10, 100])
+    ap.add_argument("--clicks", type=int, default=20)
+    args = ap.parse_args()
+
+    # Sheet1: la copia del historial con columnas del app (codigo, fecha_recepcion, ...)
+    base = LocalWorkbookBackend({"table_name_hist": "data/historial_it_pei.xlsx!Sheet1"}).read_table("table_name_hist")
+    codigos = base["codigo"].astype(str).drop_duplicates().sample(args.clicks, random_state=0).tolist()
+
+    for f in args.factors:
+        df = pd.concat([base] * f, ignore_index=True)
+        esperado = filtro_anterior(df, codigos[0])
+        obtenido = filtro_indexado(df.copy(), codigos[0])
+        assert len(esperado) == len(obtenido), (len(esperado), len(obtenido))
+
+        a1, a = medir(filtro_anterior, df, codigos)
+        b1, b = medir(filtro_indexado, df, codigos)
+        print(
+            f"x{f:<4} filas={len(df):>7}  apply: {a:8.1f} ms/clic   "
+            f"índice: primer clic {b1:7.1f} ms, luego {b:6.2f} ms/clic"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Tiempo de pared de flujos con varias llamadas independientes a Graph: en secuencia
+(GraphClient) vs. concurrentes (graph_async, httpx) contra el servidor local.
+
+    python scripts/bench_graph_async.py --latency-ms 40 --rounds 10
+
+Flujos:
+- arranque: versión del archivo + headers de UE e Historial + columnas codigo/fecha
+- esquemas: warm_table_schemas() vs. get_table_schema() de cada tabla en secuencia
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_stub import GraphStub
+import sharepoint_excel as se
+import graph_async as ga
+
+SITE, ITEM = "site-id", "item-id"
+BASE = f"/sites/{SITE}/drive/items/{ITEM}"
+TABLES = {
+    "UE": {"sheet": "Hoja3", "headers": ["codigo", "nombre", "PEI", "responsable_institucional"],
+           "rows": [[str(i), f"UE {i}", "S", f"resp {i % 12}"] for i in range(500)]},
+    "Historial": {"sheet": "Hoja1", "headers": ["Id_UE", "Fecha de recepción", "Estado", "IdRegistro", "LastUpdated"],
+                  "rows": [[str(i % 500), "2024-01-01", "En proceso", f"id{i}", ""] for i in range(3000)]},
+}
+PATHS = {
+    "versions": f"{BASE}?$select=eTag,cTag",
+    "ue_columns": f"{BASE}/workbook/tables/UE/columns",
+    "hist_columns": f"{BASE}/workbook/tables/Historial/columns",
+    "hist_codigo": f"{BASE}/workbook/tables/Historial/columns/Id_UE/dataBodyRange",
+    "hist_fecha": f"{BASE}/workbook/tables/Historial/columns/Fecha%20de%20recepci%C3%B3n/dataBodyRange",
+    "ue_range": f"{BASE}/workbook/tables/UE/range",
+}
+
+
+def secuencial(token: str) -> dict:
+    client = se.get_graph_client()
+    return {k: client.get(p, token).json() for k, p in PATHS.items()}
+
+
+def concurrente(token: str) -> dict:
+    return ga.graph_get_many(token, PATHS)
+
+
+def esquemas_secuencial(token: str) -> None:
+    se.invalidate_table_schema()
+    se._graph_get_item_versions(token, SITE, ITEM)
+    for t in TABLES:
+        se.get_table_schema(token, SITE, ITEM, t)
+
+
+def esquemas_concurrente(token: str) -> None:
+    se.invalidate_table_schema()
+    ga.warm_table_schemas(token, SITE, ITEM, list(TABLES))
+
+
+def medir(fn, rounds: int) -> float:
+    fn("token-local")   # calienta conexiones
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        fn("token-local")
+    return (time.perf_counter() - t0) * 1000 / rounds
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--latency-ms", type=float, default=40.0)
+    ap.add_argument("--rounds", type=int, default=10)
+    ap.add_argument("--concurrency", type=int, default=8)
+    args = ap.parse_args()
+
+    stub = GraphStub(tables=TABLES, latency_s=args.latency_ms / 1000).start()
+    se.set_graph_client(se.GraphClient(base_url=stub.base_url))
+    ga.set_async_graph_client(ga.new_async_graph_client(base_url=stub.base_url, max_concurrency=args.concurrency))
+    se.enable_workbook_sessions(False)
+    try:
+        assert secuencial("token-local") == concurrente("token-local")
+        for nombre, sec, conc, n in (
+            ("arranque", secuencial, concurrente, len(PATHS)),
+            ("esquemas", esquemas_secuencial, esquemas_concurrente, len(TABLES) + 1),
+        ):
+            a, b = medir(sec, args.rounds), medir(conc, args.rounds)
+            print(f"{nombre:<9} ({n} llamadas): secuencial {a:7.1f} ms   concurrente {b:7.1f} ms   x{a / b:4.1f}")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compara conexiones TCP y tiempo por "guardado" usando requests sin sesión
+(comportamiento anterior) vs. el GraphClient con pool de conexiones.
+
+Corre contra un servidor local (scripts/graph_stub.py), sin red ni credenciales:
+    python scripts/bench_graph_session.py --saves 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_stub import GraphStub
+from sharepoint_excel import (
+    GraphClient,
+    set_graph_client,
+    _graph_get_site_id,
+    _graph_get_drive_item_id,
+    _excel_get_table_header_names,
+    _excel_table_add_row,
+)
+
+TABLE = "Historial"
+HEADERS = ["Id_UE", "Periodo PEI", "Estado", "IdRegistro"]
+
+
+class SinPoolClient(GraphClient):
+    """Mismo API que GraphClient pero abre una conexión nueva por request (como requests.get)."""
+
+    def request(self, method, path, token, headers=None, **kwargs):
+        h = {"Authorization": f"Bearer {token}"}
+        if headers:
+            h.update(headers)
+        kwargs.setdefault("timeout", self.timeout)
+        r = requests.request(method, self.url(path), headers=h, **kwargs)
+        r.raise_for_status()
+        return r
+
+
+def simular_guardado(token: str) -> None:
+    # Misma secuencia que append_row_to_sharepoint_excel (sin el token MSAL)
+    site_id = _graph_get_site_id(token, "contoso.sharepoint.com", "/sites/pei")
+    item_id = _graph_get_drive_item_id(token, site_id, "/Shared Documents/historial.xlsx")
+    headers = _excel_get_table_header_names(token, site_id, item_id, TABLE)
+    _excel_table_add_row(token, site_id, item_id, TABLE, ["1314", "2025-2027", "En proceso", "x"][: len(headers)])
+
+
+def medir(stub: GraphStub, client: GraphClient, saves: int) -> tuple[int, int, float]:
+    set_graph_client(client)
+    stub.reset_counters()
+    t0 = time.perf_counter()
+    for _ in range(saves):
+        simular_guardado("token-local")
+    dt = time.perf_counter() - t0
+    client.close()
+    return stub.counters["connections"], stub.counters["requests"], dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--saves", type=int, default=20)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="latencia simulada por request")
+    args = ap.parse_args()
+
+    stub = GraphStub(tables={TABLE: {"headers": HEADERS, "rows": []}}, latency_s=args.latency_ms / 1000).start()
+    try:
+        for nombre, client in (
+            ("sin pool (requests.*)", SinPoolClient(base_url=stub.base_url)),
+            ("GraphClient (pool)   ", GraphClient(base_url=stub.base_url)),
+        ):
+            conns, reqs, dt = medir(stub, client, args.saves)
+            print(
+                f"{nombre}: {args.saves} guardados, {reqs} requests, {conns} conexiones "
+                f"({conns / args.saves:.2f}/guardado), {dt * 1000 / args.saves:.1f} ms/guardado"
+            )
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
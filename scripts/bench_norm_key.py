@@ -0,0 +1,81 @@
+"""
+Microbenchmark de norm_key: versión original (NFD + regex) vs. tabla de str.translate
+(escalar memoizada y vectorizada para Series).
+
+Verifica que la salida sea idéntica sobre los headers reales de data/*.xlsx y sobre los
+valores de texto de sus columnas, y mide el throughput:
+    python scripts/bench_norm_key.py --repeat 20
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import pandas as pd
+from openpyxl import load_workbook
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import sharepoint_excel as se
+
+
+def textos_de_libros() -> tuple[list[str], list[str]]:
+    """(headers de todas las hojas, valores de texto de todas las celdas) de data/*.xlsx."""
+    headers, valores = [], []
+    for path in sorted(glob.glob(os.path.join(ROOT, "data", "*.xlsx"))):
+        wb = load_workbook(path, read_only=True, data_only=True)
+        for ws in wb.worksheets:
+            rows = ws.iter_rows(values_only=True)
+            headers += [str(h) for h in next(rows, ()) if h is not None]
+            for row in rows:
+                valores += [v for v in row if isinstance(v, str)]
+        wb.close()
+    return headers, valores
+
+
+def cronometrar(fn, repeat: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    headers, valores = textos_de_libros()
+
+    # 1) Salida idéntica
+    for nombre, textos in (("headers", headers), ("valores", valores)):
+        esperado = [se._norm_key_slow(t) for t in textos]
+        escalar = [se._norm_key_str.__wrapped__(t) for t in textos]
+        vector = se.norm_key_series(textos).tolist()
+        assert escalar == esperado, f"{nombre}: la versión escalar difiere"
+        assert vector == esperado, f"{nombre}: la versión vectorizada difiere"
+        print(f"{nombre}: {len(textos)} textos ({len(set(textos))} distintos), salida idéntica")
+
+    # 2) Throughput
+    for nombre, textos in (("headers", headers), ("valores", valores)):
+        n = len(textos)
+        original = cronometrar(lambda: [se._norm_key_slow(t) for t in textos], args.repeat)
+        tabla = cronometrar(lambda: [se._norm_key_str.__wrapped__(t) for t in textos], args.repeat)
+        se._norm_key_str.cache_clear()
+        memo = cronometrar(lambda: [se.norm_key(t) for t in textos], args.repeat)
+        serie = pd.Series(textos)
+        vector = cronometrar(lambda: se.norm_key_series(serie), args.repeat)
+        print(f"\n{nombre} ({n} textos), miles de textos/s:")
+        for etiqueta, dt in (
+            ("original (NFD + regex)", original),
+            ("tabla translate", tabla),
+            ("tabla + memo (norm_key)", memo),
+            ("vectorizada (Series)", vector),
+        ):
+            print(f"  {etiqueta:<26} {n / dt / 1000:10.1f}   x{original / dt:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Validación del historial completo: validar_formulario fila por fila (dict por fila, con
+los vacíos de pandas pasados a "") vs. validar_dataframe (operaciones por columna).
+
+Lee data/historial_it_pei.xlsx (Hoja1, headers del Excel), lo adapta a columnas del app,
+verifica que ambas versiones den los mismos errores y mide el tiempo; --scale replica
+las filas para simular tablas más grandes:
+    python scripts/bench_validators.py --scale 20
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from openpyxl import load_workbook
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from adapters.historial_sharepoint import adaptar_historial_sharepoint
+from validators import validar_dataframe, validar_formulario
+
+
+def vacios_como_texto(datos: dict) -> dict:
+    # Contrato de validar_dataframe: una celda vacía de pandas (None/NaN/NaT) cuenta como ""
+    return {k: ("" if v is None or (not isinstance(v, str) and pd.isna(v)) else v) for k, v in datos.items()}
+
+
+def cargar_historial(path: str, sheet: str) -> pd.DataFrame:
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        headers = [str(h).strip() if h is not None else "" for h in next(rows)]
+        data = [r for r in rows if any(v is not None for v in r)]
+    finally:
+        wb.close()
+    df = pd.DataFrame(data, columns=headers)
+    return adaptar_historial_sharepoint(df.loc[:, [h != "" for h in headers]])
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--file", default=os.path.join(ROOT, "data", "historial_it_pei.xlsx"))
+    ap.add_argument("--sheet", default="Hoja1")
+    ap.add_argument("--scale", type=int, default=10)
+    args = ap.parse_args()
+
+    base = cargar_historial(args.file, args.sheet)
+    # el libro trae "EMITIDO"; se agrega una variante "Emitido" para ejercitar las reglas de Estado
+    variante = base.assign(estado=base["estado"].astype("string").str.title())
+    df = pd.concat([base, variante] * args.scale, ignore_index=True)
+    cols = ["periodo", "estado", "expediente", "numero_it", "fecha_it"]
+
+    records = df[cols].to_dict("records")
+    t0 = time.perf_counter()
+    escalar = [validar_formulario(vacios_como_texto(d)) for d in records]
+    t_escalar = time.perf_counter() - t0
+    # filas donde importa que el vacío sea "" (validar_formulario con None/NaN crudos difiere)
+    distintas = sum(validar_formulario(d) != e for d, e in zip(records, escalar))
+
+    t0 = time.perf_counter()
+    reporte = validar_dataframe(df)
+    t_vector = time.perf_counter() - t0
+
+    esperado = [(i, e) for i, errs in enumerate(escalar) for e in errs]
+    assert esperado == list(zip(reporte["fila"], reporte["error"])), "los reportes no coinciden"
+
+    print(f"{len(df):,} filas, {len(reporte):,} errores en {reporte['fila'].nunique():,} filas (iguales en ambas versiones)")
+    print(reporte["error"].value_counts().to_string())
+    print(f"filas que validar_formulario juzga distinto con None/NaN crudos: {distintas:,}")
+    print(f"fila por fila:   {t_escalar * 1000:8.1f} ms")
+    print(f"por columnas:    {t_vector * 1000:8.1f} ms   x{t_escalar / t_vector:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Latencia por request de la API Excel con y sin sesión de libro (workbook-session-id).
+
+El servidor local (scripts/graph_stub.py) cobra --open-cost-ms a cada request sin
+sesión, imitando a Excel Online abriendo el archivo; con sesión solo cobra --latency-ms.
+    python scripts/bench_workbook_session.py --rounds 20 --open-cost-ms 80 --latency-ms 5
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_stub import GraphStub
+import sharepoint_excel as se
+
+TABLE = "Historial"
+HEADERS = ["Id_UE", "Periodo PEI", "Estado", "IdRegistro", "LastUpdated"]
+
+
+def ronda(token: str, n: int) -> int:
+    """Lecturas y escrituras típicas de un especialista. Devuelve cuántos requests hizo."""
+    site_id, item_id = "site-id", "item-id"
+    se._excel_get_table_header_names(token, site_id, item_id, TABLE)
+    se.read_table_from_sharepoint_as_df_with_ids(token, site_id, item_id, TABLE)
+    added = se._excel_table_add_row(token, site_id, item_id, TABLE, [str(n), "2025-2027", "En proceso", f"id{n}", ""])
+    row = se._excel_table_get_row(token, site_id, item_id, TABLE, added["index"])
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{TABLE}/rows/itemAt(index={added['index']})/range"
+    se._workbook_request("PATCH", url, token, site_id, item_id, json={"values": [row[:2] + ["Emitido"] + row[3:]]})
+    return 5
+
+
+def medir(stub: GraphStub, sesiones: bool, rounds: int) -> tuple[float, int, int]:
+    se.enable_workbook_sessions(sesiones)
+    stub.reset_counters()
+    reqs = 0
+    t0 = time.perf_counter()
+    for n in range(rounds):
+        reqs += ronda("token-local", n)
+    dt = time.perf_counter() - t0
+    se.close_workbook_sessions("token-local")
+    return dt * 1000 / reqs, reqs, stub.counters["sessions_created"]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=20)
+    ap.add_argument("--open-cost-ms", type=float, default=80.0)
+    ap.add_argument("--latency-ms", type=float, default=5.0)
+    args = ap.parse_args()
+
+    stub = GraphStub(
+        tables={TABLE: {"headers": HEADERS, "rows": []}},
+        latency_s=args.latency_ms / 1000,
+        open_cost_s=args.open_cost_ms / 1000,
+    ).start()
+    se.set_graph_client(se.GraphClient(base_url=stub.base_url))
+    try:
+        for nombre, sesiones in (("sin sesión", False), ("con sesión", True)):
+            ms, reqs, creadas = medir(stub, sesiones, args.rounds)
+            print(f"{nombre}: {reqs} requests de tabla, {ms:.1f} ms/request, sesiones creadas={creadas}")
+    finally:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""
+Importación/exportación masiva del historial en streaming (memoria acotada).
+
+    # valida un .xlsx/.csv sin escribir (rechazos con su motivo en rechazos.csv)
+    python scripts/bulk_historial.py import data/historial_it_pei.xlsx --sheet Hoja1 --rejects rechazos.csv
+    # lo agrega a la tabla del backend configurado (SharePoint, libros locales o SQL)
+    python scripts/bulk_historial.py import nuevos.csv --apply
+    # descarga la tabla a .xlsx o .csv por ventanas de filas
+    python scripts/bulk_historial.py export historial.csv
+
+- Lectura con openpyxl read_only (o csv) y escritura con write_only: nunca se arma el
+  libro completo en memoria; las filas viajan en bloques de --chunk.
+- Los headers del archivo pueden ser los del Excel ("Fecha de recepción") o las claves
+  del app ("fecha_recepcion"): se traducen con el mismo alias que append_row_to_sharepoint_excel
+  (norm_key + APPKEY_TO_EXCELNORM).
+- Las filas se validan por bloque con validators.validar_dataframe (las mismas reglas que
+  validar_formulario, con las celdas vacías como ""); las inválidas no se envían.
+- Backend: --secrets (TOML con [sharepoint], como la app) o --local-dir (libros .xlsx locales).
+
+Con --apply, antes de escribir se comparan las columnas del archivo (y IdRegistro,
+LastUpdated, UpdatedBy) con las de la tabla destino: si alguna no existe se aborta sin
+escribir nada, en vez de perder esa columna en todas las filas.
+
+Al final se informa filas/s y el pico de memoria (RSS) del proceso. Medido en este entorno
+con data/historial_it_pei.xlsx!Hoja1 (3.481 filas, 38 columnas; el RSS incluye ~130 MB de
+importar pandas/openpyxl):
+    import --sheet Hoja1 (dry run: lectura + alias + validación)                ~3.100 filas/s   pico RSS 146 MB
+    export a .csv  (--local-dir .)                                              ~3.600 filas/s   pico RSS 140 MB
+    export a .xlsx (--local-dir .)                                              ~1.500 filas/s   pico RSS 140 MB
+    import --apply a una copia local de data/ (--chunk 5000: una edición del libro,
+      todas las columnas con su valor)                                            ~550 filas/s    pico RSS 265 MB
+"""
+import argparse
+import csv
+import os
+import resource
+import sys
+import time
+import tomllib
+from datetime import date, datetime
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from sharepoint_excel import (
+    APPKEY_TO_EXCELNORM,
+    TableSchema,
+    norm_key,
+)
+from adapters.historial_sharepoint import EXCEL_NORM_TO_APP
+from storage_backends import LocalWorkbookBackend, get_backend
+from validators import validar_dataframe
+
+DEFAULT_CHUNK = 500
+AUDITORIA = ("idregistro", "lastupdated", "updatedby")     # columnas que completa el import
+
+
+# -----------------------------
+# Lectura en streaming
+# -----------------------------
+def _celda(v):
+    # mismo formato que guarda la app (date.isoformat)
+    if isinstance(v, datetime):
+        return v.date().isoformat() if v.time() == datetime.min.time() else v.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(v, date):
+        return v.isoformat()
+    return "" if v is None else v
+
+
+def _abrir(path: str, sheet: str | None):
+    if path.lower().endswith(".csv"):
+        f = open(path, newline="", encoding="utf-8-sig")
+        return csv.reader(f), f.close
+    wb = load_workbook(path, read_only=True, data_only=True)
+    return (wb[sheet] if sheet else wb.worksheets[0]).iter_rows(values_only=True), wb.close
+
+
+def _claves(headers) -> list[str | None]:
+    # header del archivo -> header normalizado del Excel (None = columna sin nombre)
+    keys = []
+    for h in headers:
+        hn = norm_key("" if h is None else h)
+        keys.append(APPKEY_TO_EXCELNORM.get(hn, hn) if hn else None)
+    return keys
+
+
+def claves_archivo(path: str, sheet: str | None = None) -> list[str]:
+    """Headers normalizados (alias aplicado) que trae el archivo."""
+    rows, close = _abrir(path, sheet)
+    try:
+        return [k for k in _claves(next(rows, None) or ()) if k]
+    finally:
+        close()
+
+
+def iter_filas(path: str, sheet: str | None = None):
+    """
+    (número de fila en el archivo, {header_normalizado_excel: valor}) con el alias del app
+    aplicado. Las filas vacías se saltan pero cuentan para la numeración (la del Excel/CSV).
+    """
+    rows, close = _abrir(path, sheet)
+    try:
+        keys = _claves(next(rows, None) or ())
+        for linea, row in enumerate(rows, start=2):
+            if row is None or all(v is None or v == "" for v in row):
+                continue
+            yield linea, {k: _celda(v) for k, v in zip(keys, row) if k}
+    finally:
+        close()
+
+
+def validar_bloque(filas_norm: list[dict], lineas: list[int]) -> dict[int, list[str]]:
+    """Errores por línea del archivo (solo las inválidas), validando el bloque por columnas."""
+    datos = pd.DataFrame(
+        [{EXCEL_NORM_TO_APP.get(k, k): v for k, v in f.items()} for f in filas_norm],
+        index=lineas,
+    )
+    reporte = validar_dataframe(datos)
+    errores = {}
+    for linea, error in zip(reporte["fila"], reporte["error"]):
+        errores.setdefault(int(linea), []).append(error)
+    return errores
+
+
+# -----------------------------
+# Escritura en streaming
+# -----------------------------
+class Salida:
+    """Escribe filas a .xlsx (write_only) o .csv a medida que llegan."""
+
+    def __init__(self, path: str, headers: list[str]):
+        self.path = path
+        if path.lower().endswith(".csv"):
+            self._f = open(path, "w", newline="", encoding="utf-8")
+            self._w = csv.writer(self._f)
+            self._wb = None
+        else:
+            self._wb = Workbook(write_only=True)
+            self._w = self._wb.create_sheet("Historial")
+        self._w.writerow(headers) if self._wb is None else self._w.append(headers)
+
+    def write(self, row) -> None:
+        if self._wb is None:
+            self._w.writerow(row)
+        else:
+            self._w.append(list(row))
+
+    def close(self) -> None:
+        if self._wb is None:
+            self._f.close()
+        else:
+            self._wb.save(self.path)
+
+
+# -----------------------------
+# Comandos
+# -----------------------------
+def cargar_backend(args):
+    if args.local_dir:
+        return LocalWorkbookBackend(base_dir=args.local_dir)
+    with open(args.secrets, "rb") as f:
+        return get_backend(tomllib.load(f))
+
+
+def columnas_sin_destino(backend, table_name_key: str, claves: list[str]) -> list[str]:
+    """Claves del archivo (más las de auditoría que agrega el import) que la tabla destino no tiene."""
+    destino = next(backend.iter_table(table_name_key, 1))
+    schema = TableSchema.from_headers([str(c) for c in destino.columns])
+    return [k for k in dict.fromkeys([*claves, *AUDITORIA]) if schema.col(k) is None]
+
+
+def importar(args) -> int:
+    backend = cargar_backend(args) if args.apply else None
+    if backend is not None:
+        # sin esto, append_rows descartaría (o rechazaría) columnas enteras a mitad de carga
+        faltan = columnas_sin_destino(backend, args.table, claves_archivo(args.file, args.sheet))
+        if faltan:
+            raise SystemExit(
+                f"La tabla destino ({args.table}) no tiene columnas para: {', '.join(faltan)}. "
+                "Agrega esas columnas o quítalas del archivo; no se escribió nada."
+            )
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    rechazos = Salida(args.rejects, ["fila", "errores"]) if args.rejects else None
+
+    leidas = validas = enviadas = 0
+    bloque, lineas = [], []
+
+    def procesar():
+        nonlocal validas, enviadas
+        errores = validar_bloque(bloque, lineas)
+        buenas = []
+        for linea, fila in zip(lineas, bloque):
+            if linea in errores:
+                if rechazos:
+                    rechazos.write([linea, " | ".join(errores[linea])])
+                continue
+            if not str(fila.get("idregistro", "")).strip():
+                fila["idregistro"] = str(uuid4())
+            fila.setdefault("lastupdated", now)
+            fila.setdefault("updatedby", "bulk_import")
+            buenas.append(fila)
+        validas += len(buenas)
+        if buenas and backend is not None:
+            backend.append_rows(buenas, args.table)
+            enviadas += len(buenas)
+
+    try:
+        for linea, fila in iter_filas(args.file, args.sheet):
+            leidas += 1
+            bloque.append(fila)
+            lineas.append(linea)
+            if len(bloque) >= args.chunk:
+                procesar()
+                bloque, lineas = [], []
+        if bloque:
+            procesar()
+    finally:
+        if rechazos:
+            rechazos.close()
+
+    print(f"Leídas: {leidas} | Válidas: {validas} | Rechazadas: {leidas - validas} | Enviadas: {enviadas}")
+    if not args.apply:
+        print("Modo: DRY RUN (no escribe; usa --apply)")
+    return leidas
+
+
+def exportar(args) -> int:
+    # todos los backends entregan la tabla por ventanas (ReadFallbackBackend: la del principal)
+    salida, total = None, 0
+    try:
+        for df in cargar_backend(args).iter_table(args.table, args.chunk):
+            if salida is None:
+                salida = Salida(args.file, [str(c) for c in df.columns])
+            for row in df.itertuples(index=False, name=None):
+                salida.write(row)
+            total += len(df)
+    finally:
+        if salida is not None:
+            salida.close()
+    print(f"Exportadas: {total} filas -> {args.file}")
+    return total
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--secrets", default="secrets.local.toml")
+    ap.add_argument("--local-dir", default=None, help="usar libros .xlsx locales (rutas de DEFAULT_LOCAL_TABLES)")
+    ap.add_argument("--table", default="table_name_hist")
+    ap.add_argument("--chunk", type=int, default=DEFAULT_CHUNK)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    i = sub.add_parser("import", help=".xlsx/.csv -> tabla (valida cada fila)")
+    i.add_argument("file")
+    i.add_argument("--sheet", default=None)
+    i.add_argument("--rejects", default=None, help="CSV/.xlsx con las filas rechazadas y el motivo")
+    i.add_argument("--apply", action="store_true")
+
+    e = sub.add_parser("export", help="tabla -> .xlsx/.csv")
+    e.add_argument("file")
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    n = importar(args) if args.cmd == "import" else exportar(args)
+    dt = time.perf_counter() - t0
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{n} filas en {dt:.2f} s ({n / dt if dt else 0:,.0f} filas/s) | pico RSS {rss_mb:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
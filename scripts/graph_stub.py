@@ -0,0 +1,276 @@
+"""
+Servidor local que imita (lo mínimo necesario) la API Excel de Microsoft Graph.
+
+Sirve para medir el cliente sin red: cuenta conexiones TCP y requests, y puede
+simular latencia por request. Mantiene un libro en memoria con tablas
+{nombre: {"headers": [...], "rows": [[...], ...]}}.
+
+Uso:
+    stub = GraphStub(tables={"Historial": {"headers": [...], "rows": [...]}})
+    stub.start()
+    client = GraphClient(base_url=stub.base_url)
+    ...
+    stub.stop()
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+def _col_to_num(col: str) -> int:
+    n = 0
+    for ch in col:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+
+def _num_to_col(n: int) -> str:
+    col = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        col = chr(65 + rem) + col
+    return col
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stub._count("connections")
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        return json.loads(raw) if raw else None
+
+    def _send(self, status: int, payload=None, headers: dict | None = None):
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method: str):
+        stub = self.server.stub
+        stub._count("requests")
+        body = self._body()
+        status, payload, headers = stub.dispatch(method, self.path, body, dict(self.headers))
+        self._send(status, payload, headers)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+
+class GraphStub:
+    def __init__(
+        self,
+        tables: dict | None = None,
+        latency_s: float = 0.0,
+        throttle_every: int = 0,
+        open_cost_s: float = 0.0,
+        session_ttl_s: float = 300.0,
+    ):
+        self.tables = tables or {}
+        self.latency_s = latency_s
+        self.open_cost_s = open_cost_s          # costo extra de abrir el libro en requests sin sesión
+        self.session_ttl_s = session_ttl_s
+        self.sessions: dict[str, float] = {}    # session id -> expira en (monotonic)
+        self.throttle_every = throttle_every   # responde 429 a 1 de cada N escrituras (0 = nunca)
+        self._writes = 0
+        self.counters = {"connections": 0, "requests": 0, "sessions_created": 0}
+        self.lock = threading.Lock()
+        self.etag_version = 1
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/v1.0"
+
+    def start(self) -> "GraphStub":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self) -> None:
+        with self.lock:
+            self.counters = {k: 0 for k in self.counters}
+
+    def _count(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def _touch(self) -> None:
+        self.etag_version += 1
+
+    # -----------------------------
+    # Rutas
+    # -----------------------------
+    def dispatch(self, method: str, raw_path: str, body, headers: dict):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+        path = unquote(urlparse(raw_path).path)
+        path = path.split("/v1.0", 1)[-1]
+
+        if path == "/$batch" and method == "POST":
+            return 200, {"responses": self._batch(body.get("requests", []))}, None
+
+        if method in ("POST", "PATCH") and self.throttle_every:
+            with self.lock:
+                self._writes += 1
+                if self._writes % self.throttle_every == 0:
+                    return 429, {"error": {"code": "TooManyRequests", "message": "throttled"}}, {"Retry-After": "0"}
+
+        if "/workbook" in path:
+            session_route = self._session_route(method, path, headers)
+            if session_route is not None:
+                return session_route
+
+        m = re.search(r"/workbook/worksheets/([^/]+)/range\(address='([A-Z]+)(\d+):([A-Z]+)(\d+)'\)$", path)
+        if m and method == "GET":
+            with self.lock:
+                return self._sheet_range(m.group(1), m.groups()[1:])
+
+        m = re.search(r"/workbook/tables/([^/]+)(/.*)?$", path)
+        if m:
+            with self.lock:
+                return self._table_route(method, m.group(1), m.group(2) or "", body)
+
+        if re.match(r"^/sites/[^/]+:", path):
+            return 200, {"id": "site-id"}, None
+
+        if re.search(r"/drive/(root:|items/)", path):
+            return 200, {"id": "item-id", "eTag": f'"v{self.etag_version}"', "cTag": f'"c{self.etag_version}"'}, None
+
+        return 404, {"error": {"code": "itemNotFound", "message": path}}, None
+
+    def _session_route(self, method: str, path: str, headers: dict):
+        # createSession / refreshSession / closeSession y costo de "abrir" el libro
+        now = time.monotonic()
+        sid = next((v for k, v in headers.items() if k.lower() == "workbook-session-id"), None)
+
+        if method == "POST" and path.endswith("/workbook/createSession"):
+            if self.open_cost_s:
+                time.sleep(self.open_cost_s)
+            with self.lock:
+                self.counters["sessions_created"] += 1
+                new_id = f"s{self.counters['sessions_created']}"
+                self.sessions[new_id] = now + self.session_ttl_s
+            return 201, {"id": new_id, "persistChanges": True}, None
+
+        if sid is not None:
+            with self.lock:
+                alive = self.sessions.get(sid, 0) > now
+                if alive:
+                    self.sessions[sid] = now + self.session_ttl_s
+                elif sid in self.sessions:
+                    del self.sessions[sid]
+            if not alive:
+                return 404, {"error": {"code": "InvalidSessionReCreatable", "message": "session expired"}}, None
+            if path.endswith("/workbook/refreshSession"):
+                return 204, None, None
+            if path.endswith("/workbook/closeSession"):
+                with self.lock:
+                    self.sessions.pop(sid, None)
+                return 204, None, None
+            return None
+
+        if self.open_cost_s:
+            time.sleep(self.open_cost_s)
+        return None
+
+    def _sheet_range(self, sheet: str, bounds):
+        # Las tablas del stub empiezan en A1 de su hoja (headers en la fila 1)
+        t = next((t for t in self.tables.values() if t.get("sheet", "Hoja1") == sheet), None)
+        if t is None:
+            return 404, {"error": {"code": "ItemNotFound", "message": sheet}}, None
+        c1, r1, c2, r2 = _col_to_num(bounds[0]), int(bounds[1]), _col_to_num(bounds[2]), int(bounds[3])
+        grid = [list(t["headers"])] + [list(r) for r in t["rows"]]
+        values = []
+        for r in range(r1, r2 + 1):
+            row = grid[r - 1] if r - 1 < len(grid) else []
+            values.append([row[c - 1] if c - 1 < len(row) else "" for c in range(c1, c2 + 1)])
+        return 200, {"values": values}, None
+
+    def _batch(self, reqs: list) -> list:
+        # Ejecuta en orden; si falla una dependencia responde 424 (como Graph)
+        status_by_id, out = {}, []
+        for req in reqs:
+            deps = req.get("dependsOn") or []
+            if any(not 200 <= status_by_id.get(d, 0) < 300 for d in deps):
+                status, payload, headers = 424, {"error": {"code": "FailedDependency", "message": "dependsOn"}}, None
+            else:
+                status, payload, headers = self.dispatch(req["method"], req["url"], req.get("body"), req.get("headers") or {})
+            status_by_id[req["id"]] = status
+            out.append({"id": req["id"], "status": status, "headers": headers or {}, "body": payload})
+        return out
+
+    def _table_route(self, method: str, table_name: str, rest: str, body):
+        t = self.tables.get(table_name)
+        if t is None:
+            return 404, {"error": {"code": "ItemNotFound", "message": table_name}}, None
+
+        headers, rows = t["headers"], t["rows"]
+
+        if method == "GET" and rest == "/columns":
+            return 200, {"value": [{"name": h} for h in headers]}, None
+
+        if method == "GET" and rest == "/range":
+            address = f"{t.get('sheet', 'Hoja1')}!A1:{_num_to_col(len(headers))}{len(rows) + 1}"
+            values = [list(headers)] + [list(r) for r in rows]
+            return 200, {"address": address, "rowCount": len(rows) + 1, "values": values}, None
+
+        if method == "POST" and rest == "/rows/add":
+            first = len(rows)
+            rows.extend(list(v) for v in body.get("values", []))
+            self._touch()
+            return 201, {"index": first, "values": body.get("values", [])}, None
+
+        m = re.match(r"^/columns/([^/]+)/dataBodyRange$", rest)
+        if m and method == "GET":
+            if m.group(1) not in headers:
+                return 404, {"error": {"code": "ItemNotFound", "message": m.group(1)}}, None
+            c = headers.index(m.group(1))
+            return 200, {"values": [[r[c] if c < len(r) else ""] for r in rows]}, None
+
+        m = re.match(r"^/rows/itemAt\(index=(\d+)\)/range$", rest)
+        if m:
+            i = int(m.group(1))
+            if i >= len(rows):
+                return 400, {"error": {"code": "InvalidArgument", "message": "index"}}, None
+            if method == "PATCH":
+                # como Graph: null en values deja la celda sin cambio
+                old = rows[i]
+                rows[i] = [old[c] if v is None and c < len(old) else v for c, v in enumerate(body["values"][0])]
+                self._touch()
+            return 200, {"values": [list(rows[i])]}, None
+
+        return 404, {"error": {"code": "ItemNotFound", "message": rest}}, None
@@ -1,9 +1,45 @@
+"""
+Completa IdRegistro (y LastUpdated/UpdatedBy) en las filas de la tabla que no lo tienen.
+
+Es un trabajo reanudable:
+- solo se lee la columna IdRegistro (no la tabla entera);
+- cada UUID asignado se anota en un checkpoint local (JSON lines, con fsync) ANTES de
+  escribirlo; si el proceso se corta, al volver a correr se reutiliza el mismo UUID para
+  esa fila y se reconocen como propias las filas que ya lo tienen;
+- las escrituras son PATCH parciales (solo esas 3 celdas; null = no tocar) en $batch,
+  repartidas en varios hilos que comparten un AdaptiveThrottle (429/Retry-After);
+- al final se vuelven a leer solo las filas tocadas para verificar el UUID.
+
+Los índices de fila se toman de la lectura inicial: conviene correrlo sin ediciones
+simultáneas en la tabla (las filas que no verifiquen se informan y se reintentan al
+volver a correrlo).
+"""
+import json
+import os
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
-import requests
-import msal
 import tomllib
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharepoint_excel import (
+    _graph_get_token,
+    _graph_get_site_id,
+    _graph_get_drive_item_id,
+    _excel_table_get_column_values,
+    get_graph_client,
+    AdaptiveThrottle,
+    patch_table_rows_by_index,
+    get_table_rows_by_index,
+)
+
+WORKERS = 4             # hilos con $batch en vuelo a la vez
+ROWS_PER_TASK = 100     # filas por tarea (graph_batch las manda de a 20)
+CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache")
+
 # -----------------------------
 # Helpers Graph auth + ids
 # -----------------------------
@@ -11,72 +47,80 @@ def norm_str(x):
     return "" if x is None else str(x).strip()
 
 def graph_get_token(sp: dict) -> str:
-    authority = f"https://login.microsoftonline.com/{sp['tenant_id']}"
-    app = msal.ConfidentialClientApplication(
-        client_id=sp["client_id"],
-        authority=authority,
-        client_credential=sp["client_secret"],
-    )
-    result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
-    if "access_token" not in result:
-        raise RuntimeError(f"No se pudo obtener token Graph: {result}")
-    return result["access_token"]
+    return _graph_get_token(sp)
 
 def graph_get_site_id(token: str, site_hostname: str, site_path: str) -> str:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_hostname}:{site_path}"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
-    return r.json()["id"]
+    return _graph_get_site_id(token, site_hostname, site_path)
 
 def graph_get_drive_item_id_by_path(token: str, site_id: str, file_path: str) -> str:
     # /drive/root:{path}
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{file_path}"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
-    return r.json()["id"]
+    return _graph_get_drive_item_id(token, site_id, file_path)
 
 # -----------------------------
 # Excel table helpers
 # -----------------------------
 def excel_table_get_headers(token: str, site_id: str, item_id: str, table_name: str) -> list[str]:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/columns"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/columns?$select=name"
+    r = get_graph_client().get(url, token)
     cols = r.json().get("value", [])
     # Cada item tiene "name"
     return [c.get("name", "") for c in cols]
 
-def excel_table_get_all_values(token: str, site_id: str, item_id: str, table_name: str) -> list[list]:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/range"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
-    return r.json().get("values", [])
-
-def excel_table_patch_row_full(token: str, site_id: str, item_id: str, table_name: str, row_index_0: int, row_values: list):
-    # Actualiza toda la fila (dentro de la tabla) por índice 0-based
-    url = (
-        f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}"
-        f"/workbook/tables/{table_name}/rows/itemAt(index={row_index_0})/range"
-    )
-    r = requests.patch(
-        url,
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        json={"values": [row_values]},
-        timeout=60
-    )
-    r.raise_for_status()
+# -----------------------------
+# Checkpoint
+# -----------------------------
+class Checkpoint:
+    """
+    Registro local de la migración, una línea JSON por evento:
+        {"index": 12, "id": "<uuid>", "state": "planned" | "written" | "verified"}
+    Se relee completo al arrancar (gana el último estado de cada fila).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows: dict[int, dict] = {}
+        self._lock = threading.Lock()     # lo usan los hilos de escritura y verificación
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue     # última línea a medio escribir
+                    self.rows[int(e["index"])] = e
+
+    def record(self, entries: list[dict]) -> None:
+        if not entries:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for e in entries:
+                    f.write(json.dumps(e) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            for e in entries:
+                self.rows[int(e["index"])] = e
+
+def checkpoint_path(item_id: str, table_name: str) -> str:
+    return os.path.join(CHECKPOINT_DIR, f"migrate_idregistro-{item_id}-{table_name}.jsonl")
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
 
 # -----------------------------
 # Migración
 # -----------------------------
-def migrate_fill_idregistro(sp: dict, secrets_path: str, dry_run: bool = True, sleep_s: float = 0.15):
+def migrate_fill_idregistro(sp: dict, secrets_path: str, dry_run: bool = True, workers: int = WORKERS):
+    t0 = time.perf_counter()
     token = graph_get_token(sp)
     site_id = graph_get_site_id(token, sp["site_hostname"], sp["site_path"])
     item_id = graph_get_drive_item_id_by_path(token, site_id, sp["file_path"])
     table_name = sp["table_name"]
 
-    headers = excel_table_get_headers(token, site_id, item_id, table_name)
-    headers = [norm_str(h) for h in headers]
+    raw_headers = excel_table_get_headers(token, site_id, item_id, table_name)
+    headers = [norm_str(h) for h in raw_headers]
     header_to_idx = {h: i for i, h in enumerate(headers)}
 
     # Validación columnas
@@ -87,52 +131,95 @@ def migrate_fill_idregistro(sp: dict, secrets_path: str, dry_run: bool = True, s
     lastupdated_col = header_to_idx.get("LastUpdated")
     updatedby_col = header_to_idx.get("UpdatedBy")
 
-    values = excel_table_get_all_values(token, site_id, item_id, table_name)
-
-    total = len(values)
-    to_update = []
-
-    for i, row in enumerate(values):
-        # Asegura largo
-        row = list(row)
-        if len(row) < len(headers):
-            row += [""] * (len(headers) - len(row))
-
-        if norm_str(row[id_col]) == "":
-            to_update.append(i)
-
-    print(f"Total filas en tabla: {total}")
-    print(f"Filas sin IdRegistro: {len(to_update)}")
+    # Solo la columna IdRegistro (índices = filas de datos de itemAt(index))
+    ids = [norm_str(v) for v in _excel_table_get_column_values(token, site_id, item_id, table_name, raw_headers[id_col])]
+    ckpt = Checkpoint(checkpoint_path(item_id, table_name))
+
+    # Filas sin IdRegistro: UUID nuevo o el ya planificado en una corrida anterior.
+    # Filas que ya tienen el UUID del checkpoint pero no se verificaron: solo verificar.
+    # Si el UUID planificado ya está en otra fila (se corrieron los índices entre corridas),
+    # esa fila queda verificada y la vacía recibe uno nuevo: nunca se repite un IdRegistro.
+    present = {rid: j for j, rid in enumerate(ids) if rid}
+    to_write, to_verify, moved = {}, [], {}
+    for i, current in enumerate(ids):
+        prev = ckpt.rows.get(i)
+        if current == "":
+            if prev and prev["state"] != "verified" and prev["id"] not in present:
+                to_write[i] = prev["id"]
+            else:
+                if prev and prev["id"] in present:
+                    moved[present[prev["id"]]] = prev["id"]
+                to_write[i] = str(uuid4())
+        elif prev and prev["id"] == current and prev["state"] != "verified":
+            to_verify.append(i)
+    to_verify = [i for i in to_verify if i not in moved]
+
+    reused = sum(1 for i, rid in to_write.items() if ckpt.rows.get(i, {}).get("id") == rid)
+    print(f"Total filas en tabla: {len(ids)}")
+    print(f"Filas sin IdRegistro: {len(to_write)} (UUID retomado del checkpoint: {reused})")
+    print(f"Filas ya escritas pendientes de verificar: {len(to_verify)}")
+    print(f"UUID del checkpoint hallados en otra fila: {len(moved)}")
+    print(f"Checkpoint: {ckpt.path}")
     print(f"Modo: {'DRY RUN (no escribe)' if dry_run else 'WRITE (escribe cambios)'}")
 
-    updated = 0
-    for idx in to_update:
-        row = list(values[idx])
-        if len(row) < len(headers):
-            row += [""] * (len(headers) - len(row))
+    if dry_run:
+        for i, rid in list(to_write.items())[:20]:
+            print(f"[DRY] row={i} set IdRegistro={rid}")
+        if len(to_write) > 20:
+            print(f"[DRY] ... y {len(to_write) - 20} filas más")
+        return
 
-        new_id = str(uuid4())
-        row[id_col] = new_id
+    # 1) Planificar (antes de escribir: si se corta, el UUID de cada fila ya quedó anotado)
+    ckpt.record([{"index": j, "id": rid, "state": "verified"} for j, rid in sorted(moved.items())])
+    ckpt.record([{"index": i, "id": rid, "state": "planned"} for i, rid in to_write.items()])
 
-        if lastupdated_col is not None:
-            row[lastupdated_col] = time.strftime("%Y-%m-%d %H:%M:%S")
+    # 2) PATCH parciales en paralelo, con la pausa compartida
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    throttle = AdaptiveThrottle()
 
+    def partial_row(rid: str) -> list:
+        row = [None] * len(headers)
+        row[id_col] = rid
+        if lastupdated_col is not None:
+            row[lastupdated_col] = now
         if updatedby_col is not None:
             row[updatedby_col] = "migration_script"
-
-        if dry_run:
-            print(f"[DRY] row={idx} set IdRegistro={new_id}")
-        else:
-            excel_table_patch_row_full(token, site_id, item_id, table_name, idx, row)
-            updated += 1
-            if updated % 20 == 0:
-                print(f"Actualizadas {updated}/{len(to_update)} filas...")
-
-            time.sleep(sleep_s)  # evita throttling
+        return row
+
+    def write(indexes: list[int]) -> list[tuple[int, object]]:
+        results = patch_table_rows_by_index(
+            token, site_id, item_id, table_name, {i: partial_row(to_write[i]) for i in indexes}, throttle=throttle
+        )
+        ckpt.record([{"index": i, "id": to_write[i], "state": "written"} for i, res in results.items() if res.ok])
+        return [(i, res) for i, res in results.items() if not res.ok]
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migrate") as pool:
+        for errs in pool.map(write, _chunks(sorted(to_write), ROWS_PER_TASK)):
+            for i, res in errs:
+                failed.append(i)
+                print(f"[ERROR] row={i} status={res.status} {res.error}")
+
+    # 3) Verificación: se releen solo las filas tocadas
+    expected = {i: to_write[i] for i in to_write if i not in failed}
+    expected.update({i: ckpt.rows[i]["id"] for i in to_verify})
+
+    def verify(indexes: list[int]) -> list[int]:
+        rows = get_table_rows_by_index(token, site_id, item_id, table_name, indexes, throttle=throttle)
+        ok = {i for i in indexes if id_col < len(rows.get(i, ())) and norm_str(rows[i][id_col]) == expected[i]}
+        ckpt.record([{"index": i, "id": expected[i], "state": "verified"} for i in sorted(ok)])
+        return [i for i in indexes if i not in ok]
+
+    mismatched = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migrate-verify") as pool:
+        for bad in pool.map(verify, _chunks(sorted(expected), ROWS_PER_TASK)):
+            mismatched += bad
 
     print("FIN.")
-    if not dry_run:
-        print(f"Filas actualizadas: {updated}")
+    print(f"Filas escritas: {len(to_write) - len(failed)} | verificadas: {len(expected) - len(mismatched)}")
+    if failed or mismatched:
+        print(f"Filas con error: {len(failed)} | sin verificar: {len(mismatched)} (vuelve a ejecutar para reintentarlas)")
+    print(f"Tiempo: {time.perf_counter() - t0:.1f} s")
 
 def load_secrets(path: str) -> dict:
     with open(path, "rb") as f:
@@ -149,5 +236,5 @@ if __name__ == "__main__":
     # 1) Primero ejecuta en DRY RUN
     migrate_fill_idregistro(sp, secrets_file, dry_run=True)
 
-    # 2) Si el DRY RUN se ve bien, cambia a False:
+    # 2) Si el DRY RUN se ve bien, cambia a False (se puede cortar y volver a correr):
     # migrate_fill_idregistro(sp, secrets_file, dry_run=False)
@@ -0,0 +1,146 @@
+"""
+Carga inicial del backend SQL desde Excel y réplica (en un solo sentido) SQL -> Excel.
+
+    # crea las tablas SQL y las llena con lo que hay hoy en SharePoint (o en data/*.xlsx)
+    python scripts/sync_sql_sharepoint.py bootstrap --source sharepoint
+    # muestra qué se replicaría; con --apply escribe; con --loop 300 repite cada 5 min
+    python scripts/sync_sql_sharepoint.py sync --apply --loop 300
+
+La réplica compara por IdRegistro y LastUpdated (solo lee esas dos columnas del Excel):
+- filas del SQL que no están en Excel -> rows/add en lotes;
+- filas con LastUpdated distinto -> PATCH en $batch con la fila completa del SQL;
+- filas que solo están en Excel o sin IdRegistro en el SQL se informan, no se tocan.
+
+Lee la configuración de secrets.local.toml ([sharepoint] con sql_url y, opcional, sql_tables).
+"""
+import argparse
+import os
+import sys
+import time
+import tomllib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharepoint_excel import (
+    norm_key,
+    resolve_graph_context,
+    read_table_columns_as_df,
+    append_rows_to_sharepoint_excel,
+    update_rows_in_table_by_idregistro,
+    _same_last_updated,
+)
+from sql_backend import SqlBackend
+from storage_backends import LocalWorkbookBackend, SharePointBackend
+
+APPEND_CHUNK = 200
+
+
+def load_secrets(path: str) -> dict:
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    if "sharepoint" not in data:
+        raise RuntimeError("El archivo secrets no tiene bloque [sharepoint].")
+    if not data["sharepoint"].get("sql_url"):
+        raise RuntimeError("Falta sql_url en el bloque [sharepoint].")
+    return data
+
+
+def sql_store(secrets: dict) -> SqlBackend:
+    sp = secrets["sharepoint"]
+    return SqlBackend(sp["sql_url"], dict(sp["sql_tables"]) if sp.get("sql_tables") else None)
+
+
+def bootstrap(secrets: dict, source: str, table_keys: list[str]) -> None:
+    sp = secrets["sharepoint"]
+    if source == "local":
+        src = LocalWorkbookBackend(dict(sp["local_tables"]) if sp.get("local_tables") else None)
+    else:
+        src = SharePointBackend(secrets)
+    store = sql_store(secrets)
+    for key in table_keys:
+        t0 = time.perf_counter()
+        df = src.read_table(key)
+        n = store.load_dataframe(key, df, replace=True)
+        print(f"{key}: {n} filas, {len(df.columns)} columnas ({time.perf_counter() - t0:.1f} s)")
+
+
+def sync(secrets: dict, table_key: str, apply: bool) -> None:
+    sp = secrets["sharepoint"]
+    table_name = sp.get(table_key)
+    if not table_name:
+        raise RuntimeError(f"Falta secrets['sharepoint'].{table_key}")
+
+    sql_df = sql_store(secrets).read_table(table_key)
+    sql_df.columns = [norm_key(c) for c in sql_df.columns]   # headers del Excel -> claves normalizadas
+    if "idregistro" not in sql_df.columns:
+        raise RuntimeError("La tabla SQL no tiene columna 'idregistro'.")
+    con_lu = "lastupdated" in sql_df.columns
+
+    token, site_id, item_id = resolve_graph_context(sp)
+    excel = read_table_columns_as_df(token, site_id, item_id, table_name, columns=["idregistro", "lastupdated"])
+    excel.columns = [norm_key(c) for c in excel.columns]
+    if "idregistro" not in excel.columns:
+        raise RuntimeError("La tabla de Excel no tiene columna 'IdRegistro'.")
+    ids_excel = excel["idregistro"].astype(str).str.strip()
+    lu_excel = dict(zip(ids_excel, excel["lastupdated"])) if "lastupdated" in excel.columns else dict.fromkeys(ids_excel)
+
+    nuevas, cambiadas, sin_id = [], {}, 0
+    for row in sql_df.to_dict("records"):
+        rid = str(row["idregistro"]).strip()
+        if not rid:
+            sin_id += 1
+        elif rid not in lu_excel:
+            nuevas.append(row)
+        elif con_lu and lu_excel[rid] is not None and not _same_last_updated(lu_excel[rid], row["lastupdated"]):
+            cambiadas[rid] = {k: v for k, v in row.items() if k != "idregistro"}
+    solo_excel = len(set(lu_excel) - set(sql_df["idregistro"].astype(str).str.strip()) - {""})
+
+    print(f"SQL: {len(sql_df)} filas | Excel: {len(excel)} filas")
+    print(f"Nuevas: {len(nuevas)} | Cambiadas: {len(cambiadas)} | Sin IdRegistro en SQL: {sin_id} | Solo en Excel: {solo_excel}")
+    if not con_lu:
+        print("La tabla SQL no tiene LastUpdated: solo se replican filas nuevas.")
+    if not apply:
+        print("Modo: DRY RUN (no escribe; usa --apply)")
+        return
+
+    # claves ya normalizadas: sin alias (appkey_to_excelnorm={})
+    for i in range(0, len(nuevas), APPEND_CHUNK):
+        append_rows_to_sharepoint_excel(secrets, nuevas[i:i + APPEND_CHUNK], table_key, appkey_to_excelnorm={})
+    fallidas = []
+    if cambiadas:
+        results = update_rows_in_table_by_idregistro(secrets, cambiadas, appkey_to_excelnorm={}, table_name_key=table_key)
+        fallidas = [(rid, res) for rid, res in results.items() if not res.ok]
+    for rid, res in fallidas:
+        print(f"[ERROR] IdRegistro={rid} status={res.status} {res.error}")
+    print(f"Escritas: {len(nuevas)} nuevas, {len(cambiadas) - len(fallidas)} actualizadas")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--secrets", default="secrets.local.toml")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    b = sub.add_parser("bootstrap", help="crear y cargar las tablas SQL desde Excel")
+    b.add_argument("--source", choices=("sharepoint", "local"), default="sharepoint")
+    b.add_argument("--tables", default="table_name_hist,table_name_ue")
+
+    s = sub.add_parser("sync", help="replicar SQL -> tabla de Excel en SharePoint")
+    s.add_argument("--table", default="table_name_hist")
+    s.add_argument("--apply", action="store_true")
+    s.add_argument("--loop", type=float, default=0, help="repetir cada N segundos")
+    args = ap.parse_args()
+
+    secrets = load_secrets(args.secrets)
+    if args.cmd == "bootstrap":
+        bootstrap(secrets, args.source, [t.strip() for t in args.tables.split(",") if t.strip()])
+        return
+
+    while True:
+        sync(secrets, args.table, args.apply)
+        if not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
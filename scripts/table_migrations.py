@@ -0,0 +1,262 @@
+"""
+Migraciones/backfills de columnas sobre las tablas de Excel (SharePoint).
+
+Cada migración declara qué columnas lee, un predicado de fila y una transformación;
+el framework se encarga del resto:
+- lectura por ventanas de filas y solo de esas columnas (read_table_columns_as_df);
+- diff: solo se escriben las celdas que cambian (PATCH parcial; null = no tocar),
+  en $batch con AdaptiveThrottle;
+- dry run (default) con filas leídas/que cumplen/que cambian, celdas por columna,
+  ejemplos y tiempos;
+- registro local de migraciones aplicadas por libro y tabla (no se repiten sin --force).
+
+    python scripts/table_migrations.py list
+    python scripts/table_migrations.py run normalizar_codigo_ue            # dry run
+    python scripts/table_migrations.py run normalizar_codigo_ue --apply
+
+Las filas llegan como {header_normalizado: valor} (norm_key: "Id_UE" -> "id_ue") y la
+transformación devuelve {header_normalizado: valor_nuevo} con las celdas a escribir.
+Para completar IdRegistro en tablas grandes usa scripts/migrate_idregistro.py (reanudable).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import tomllib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+from uuid import uuid4
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sharepoint_excel import (
+    AdaptiveThrottle,
+    get_table_schema,
+    norm_key,
+    patch_table_rows_by_index,
+    read_table_columns_as_df,
+    resolve_graph_context,
+)
+from adapters.historial_sharepoint import normalizar_codigo_valor
+
+WINDOW_ROWS = 2000
+SAMPLES = 10
+APPLIED_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "applied_migrations.json")
+
+
+@dataclass(frozen=True)
+class Migration:
+    name: str
+    description: str
+    columns: tuple[str, ...]                 # headers normalizados que se leen
+    predicate: Callable[[dict], bool]
+    transform: Callable[[dict], dict]        # fila -> {header_normalizado: valor nuevo}
+    table_name_key: str = "table_name_hist"
+
+
+MIGRATIONS: dict[str, Migration] = {}
+
+
+def migration(name: str, description: str, columns: tuple[str, ...], where: Callable[[dict], bool], table_name_key="table_name_hist"):
+    """Registra la función decorada como transformación de la migración `name`."""
+    def deco(transform):
+        MIGRATIONS[name] = Migration(name, description, tuple(norm_key(c) for c in columns), where, transform, table_name_key)
+        return transform
+    return deco
+
+
+def _texto(v) -> str:
+    return "" if v is None else str(v).strip()
+
+
+# -----------------------------
+# Migraciones
+# -----------------------------
+@migration(
+    "fill_idregistro",
+    "IdRegistro (UUID), LastUpdated y UpdatedBy en las filas sin IdRegistro",
+    columns=("idregistro",),
+    where=lambda row: _texto(row.get("idregistro")) == "",
+)
+def _fill_idregistro(row: dict) -> dict:
+    return {"idregistro": str(uuid4()), "lastupdated": time.strftime("%Y-%m-%d %H:%M:%S"), "updatedby": "migration_script"}
+
+
+@migration(
+    "normalizar_codigo_ue",
+    "Id_UE como entero en texto (1314.0 / ' 1314 ' -> 1314)",
+    columns=("id_ue",),
+    where=lambda row: _texto(row.get("id_ue")) != "" and normalizar_codigo_valor(row["id_ue"]) != _texto(row["id_ue"]),
+)
+def _normalizar_codigo_ue(row: dict) -> dict:
+    return {"id_ue": normalizar_codigo_valor(row["id_ue"])}
+
+
+_FECHA_DMY = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4})$")
+_COLUMNAS_FECHA = ("fecha_de_recepcion", "fecha_de_derivacion", "fecha_de_i_t", "fecha_oficio")
+
+
+@migration(
+    "fechas_iso",
+    "Fechas escritas como texto dd/mm/yyyy -> yyyy-mm-dd (como las guarda la app)",
+    columns=_COLUMNAS_FECHA,
+    where=lambda row: any(_FECHA_DMY.match(_texto(row.get(c))) for c in _COLUMNAS_FECHA),
+)
+def _fechas_iso(row: dict) -> dict:
+    out = {}
+    for c in _COLUMNAS_FECHA:
+        m = _FECHA_DMY.match(_texto(row.get(c)))
+        if m:
+            d, mth, y = m.groups()
+            out[c] = f"{y}-{int(mth):02d}-{int(d):02d}"
+    return out
+
+
+# -----------------------------
+# Registro de migraciones aplicadas
+# -----------------------------
+def _load_applied() -> dict:
+    if not os.path.exists(APPLIED_PATH):
+        return {}
+    with open(APPLIED_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _record_applied(scope: str, name: str, info: dict) -> None:
+    data = _load_applied()
+    data.setdefault(scope, {})[name] = info
+    os.makedirs(os.path.dirname(APPLIED_PATH), exist_ok=True)
+    tmp = f"{APPLIED_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, APPLIED_PATH)
+
+
+# -----------------------------
+# Runner
+# -----------------------------
+def run_migration(secrets: dict, m: Migration, apply: bool = False, force: bool = False, window: int = WINDOW_ROWS) -> dict:
+    sp = secrets["sharepoint"]
+    table_name = sp.get(m.table_name_key)
+    if not table_name:
+        raise ValueError(f"Falta secrets['sharepoint'].{m.table_name_key}")
+
+    token, site_id, item_id = resolve_graph_context(sp)
+    scope = f"{item_id}/{table_name}"
+    applied = _load_applied().get(scope, {}).get(m.name)
+    if applied and apply and not force:
+        print(f"'{m.name}' ya se aplicó el {applied['applied_at']} ({applied['rows_changed']} filas). Usa --force para repetirla.")
+        return applied
+
+    schema = get_table_schema(token, site_id, item_id, table_name, force=True)
+    missing = [c for c in m.columns if schema.col(c) is None]
+    if missing:
+        raise ValueError(f"La tabla '{table_name}' no tiene las columnas: {', '.join(missing)}")
+
+    throttle = AdaptiveThrottle()
+    scanned = matched = changed_rows = 0
+    cells, samples, failed = Counter(), [], []
+    t_read = t_write = 0.0
+    t0 = time.perf_counter()
+
+    start = 0
+    while True:
+        t = time.perf_counter()
+        df = read_table_columns_as_df(token, site_id, item_id, table_name, list(m.columns), row_start=start, row_count=window)
+        t_read += time.perf_counter() - t
+        df.columns = [norm_key(c) for c in df.columns]
+
+        patches = {}
+        for idx, row in zip(df.index, df.to_dict("records")):
+            scanned += 1
+            if not m.predicate(row):
+                continue
+            matched += 1
+            changes = {}
+            for hn, new in m.transform(dict(row)).items():
+                hn = norm_key(hn)
+                col = schema.col(hn)
+                if col is None:
+                    raise ValueError(f"'{m.name}' escribe la columna '{hn}', que no está en la tabla.")
+                if hn in row and _texto(row[hn]) == _texto(new):
+                    continue
+                changes[col] = new
+                cells[hn] += 1
+            if not changes:
+                continue
+            changed_rows += 1
+            if len(samples) < SAMPLES:
+                samples.append((int(idx), {schema.headers_norm[c]: (row.get(schema.headers_norm[c]), v) for c, v in changes.items()}))
+            patch = [None] * len(schema.headers)
+            for col, v in changes.items():
+                patch[col] = v
+            patches[int(idx)] = patch
+
+        if apply and patches:
+            t = time.perf_counter()
+            results = patch_table_rows_by_index(token, site_id, item_id, table_name, patches, throttle=throttle)
+            t_write += time.perf_counter() - t
+            for idx, res in sorted(results.items()):
+                if not res.ok:
+                    failed.append(idx)
+                    print(f"[ERROR] row={idx} status={res.status} {res.error}")
+
+        if len(df) < window:
+            break
+        start += window
+
+    report = {
+        "applied_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "rows_scanned": scanned,
+        "rows_matched": matched,
+        "rows_changed": changed_rows,
+        "cells_changed": dict(cells),
+        "rows_failed": len(failed),
+        "seconds": round(time.perf_counter() - t0, 2),
+    }
+
+    print(f"Migración: {m.name} — {m.description}")
+    print(f"Tabla: {table_name} | Modo: {'WRITE' if apply else 'DRY RUN (no escribe; usa --apply)'}")
+    print(f"Filas leídas: {scanned} | cumplen el predicado: {matched} | con cambios: {changed_rows}")
+    for hn, n in cells.most_common():
+        print(f"  {hn}: {n} celdas")
+    for idx, diff in samples:
+        print(f"  row={idx} " + ", ".join(f"{hn}: {old!r} -> {new!r}" for hn, (old, new) in diff.items()))
+    print(f"Tiempo: {report['seconds']} s (lectura {t_read:.1f} s, escritura {t_write:.1f} s)")
+    if failed:
+        print(f"Filas con error: {len(failed)} (no se registra como aplicada; vuelve a ejecutar)")
+
+    if apply and not failed:
+        _record_applied(scope, m.name, report)
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--secrets", default="secrets.local.toml")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list", help="migraciones disponibles y cuáles ya se aplicaron")
+    r = sub.add_parser("run", help="ejecutar una migración (dry run por defecto)")
+    r.add_argument("name", choices=sorted(MIGRATIONS))
+    r.add_argument("--apply", action="store_true")
+    r.add_argument("--force", action="store_true", help="repetir aunque ya esté registrada como aplicada")
+    r.add_argument("--window", type=int, default=WINDOW_ROWS)
+    args = ap.parse_args()
+
+    if args.cmd == "list":
+        applied = _load_applied()
+        for m in MIGRATIONS.values():
+            when = [f"{scope} ({info['applied_at']})" for scope, names in applied.items() for n, info in names.items() if n == m.name]
+            print(f"{m.name:<22} {m.description}" + (f"\n{'':<22} aplicada: {', '.join(when)}" if when else ""))
+        return
+
+    with open(args.secrets, "rb") as f:
+        secrets = tomllib.load(f)
+    run_migration(secrets, MIGRATIONS[args.name], apply=args.apply, force=args.force, window=args.window)
+
+
+if __name__ == "__main__":
+    main()
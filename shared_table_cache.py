@@ -0,0 +1,103 @@
+"""
+Caché de tablas compartida por todas las sesiones del proceso.
+
+- single-flight: por clave hay como máximo una descarga en curso; los demás que piden
+  la misma tabla esperan ese resultado en vez de lanzar su propia descarga;
+- stale-while-revalidate: vencido el TTL se sigue sirviendo el snapshot anterior y se
+  refresca en segundo plano (nadie espera un refresco; solo la primera carga bloquea);
+- sin copias cuando es seguro: con copy-on-write activo (siempre en pandas 3; en pandas 2
+  si la app lo activa) cada acierto devuelve una vista superficial del mismo DataFrame, y
+  un cambio sobre esa vista copia solo lo que toca. Sin copy-on-write se entrega una copia
+  completa, para que nadie altere el snapshot compartido.
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+PANDAS_MAJOR = int(pd.__version__.split(".")[0])
+ERROR_RETRY_S = 30          # tras un refresco fallido se sigue sirviendo el snapshot anterior
+
+
+def _entregar(df: pd.DataFrame) -> pd.DataFrame:
+    # pandas 2 sin copy-on-write: una vista superficial compartiría los datos del snapshot
+    if PANDAS_MAJOR >= 3 or pd.get_option("mode.copy_on_write") is True:
+        return df.copy(deep=False)
+    return df.copy()
+
+
+class _Entry:
+    __slots__ = ("value", "version", "loaded_at", "inflight", "failed_at")
+
+    def __init__(self):
+        self.value = None
+        self.version = 0            # sube con cada snapshot cargado (para cachés derivadas)
+        self.loaded_at = 0.0
+        self.inflight: Future | None = None
+        self.failed_at = 0.0
+
+
+class SharedTableCache:
+    def __init__(self, loader, ttl: float = 180, max_workers: int = 2):
+        """loader(*key) -> DataFrame; la clave son los argumentos de get()."""
+        self.loader = loader
+        self.ttl = ttl
+        self._entries: dict[tuple, _Entry] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="table-cache")
+
+    def get(self, *key) -> pd.DataFrame:
+        return self.get_versioned(*key)[1]
+
+    def get_versioned(self, *key) -> tuple[int, pd.DataFrame]:
+        """(versión del snapshot, DataFrame): la versión identifica ese snapshot para derivar cachés."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            if entry.value is not None:
+                if (
+                    now - entry.loaded_at >= self.ttl
+                    and entry.inflight is None
+                    and now - entry.failed_at >= ERROR_RETRY_S
+                ):
+                    entry.inflight = Future()
+                    self._pool.submit(self._load, key, entry, entry.inflight)
+                return entry.version, _entregar(entry.value)
+
+            fut, owner = entry.inflight, entry.inflight is None
+            if owner:
+                fut = entry.inflight = Future()
+
+        if owner:
+            # primera carga: la hace quien llegó primero, en su propio hilo
+            self._load(key, entry, fut)
+        version, value = fut.result()
+        return version, _entregar(value)
+
+    def _load(self, key: tuple, entry: _Entry, fut: Future) -> None:
+        try:
+            value = self.loader(*key)
+        except BaseException as e:
+            with self._lock:
+                entry.inflight = None
+                entry.failed_at = time.monotonic()
+            fut.set_exception(e)
+            return
+        with self._lock:
+            entry.value = value
+            entry.version += 1
+            entry.loaded_at = time.monotonic()
+            entry.inflight = None
+            version = entry.version
+        fut.set_result((version, value))
+
+    def invalidate(self, *key) -> None:
+        """Marca la clave (o todas, sin argumentos) como vencida: el próximo get() la refresca."""
+        with self._lock:
+            entries = self._entries.values() if not key else [self._entries[key]] if key in self._entries else []
+            for entry in entries:
+                entry.loaded_at = 0.0
+                entry.failed_at = 0.0
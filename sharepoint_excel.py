@@ -1,75 +1,394 @@
 import io
 import re
+import threading
+import time
 import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from urllib.parse import quote
 import requests
 import msal
+import numpy as np
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-def norm_key(s: str) -> str:
-    s = "" if s is None else str(s).strip().lower()
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+
+
+class GraphClient:
+    """
+    Cliente HTTP compartido para Microsoft Graph.
+
+    Usa una sola requests.Session con pool de conexiones (keep-alive), de modo que
+    las llamadas sucesivas reutilizan la conexión TLS en vez de abrir una nueva.
+    Reintenta 429/503 con backoff exponencial, respetando Retry-After.
+    """
+
+    def __init__(
+        self,
+        base_url: str = GRAPH_BASE_URL,
+        pool_maxsize: int = 10,
+        max_retries: int = 5,
+        backoff_factor: float = 0.5,
+        timeout: float = 60,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 503),
+            allowed_methods=None,           # Graph indica reintentar 429/503 también en POST/PATCH
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def url(self, path: str) -> str:
+        if path.startswith("http://") or path.startswith("https://"):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, token: str, headers: dict | None = None, **kwargs) -> requests.Response:
+        h = {"Authorization": f"Bearer {token}"}
+        if headers:
+            h.update(headers)
+        kwargs.setdefault("timeout", self.timeout)
+        r = self.session.request(method, self.url(path), headers=h, **kwargs)
+        r.raise_for_status()
+        return r
+
+    def get(self, path: str, token: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, token, **kwargs)
+
+    def post(self, path: str, token: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, token, **kwargs)
+
+    def patch(self, path: str, token: str, **kwargs) -> requests.Response:
+        return self.request("PATCH", path, token, **kwargs)
+
+    def put(self, path: str, token: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, token, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_graph_client: GraphClient | None = None
+_graph_client_lock = threading.Lock()
+
+def get_graph_client() -> GraphClient:
+    """Devuelve el GraphClient del proceso (se crea una sola vez, thread-safe)."""
+    global _graph_client
+    if _graph_client is None:
+        with _graph_client_lock:
+            if _graph_client is None:
+                _graph_client = GraphClient()
+    return _graph_client
+
+def set_graph_client(client: GraphClient) -> GraphClient | None:
+    """Reemplaza el cliente del proceso (p.ej. para apuntar a un servidor local). Devuelve el anterior."""
+    global _graph_client
+    with _graph_client_lock:
+        prev, _graph_client = _graph_client, client
+    return prev
+
+def _norm_key_slow(s: str) -> str:
+    s = s.strip().lower()
     s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
     s = re.sub(r"[^a-z0-9]+", "_", s)
     return s.strip("_")
 
-def _graph_get_token(sp: dict) -> str:
-    authority = f"https://login.microsoftonline.com/{sp['tenant_id']}"
-    app = msal.ConfidentialClientApplication(
-        client_id=sp["client_id"],
-        authority=authority,
-        client_credential=sp["client_secret"],
-    )
-    result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+def _build_norm_table() -> dict[int, str]:
+    # Tabla para str.translate, derivada de _norm_key_slow carácter por carácter (ASCII,
+    # Latin-1 y Latin Extended-A/B: vocales con tilde, ñ, ü, etc.): cada carácter va a su
+    # forma en minúscula sin diacríticos, y lo que no es [a-z0-9] a "_".
+    table = {}
+    for cp in range(0x250):
+        c = chr(cp)
+        base = "".join(ch for ch in unicodedata.normalize("NFD", c.lower()) if unicodedata.category(ch) != "Mn")
+        table[cp] = "".join(ch if ("a" <= ch <= "z" or "0" <= ch <= "9") else "_" for ch in base)
+    return table
+
+_NORM_TABLE = _build_norm_table()
+_UNDERSCORES_RE = re.compile(r"_+")
+
+def norm_key(s: str) -> str:
+    return _norm_key_str("" if s is None else str(s))
+
+@lru_cache(maxsize=8192)
+def _norm_key_str(s: str) -> str:
+    # Los headers se repiten en cada lectura/adaptación: se normaliza cada texto una sola vez
+    t = s.translate(_NORM_TABLE)
+    if not t.isascii():
+        return _norm_key_slow(s)     # caracteres fuera de la tabla
+    return _UNDERSCORES_RE.sub("_", t).strip("_")
+
+def norm_key_series(values) -> pd.Series:
+    """
+    norm_key para una Series/array de textos (nulos -> ""). Se normaliza una vez cada
+    valor distinto (factorize + versión escalar memoizada) y se expande por código.
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    codes, uniques = pd.factorize(s.astype("string").fillna(""))
+    mapped = np.array([_norm_key_str(u) for u in uniques], dtype=object)
+    return pd.Series(mapped[codes] if len(mapped) else np.array([], dtype=object), index=s.index, name=s.name)
+
+# Caché del proceso: apps MSAL (con su token cache), tokens vigentes, site_id e item_id.
+# Lo comparten las lecturas (app.py) y las escrituras (append/update).
+TOKEN_REFRESH_MARGIN_S = 5 * 60   # renueva el token 5 min antes de que expire
+
+_resolver_lock = threading.RLock()
+_msal_apps: dict[tuple, msal.ConfidentialClientApplication] = {}
+_tokens: dict[tuple, tuple[str, float]] = {}     # key -> (token, expira_en epoch)
+_site_ids: dict[tuple, str] = {}
+_item_ids: dict[tuple, str] = {}
+
+def _sp_key(sp: dict) -> tuple:
+    return (sp["tenant_id"], sp["client_id"])
+
+def _msal_app(sp: dict) -> msal.ConfidentialClientApplication:
+    key = _sp_key(sp)
+    with _resolver_lock:
+        app = _msal_apps.get(key)
+        if app is None:
+            authority = f"https://login.microsoftonline.com/{sp['tenant_id']}"
+            app = msal.ConfidentialClientApplication(
+                client_id=sp["client_id"],
+                authority=authority,
+                client_credential=sp["client_secret"],
+            )
+            _msal_apps[key] = app
+        return app
+
+def _graph_acquire_token(sp: dict) -> dict:
+    result = _msal_app(sp).acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
     if "access_token" not in result:
         raise RuntimeError(f"No se pudo obtener token Graph: {result}")
-    return result["access_token"]
+    return result
+
+def _graph_get_token(sp: dict) -> str:
+    """Token Graph del proceso; solo pide uno nuevo cuando el vigente está por expirar."""
+    key = _sp_key(sp)
+    with _resolver_lock:
+        cached = _tokens.get(key)
+        if cached and cached[1] - TOKEN_REFRESH_MARGIN_S > time.time():
+            return cached[0]
+
+        result = _graph_acquire_token(sp)
+        expires_in = float(result.get("expires_in") or 3600)
+        _tokens[key] = (result["access_token"], time.time() + expires_in)
+        return result["access_token"]
+
+def get_site_id_cached(token: str, site_hostname: str, site_path: str) -> str:
+    key = (site_hostname, site_path)
+    site_id = _site_ids.get(key)
+    if site_id is None:
+        site_id = _graph_get_site_id(token, site_hostname, site_path)
+        with _resolver_lock:
+            _site_ids[key] = site_id
+    return site_id
+
+def get_item_id_cached(token: str, site_id: str, file_path: str) -> str:
+    key = (site_id, file_path)
+    item_id = _item_ids.get(key)
+    if item_id is None:
+        item_id = _graph_get_drive_item_id(token, site_id, file_path)
+        with _resolver_lock:
+            _item_ids[key] = item_id
+    return item_id
+
+def resolve_graph_context(sp: dict) -> tuple[str, str, str]:
+    """Devuelve (token, site_id, item_id) usando la caché del proceso."""
+    token = _graph_get_token(sp)
+    site_id = get_site_id_cached(token, sp["site_hostname"], sp["site_path"])
+    item_id = get_item_id_cached(token, site_id, sp["file_path"])
+    return token, site_id, item_id
+
+def clear_graph_resolver_cache() -> None:
+    with _resolver_lock:
+        _tokens.clear()
+        _site_ids.clear()
+        _item_ids.clear()
 
 def _graph_get_site_id(token: str, site_hostname: str, site_path: str) -> str:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_hostname}:{site_path}"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    r = get_graph_client().get(f"/sites/{site_hostname}:{site_path}", token)
     return r.json()["id"]
 
 def _graph_get_drive_item_id(token: str, site_id: str, file_path: str) -> str:
     # Obtiene metadata del item (incluye id)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{file_path}"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    r = get_graph_client().get(f"/sites/{site_id}/drive/root:{file_path}", token)
     return r.json()["id"]
 
+# -----------------------------
+# Sesiones de libro (workbook-session-id)
+# -----------------------------
+# Sin sesión, Excel Online abre el archivo en cada request. Con una sesión persistente
+# (persistChanges=true) el libro queda abierto en el servidor y las llamadas siguientes
+# son mucho más rápidas. La sesión expira tras ~5 min sin uso: se refresca si lleva
+# un rato inactiva y se recrea si ya expiró o Graph la rechaza.
+WORKBOOK_SESSION_REFRESH_S = 2 * 60
+WORKBOOK_SESSION_EXPIRE_S = 5 * 60
+
+_workbook_sessions_enabled = False
+
+class WorkbookSession:
+    def __init__(self, site_id: str, item_id: str, persist_changes: bool = True):
+        self.site_id = site_id
+        self.item_id = item_id
+        self.persist_changes = persist_changes
+        self.session_id: str | None = None
+        self.last_used = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def _base(self) -> str:
+        return f"/sites/{self.site_id}/drive/items/{self.item_id}/workbook"
+
+    def _create(self, token: str) -> None:
+        r = get_graph_client().post(f"{self._base}/createSession", token, json={"persistChanges": self.persist_changes})
+        self.session_id = r.json()["id"]
+        self.last_used = time.time()
+
+    def id(self, token: str) -> str:
+        """Id de sesión vigente (la crea, refresca o recrea según haga falta)."""
+        with self._lock:
+            idle = time.time() - self.last_used
+            if self.session_id is None or idle >= WORKBOOK_SESSION_EXPIRE_S:
+                self._create(token)
+            elif idle >= WORKBOOK_SESSION_REFRESH_S:
+                try:
+                    get_graph_client().post(
+                        f"{self._base}/refreshSession", token, headers={"workbook-session-id": self.session_id}
+                    )
+                    self.last_used = time.time()
+                except requests.HTTPError:
+                    self._create(token)
+            return self.session_id
+
+    def touch(self) -> None:
+        self.last_used = time.time()
+
+    def invalidate(self, session_id: str | None = None) -> None:
+        with self._lock:
+            if session_id is None or session_id == self.session_id:
+                self.session_id = None
+
+    def close(self, token: str) -> None:
+        with self._lock:
+            if self.session_id is None:
+                return
+            try:
+                get_graph_client().post(f"{self._base}/closeSession", token, headers={"workbook-session-id": self.session_id})
+            except requests.HTTPError:
+                pass
+            self.session_id = None
+
+_workbook_sessions: dict[tuple[str, str], WorkbookSession] = {}
+_workbook_sessions_lock = threading.Lock()
+
+def enable_workbook_sessions(enabled: bool = True) -> None:
+    global _workbook_sessions_enabled
+    _workbook_sessions_enabled = enabled
+
+def get_workbook_session(site_id: str, item_id: str) -> WorkbookSession | None:
+    """Sesión compartida del proceso para el libro (None si las sesiones están desactivadas)."""
+    if not _workbook_sessions_enabled:
+        return None
+    key = (site_id, item_id)
+    with _workbook_sessions_lock:
+        ws = _workbook_sessions.get(key)
+        if ws is None:
+            ws = _workbook_sessions[key] = WorkbookSession(site_id, item_id)
+        return ws
+
+def close_workbook_sessions(token: str) -> None:
+    with _workbook_sessions_lock:
+        sessions = list(_workbook_sessions.values())
+        _workbook_sessions.clear()
+    for ws in sessions:
+        ws.close(token)
+
+def _workbook_session_headers(token: str, site_id: str, item_id: str) -> dict:
+    ws = get_workbook_session(site_id, item_id)
+    return {"workbook-session-id": ws.id(token)} if ws else {}
+
+def _is_session_error(e: requests.HTTPError) -> bool:
+    if e.response is None or e.response.status_code not in (400, 404, 410):
+        return False
+    try:
+        code = ((e.response.json() or {}).get("error") or {}).get("code", "")
+    except ValueError:
+        return False
+    return "session" in str(code).lower()
+
+def _workbook_request(method: str, path: str, token: str, site_id: str, item_id: str, **kwargs) -> requests.Response:
+    """Request a /workbook/... usando la sesión del libro si está activa (la recrea una vez si expiró)."""
+    ws = get_workbook_session(site_id, item_id)
+    if ws is None:
+        return get_graph_client().request(method, path, token, **kwargs)
+
+    extra = dict(kwargs.pop("headers", None) or {})
+    for attempt in range(2):
+        sid = ws.id(token)
+        try:
+            r = get_graph_client().request(method, path, token, headers={**extra, "workbook-session-id": sid}, **kwargs)
+            ws.touch()
+            return r
+        except requests.HTTPError as e:
+            if attempt == 0 and _is_session_error(e):
+                ws.invalidate(sid)
+                continue
+            raise
+
 def _excel_get_table_header_names(token: str, site_id: str, item_id: str, table_name: str) -> list[str]:
     # Devuelve los nombres de columnas de la tabla (en orden)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/columns"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/columns"
+    r = _workbook_request("GET", url, token, site_id, item_id)
     cols = r.json().get("value", [])
     # Cada columna trae { "name": "..." }
     return [c.get("name", "").strip() for c in cols]
 
-def _excel_table_add_row(token: str, site_id: str, item_id: str, table_name: str, row_values_in_order: list) -> None:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/rows/add"
+def _excel_table_add_row(token: str, site_id: str, item_id: str, table_name: str, row_values_in_order: list) -> dict:
+    # Devuelve la fila creada ({"index": n, "values": [[...]]})
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/rows/add"
     body = {"values": [row_values_in_order]}
-    r = requests.post(
-        url,
-        headers={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        },
-        json=body,
-        timeout=60,
+    r = _workbook_request("POST", url, token, site_id, item_id, json=body)
+    return r.json() if r.content else {}
+
+def _excel_table_get_row(token: str, site_id: str, item_id: str, table_name: str, index: int) -> list:
+    # Una sola fila de datos (índice 0-based dentro de la tabla, sin contar headers)
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/rows/itemAt(index={index})/range"
+    values = _workbook_request("GET", url, token, site_id, item_id).json().get("values", [])
+    return list(values[0]) if values else []
+
+def _excel_table_get_column_values(token: str, site_id: str, item_id: str, table_name: str, column_name: str) -> list:
+    # Solo el cuerpo de una columna (sin header), como lista plana
+    url = (
+        f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}"
+        f"/columns/{quote(column_name, safe='')}/dataBodyRange?$select=values"
     )
-    r.raise_for_status()
+    values = _workbook_request("GET", url, token, site_id, item_id).json().get("values", [])
+    return [row[0] if row else "" for row in values]
 
 def _graph_download_file(token: str, site_id: str, file_path: str) -> bytes:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{file_path}:/content"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=120)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/root:{file_path}:/content"
+    r = get_graph_client().get(url, token, timeout=120)
     return r.content
 
 
 def _graph_upload_file(token: str, site_id: str, file_path: str, content: bytes) -> None:
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:{file_path}:/content"
-    r = requests.put(url, headers={"Authorization": f"Bearer {token}"}, data=content, timeout=120)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/root:{file_path}:/content"
+    get_graph_client().put(url, token, data=content, timeout=120)
 
 def read_table_from_sharepoint_as_df(
     secrets,
@@ -77,17 +396,14 @@ def read_table_from_sharepoint_as_df(
     table_name_key_in_secrets: str = "table_name",
 ) -> pd.DataFrame:
     sp = secrets["sharepoint"]
-    token = _graph_get_token(sp)
-    site_id = _graph_get_site_id(token, sp["site_hostname"], sp["site_path"])
-    item_id = _graph_get_drive_item_id(token, site_id, sp["file_path"])
+    token, site_id, item_id = resolve_graph_context(sp)
 
     tn = table_name or sp.get(table_name_key_in_secrets)
     if not tn:
         raise ValueError(f"No se indicó table_name y secrets['sharepoint'].{table_name_key_in_secrets} no existe.")
 
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{tn}/range"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{tn}/range"
+    r = _workbook_request("GET", url, token, site_id, item_id)
 
     values = r.json().get("values", [])
     if not values:
@@ -109,9 +425,8 @@ def read_table_from_sharepoint_as_df_with_ids(
     table_name: str,
 ) -> pd.DataFrame:
 
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/range"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/range"
+    r = _workbook_request("GET", url, token, site_id, item_id)
 
     values = r.json().get("values", [])
     if not values:
@@ -119,165 +434,753 @@ def read_table_from_sharepoint_as_df_with_ids(
 
     headers = [str(x).strip() for x in values[0]]
     rows = values[1:]
+
+    # aprovecha la lectura completa para (re)armar el índice IdRegistro -> fila
+    _seed_idregistro_index(item_id, table_name, headers, rows)
+
     return pd.DataFrame(rows, columns=headers)
 
+# Alias: claves técnicas del app -> claves normalizadas del Excel
+# (Esto resuelve fecha_recepcion vs fecha_de_recepcion, etc.)
+APPKEY_TO_EXCELNORM = {
+    "codigo": "id_ue",
+    "nombre": "nombre_unidad_ejecutora",
+    "año": "ano",              # norm_key("Año") => "ano"
+    "anio": "ano",
+    "ng1": "n_g_1",
+    "ng2": "n_g_2",
+
+    "fecha_recepcion": "fecha_de_recepcion",
+    "periodo": "periodo_pei",
+    "vigencia": "vigencia",
+    "tipo_pei": "tipo_de_pei",
+    "estado": "estado",
+    "responsable_institucional": "responsable_institucional",
+    "cantidad_revisiones": "cantidad_de_revisiones",
+    "fecha_derivacion": "fecha_de_derivacion",
+    "etapa_revision": "etapas_de_revision",
+    "comentario": "comentario_adicional_emisor_de_i_t",
+    "articulacion": "articulacion",
+    "expediente": "expediente",
+    "fecha_it": "fecha_de_i_t",
+    "numero_it": "numero_de_i_t",
+    "fecha_oficio": "fecha_oficio",
+    "numero_oficio": "numero_oficio",
+
+    "id_sector": "id_sector",
+    "nombre_sector": "nombre_sector",
+    "id_pliego": "id_pliego",
+    "nombre_pliego": "nombre_pliego",
+
+    "id_departamento": "id_departamento",
+    "nombre_departamento": "nombre_departamento",
+    "id_provincia": "id_provincia",
+    "nombre_provincia": "nombre_provincia",
+    "id_4distrito": "id_4distrito",
+    "nombre_distrito": "nombre_distrito",
+
+    "id_registro": "idregistro",
+    "last_updated": "lastupdated",
+    "updated_by": "updatedby",
+}
+
+def app_row_to_excel_norm(row_by_app_key: dict, appkey_to_excelnorm: dict | None = None) -> dict:
+    """Traduce {clave_app: valor} a {header_normalizado_excel: valor}."""
+    alias = APPKEY_TO_EXCELNORM if appkey_to_excelnorm is None else appkey_to_excelnorm
+    data_norm = {}
+    for k, v in row_by_app_key.items():
+        k0 = norm_key(k)  # por si acaso llega con espacios/tildes
+        data_norm[alias.get(k0, k0)] = v  # si no hay alias, usa k0
+    return data_norm
+
+# -----------------------------
+# Esquema de tabla (headers) en caché
+# -----------------------------
+# El eTag del archivo cambia con cualquier edición (también al agregar filas), por eso
+# no se consulta en cada guardado: se revalida como máximo cada SCHEMA_REVALIDATE_S,
+# y si una escritura falla por forma (400) se invalida y se reintenta una vez.
+SCHEMA_REVALIDATE_S = 5 * 60
+
+@dataclass(frozen=True)
+class TableSchema:
+    headers: tuple[str, ...]
+    headers_norm: tuple[str, ...]
+    index: dict[str, int]          # header normalizado -> posición
+    etag: str | None = None
+
+    @classmethod
+    def from_headers(cls, headers: list[str], etag: str | None = None) -> "TableSchema":
+        headers_norm = tuple(norm_key(h) for h in headers)
+        index = {}
+        for i, h in enumerate(headers_norm):
+            index.setdefault(h, i)   # si hay duplicados gana el primero (como list.index)
+        return cls(tuple(headers), headers_norm, index, etag)
+
+    def col(self, header_norm: str) -> int | None:
+        return self.index.get(header_norm)
+
+    def unknown_keys(self, data_norm: dict) -> list[str]:
+        """Claves con valor que no son columnas de la tabla (row_from_norm/apply_updates las descartan)."""
+        return [k for k, v in data_norm.items() if k not in self.index and v is not None and v != ""]
+
+    def row_from_norm(self, data_norm: dict) -> list:
+        """Arma una fila completa en el orden de la tabla ("" donde no hay dato)."""
+        return [data_norm.get(h, "") for h in self.headers_norm]
+
+    def apply_updates(self, row: list, updates_norm: dict) -> list:
+        current = list(row)
+        # asegurar largo correcto (por si excel devuelve menos columnas)
+        if len(current) < len(self.headers):
+            current += [""] * (len(self.headers) - len(current))
+        for hn, v in updates_norm.items():
+            i = self.index.get(hn)
+            if i is not None:
+                current[i] = v
+        return current
+
+_schemas: dict[tuple[str, str], tuple[TableSchema, float]] = {}
+_schemas_lock = threading.Lock()
+
+def _graph_get_item_versions(token: str, site_id: str, item_id: str) -> dict:
+    # eTag cambia con cualquier cambio (metadata o contenido); cTag solo con el contenido
+    r = get_graph_client().get(f"/sites/{site_id}/drive/items/{item_id}?$select=eTag,cTag", token)
+    data = r.json()
+    return {"eTag": data.get("eTag"), "cTag": data.get("cTag")}
+
+def _graph_get_item_etag(token: str, site_id: str, item_id: str) -> str | None:
+    return _graph_get_item_versions(token, site_id, item_id)["eTag"]
+
+def get_table_schema(token: str, site_id: str, item_id: str, table_name: str, force: bool = False) -> TableSchema:
+    key = (item_id, table_name)
+    now = time.time()
+    with _schemas_lock:
+        cached = _schemas.get(key)
+
+    etag = None
+    if cached and not force:
+        schema, checked_at = cached
+        if now - checked_at < SCHEMA_REVALIDATE_S:
+            return schema
+        # revalidación barata: si el eTag no cambió, el esquema sigue vigente
+        etag = _graph_get_item_etag(token, site_id, item_id)
+        if etag is not None and etag == schema.etag:
+            with _schemas_lock:
+                _schemas[key] = (schema, now)
+            return schema
+
+    headers = _excel_get_table_header_names(token, site_id, item_id, table_name)
+    if not headers:
+        raise RuntimeError(f"No se pudieron leer columnas de la tabla '{table_name}'.")
+    schema = TableSchema.from_headers(headers, etag)
+    with _schemas_lock:
+        _schemas[key] = (schema, now)
+    return schema
+
+def set_table_schema(item_id: str, table_name: str, schema: TableSchema) -> None:
+    """Guarda un esquema leído por otra vía (p. ej. en paralelo con graph_async)."""
+    with _schemas_lock:
+        _schemas[(item_id, table_name)] = (schema, time.time())
+
+def invalidate_table_schema(item_id: str | None = None, table_name: str | None = None) -> None:
+    with _schemas_lock:
+        for key in list(_schemas):
+            if (item_id is None or key[0] == item_id) and (table_name is None or key[1] == table_name):
+                del _schemas[key]
+
+# -----------------------------
+# Índice IdRegistro -> posición de fila
+# -----------------------------
+# Se arma una vez (desde una lectura completa de la tabla o, si no hay, leyendo solo la
+# columna IdRegistro) y se parcha en cada append. Antes de escribir se verifica leyendo
+# solo la fila destino; si no coincide (alguien insertó/ordenó/borró) se reconstruye.
+_row_indexes: dict[tuple[str, str], dict[str, int]] = {}
+_row_indexes_lock = threading.Lock()
+
+def _build_idregistro_index(rows: list[list], id_col: int) -> dict[str, int]:
+    index = {}
+    for i, row in enumerate(rows):
+        if id_col < len(row):
+            rid = str(row[id_col]).strip()
+            if rid:
+                index.setdefault(rid, i)
+    return index
+
+def _seed_idregistro_index(item_id: str, table_name: str, headers: list[str], rows: list[list]) -> None:
+    headers_norm = [norm_key(h) for h in headers]
+    if "idregistro" not in headers_norm:
+        return
+    index = _build_idregistro_index(rows, headers_norm.index("idregistro"))
+    with _row_indexes_lock:
+        _row_indexes[(item_id, table_name)] = index
+
+def _rebuild_idregistro_index(token: str, site_id: str, item_id: str, table_name: str, schema: TableSchema) -> dict[str, int]:
+    id_col = schema.col("idregistro")
+    ids = _excel_table_get_column_values(token, site_id, item_id, table_name, schema.headers[id_col])
+    index = _build_idregistro_index([[v] for v in ids], 0)
+    with _row_indexes_lock:
+        _row_indexes[(item_id, table_name)] = index
+    return index
+
+def _lookup_idregistro(token: str, site_id: str, item_id: str, table_name: str, schema: TableSchema, id_registro: str) -> int | None:
+    with _row_indexes_lock:
+        index = _row_indexes.get((item_id, table_name))
+    if index is None:
+        index = _rebuild_idregistro_index(token, site_id, item_id, table_name, schema)
+    return index.get(id_registro)
+
+def _patch_idregistro_index(item_id: str, table_name: str, id_registro: str, row_index: int) -> None:
+    with _row_indexes_lock:
+        index = _row_indexes.get((item_id, table_name))
+        if index is not None and id_registro:
+            index[id_registro] = row_index
+
+def invalidate_idregistro_index(item_id: str | None = None, table_name: str | None = None) -> None:
+    with _row_indexes_lock:
+        for key in list(_row_indexes):
+            if (item_id is None or key[0] == item_id) and (table_name is None or key[1] == table_name):
+                del _row_indexes[key]
+
+# -----------------------------
+# Lecturas proyectadas (columnas) y por ventana de filas
+# -----------------------------
+_ADDRESS_RE = re.compile(r"^(?:'?(?P<sheet>.+?)'?!)?\$?(?P<c1>[A-Z]+)\$?(?P<r1>\d+)(?::\$?(?P<c2>[A-Z]+)\$?(?P<r2>\d+))?$")
+
+def _col_to_num(col: str) -> int:
+    n = 0
+    for ch in col:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def _num_to_col(n: int) -> str:
+    col = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        col = chr(65 + rem) + col
+    return col
+
+def _excel_table_address(token: str, site_id: str, item_id: str, table_name: str) -> dict:
+    """Hoja, columna inicial (1-based), fila de headers y cantidad de filas de datos de la tabla."""
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/range?$select=address,rowCount"
+    data = _workbook_request("GET", url, token, site_id, item_id).json()
+    m = _ADDRESS_RE.match(str(data.get("address", "")))
+    if not m:
+        raise RuntimeError(f"No se pudo interpretar la dirección de la tabla '{table_name}': {data.get('address')}")
+    header_row = int(m.group("r1"))
+    last_row = int(m.group("r2") or header_row)
+    return {
+        "sheet": m.group("sheet"),
+        "first_col": _col_to_num(m.group("c1")),
+        "header_row": header_row,
+        "row_count": last_row - header_row,   # sin la fila de headers
+    }
+
+def _resolve_columns(schema: TableSchema, columns: list[str] | None) -> list[int]:
+    # Acepta headers reales o normalizados; las que no existen se omiten. Mantiene el orden de la tabla.
+    if columns is None:
+        return list(range(len(schema.headers)))
+    wanted = {norm_key(c) for c in columns}
+    return [i for i, h in enumerate(schema.headers_norm) if h in wanted]
+
+def _contiguous_runs(cols: list[int]) -> list[tuple[int, int]]:
+    runs = []
+    for c in cols:
+        if runs and c == runs[-1][1] + 1:
+            runs[-1] = (runs[-1][0], c)
+        else:
+            runs.append((c, c))
+    return runs
+
+def read_table_columns_as_df(
+    token: str,
+    site_id: str,
+    item_id: str,
+    table_name: str,
+    columns: list[str] | None = None,
+    row_start: int = 0,
+    row_count: int | None = None,
+) -> pd.DataFrame:
+    """
+    Lee solo algunas columnas y/o una ventana de filas de la tabla.
+    - columns: headers reales o normalizados (norm_key); None = todas
+    - row_start / row_count: ventana de filas de datos (0-based); sin ventana se lee el cuerpo completo
+    Devuelve un DataFrame con los headers reales, igual que read_table_from_sharepoint_as_df_with_ids;
+    su índice es la posición de cada fila dentro de la tabla (sirve para itemAt(index)).
+    """
+    schema = get_table_schema(token, site_id, item_id, table_name)
+    cols = _resolve_columns(schema, columns)
+    headers = [schema.headers[i] for i in cols]
+    if not cols:
+        return pd.DataFrame()
+
+    base = f"/sites/{site_id}/drive/items/{item_id}/workbook"
+    session_headers = _workbook_session_headers(token, site_id, item_id)
+
+    if row_start == 0 and row_count is None:
+        # columnas completas: un dataBodyRange por columna, todas en $batch
+        reqs = {
+            i: {
+                "method": "GET",
+                "url": f"{base}/tables/{table_name}/columns/{quote(schema.headers[i], safe='')}/dataBodyRange?$select=values",
+                "headers": session_headers,
+            }
+            for i in cols
+        }
+        data = {}
+        for i, res in graph_batch(token, reqs).items():
+            if not res.ok:
+                raise RuntimeError(f"No se pudo leer la columna '{schema.headers[i]}': {res.error}")
+            data[i] = [row[0] if row else "" for row in (res.body or {}).get("values", [])]
+        return pd.DataFrame({schema.headers[i]: data[i] for i in cols}, columns=headers)
+
+    # ventana de filas: rango de hoja por cada tramo contiguo de columnas
+    addr = _excel_table_address(token, site_id, item_id, table_name)
+    start = max(0, int(row_start))
+    stop = addr["row_count"] if row_count is None else min(addr["row_count"], start + int(row_count))
+    if stop <= start:
+        return pd.DataFrame(columns=headers)
+
+    r1 = addr["header_row"] + 1 + start
+    r2 = addr["header_row"] + stop
+    sheet = quote(addr["sheet"] or "", safe="")
+    reqs = {}
+    for c1, c2 in _contiguous_runs(cols):
+        a = f"{_num_to_col(addr['first_col'] + c1)}{r1}:{_num_to_col(addr['first_col'] + c2)}{r2}"
+        reqs[(c1, c2)] = {
+            "method": "GET",
+            "url": f"{base}/worksheets/{sheet}/range(address='{a}')?$select=values",
+            "headers": session_headers,
+        }
+
+    data = {}
+    for (c1, c2), res in graph_batch(token, reqs).items():
+        if not res.ok:
+            raise RuntimeError(f"No se pudo leer el rango de la tabla '{table_name}': {res.error}")
+        values = (res.body or {}).get("values", [])
+        for k, c in enumerate(range(c1, c2 + 1)):
+            data[c] = [row[k] if k < len(row) else "" for row in values]
+    df = pd.DataFrame({schema.headers[i]: data[i] for i in cols}, columns=headers)
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+def _is_shape_error(e: Exception) -> bool:
+    return isinstance(e, requests.HTTPError) and e.response is not None and e.response.status_code == 400
+
 def append_row_to_sharepoint_excel(secrets, row_by_app_key: dict, table_name_key="table_name_hist") -> None:
     """
     Inserta una fila en la TABLA del Excel (SharePoint) usando headers reales.
     Acepta claves técnicas del app (snake_case) y las traduce a los headers de Excel.
     """
     sp = secrets["sharepoint"]
-    token = _graph_get_token(sp)
-    site_id = _graph_get_site_id(token, sp["site_hostname"], sp["site_path"])
-    item_id = _graph_get_drive_item_id(token, site_id, sp["file_path"])
+    token, site_id, item_id = resolve_graph_context(sp)
 
     table_name = sp.get(table_name_key)
     if not table_name:
         raise ValueError("Falta secrets['sharepoint'].table_name")
 
-    # 1) Headers reales de la tabla (en orden)
-    table_headers = _excel_get_table_header_names(token, site_id, item_id, table_name)
-    if not table_headers:
-        raise RuntimeError(f"No se pudieron leer columnas de la tabla '{table_name}'.")
+    # 1) Headers reales de la tabla (en caché) y claves del app normalizadas con alias
+    schema = get_table_schema(token, site_id, item_id, table_name)
+    data_norm = app_row_to_excel_norm(row_by_app_key)
 
-    # 2) Normaliza headers reales del Excel
-    excel_norm_headers = [norm_key(h) for h in table_headers]
-
-    # 3) Alias: claves técnicas del app -> claves normalizadas del Excel
-    #    (Esto resuelve fecha_recepcion vs fecha_de_recepcion, etc.)
-    APPKEY_TO_EXCELNORM = {
-        "codigo": "id_ue",
-        "nombre": "nombre_unidad_ejecutora",
-        "año": "ano",              # norm_key("Año") => "ano"
-        "anio": "ano",
-        "ng1": "n_g_1",
-        "ng2": "n_g_2",
-
-        "fecha_recepcion": "fecha_de_recepcion",
-        "periodo": "periodo_pei",
-        "vigencia": "vigencia",
-        "tipo_pei": "tipo_de_pei",
-        "estado": "estado",
-        "responsable_institucional": "responsable_institucional",
-        "cantidad_revisiones": "cantidad_de_revisiones",
-        "fecha_derivacion": "fecha_de_derivacion",
-        "etapa_revision": "etapas_de_revision",
-        "comentario": "comentario_adicional_emisor_de_i_t",
-        "articulacion": "articulacion",
-        "expediente": "expediente",
-        "fecha_it": "fecha_de_i_t",
-        "numero_it": "numero_de_i_t",
-        "fecha_oficio": "fecha_oficio",
-        "numero_oficio": "numero_oficio",
-
-        "id_sector": "id_sector",
-        "nombre_sector": "nombre_sector",
-        "id_pliego": "id_pliego",
-        "nombre_pliego": "nombre_pliego",
-
-        "id_departamento": "id_departamento",
-        "nombre_departamento": "nombre_departamento",
-        "id_provincia": "id_provincia",
-        "nombre_provincia": "nombre_provincia",
-        "id_4distrito": "id_4distrito",
-        "nombre_distrito": "nombre_distrito",
-
-        "id_registro": "idregistro",
-        "last_updated": "lastupdated",
-        "updated_by": "updatedby",
-    }
+    # 2) Inserta la fila (en el orden de la tabla) por Graph Excel API
+    try:
+        added = _excel_table_add_row(token, site_id, item_id, table_name, schema.row_from_norm(data_norm))
+    except requests.HTTPError as e:
+        if not _is_shape_error(e):
+            raise
+        # columnas cambiaron desde la última lectura: refresca esquema y reintenta una vez
+        schema = get_table_schema(token, site_id, item_id, table_name, force=True)
+        added = _excel_table_add_row(token, site_id, item_id, table_name, schema.row_from_norm(data_norm))
 
-    # 4) Construye diccionario normalizado con alias
-    data_norm = {}
-    for k, v in row_by_app_key.items():
-        k0 = norm_key(k)  # por si acaso llega con espacios/tildes
-        excel_norm = APPKEY_TO_EXCELNORM.get(k0, k0)  # si no hay alias, usa k0
-        data_norm[excel_norm] = v
+    # 3) Mantiene el índice IdRegistro -> fila
+    if isinstance(added.get("index"), int):
+        _patch_idregistro_index(item_id, table_name, str(data_norm.get("idregistro", "")).strip(), added["index"])
+
+CAS_MAX_ATTEMPTS = 3     # reintentos reubicando la fila si se movió entre la búsqueda y la escritura
+
+class UpdateConflictError(RuntimeError):
+    """El registro fue modificado por otra persona (LastUpdated distinto al esperado)."""
+
+    def __init__(self, id_registro: str, expected, actual):
+        super().__init__(
+            f"El registro {id_registro} fue modificado por otra persona "
+            f"(LastUpdated actual: {actual!r}; se esperaba: {expected!r})."
+        )
+        self.id_registro = id_registro
+        self.expected = expected
+        self.actual = actual
 
-    # 5) Arma la fila en el mismo orden de la tabla
-    new_row = [data_norm.get(h_norm, "") for h_norm in excel_norm_headers]
+def _as_timestamp(v):
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return pd.Timestamp("1899-12-30") + pd.to_timedelta(float(v), unit="D")   # serial de Excel
+    try:
+        return pd.Timestamp(str(v).strip())
+    except (ValueError, TypeError):
+        return None
 
-    # 6) Inserta fila por Graph Excel API
-    _excel_table_add_row(token, site_id, item_id, table_name, new_row)
+def _same_last_updated(a, b) -> bool:
+    # Excel puede devolver la fecha como texto o como serial numérico
+    sa = "" if a is None else str(a).strip()
+    sb = "" if b is None else str(b).strip()
+    if sa == sb:
+        return True
+    if not sa or not sb:
+        return False
+    ta, tb = _as_timestamp(a), _as_timestamp(b)
+    return ta is not None and tb is not None and abs((ta - tb).total_seconds()) < 1
 
-def _excel_table_get_all_values(token: str, site_id: str, item_id: str, table_name: str) -> list[list]:
-    # Devuelve matriz: [ [fila1...], [fila2...] ... ] (sin headers)
-    url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/range"
-    r = requests.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=60)
-    r.raise_for_status()
-    return r.json().get("values", [])
+def _cell(row: list | None, col: int | None):
+    return None if row is None or col is None or col >= len(row) else row[col]
+
+def _cas_read_row(token: str, site_id: str, item_id: str, table_name: str, index: int) -> list | None:
+    # Fila actual en esa posición (None si la posición ya no existe)
+    try:
+        return _excel_table_get_row(token, site_id, item_id, table_name, index)
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code in (400, 404):
+            return None
+        raise
 
 def update_row_in_table_by_idregistro(
     secrets,
     updates_by_app_key: dict,
     id_registro: str,
-    appkey_to_excelnorm: dict,
+    appkey_to_excelnorm: dict | None = None,
     table_name_key="table_name_hist", 
+    expected_last_updated=None,
 ) -> None:
     """
     Actualiza un registro existente en la tabla (SharePoint Excel) buscando por IdRegistro.
     - updates_by_app_key: dict con claves técnicas del app (estado, comentario, etc.)
     - id_registro: valor exacto de la columna IdRegistro de esa fila
-    - appkey_to_excelnorm: el mismo alias que ya usas para insertar (Opción A)
+    - appkey_to_excelnorm: alias app -> Excel (por defecto APPKEY_TO_EXCELNORM, el mismo del insert)
+    - expected_last_updated: LastUpdated que tenía la fila cuando se leyó (compare-and-set);
+      si no coincide se lanza UpdateConflictError y la fila queda como estaba
+
+    Compare-and-set: antes de escribir se lee la fila en la posición indexada y se verifica
+    que tenga este IdRegistro (si no, se reubica con la columna IdRegistro) y el LastUpdated
+    esperado (si no, UpdateConflictError sin escribir nada). Solo entonces se envía el PATCH
+    parcial (solo las celdas que cambian; None = no tocar).
     """
     sp = secrets["sharepoint"]
     table_name = sp.get(table_name_key)
     if not table_name:
         raise ValueError("Falta secrets['sharepoint'].table_name")
 
-    token = _graph_get_token(sp)
-    site_id = _graph_get_site_id(token, sp["site_hostname"], sp["site_path"])
-    item_id = _graph_get_drive_item_id(token, site_id, sp["file_path"])
+    token, site_id, item_id = resolve_graph_context(sp)
 
-    headers = _excel_get_table_header_names(token, site_id, item_id, table_name)
-    headers_norm = [norm_key(h) for h in headers]
-
-    # datos actuales (matriz sin headers)
-    values = _excel_table_get_all_values(token, site_id, item_id, table_name)
+    schema = get_table_schema(token, site_id, item_id, table_name)
 
-    # ubicar columna IdRegistro
-    if "idregistro" not in headers_norm:
+    # ubicar columnas IdRegistro / LastUpdated
+    id_col = schema.col("idregistro")
+    if id_col is None:
         raise ValueError("La tabla no tiene columna 'IdRegistro' (requerida para actualizar).")
+    lu_col = schema.col("lastupdated")
+    if expected_last_updated is not None and lu_col is None:
+        raise ValueError("La tabla no tiene columna 'LastUpdated' (requerida para compare-and-set).")
+
+    # fila parcial: None = no tocar la celda (no pisa cambios concurrentes en otras columnas)
+    updates_norm = app_row_to_excel_norm(updates_by_app_key, appkey_to_excelnorm)
+    partial = schema.apply_updates([None] * len(schema.headers), updates_norm)
+
+    id_registro = str(id_registro).strip()
+    target_idx = _lookup_idregistro(token, site_id, item_id, table_name, schema, id_registro)
+
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/rows/itemAt(index={{}})/range"
+    for _ in range(CAS_MAX_ATTEMPTS):
+        if target_idx is None:
+            # índice desactualizado: se reconstruye desde la columna IdRegistro
+            target_idx = _rebuild_idregistro_index(token, site_id, item_id, table_name, schema).get(id_registro)
+            if target_idx is None:
+                raise ValueError(f"No se encontró IdRegistro={id_registro} en la tabla.")
+
+        current = _cas_read_row(token, site_id, item_id, table_name, target_idx)
+        if current is None or str(_cell(current, id_col) or "").strip() != id_registro:
+            # la posición tiene otra fila (append, orden o borrado concurrente): se reubica
+            target_idx = None
+            continue
+
+        actual = _cell(current, lu_col)
+        if expected_last_updated is not None and not _same_last_updated(actual, expected_last_updated):
+            raise UpdateConflictError(id_registro, expected_last_updated, actual)
+
+        _workbook_request("PATCH", url.format(target_idx), token, site_id, item_id, json={"values": [partial]})
+        return
 
-    id_col = headers_norm.index("idregistro")
+    raise RuntimeError(f"No se pudo actualizar IdRegistro={id_registro}: la fila cambió de posición en cada intento.")
 
-    # ubicar fila por IdRegistro
-    target_idx = None
-    for i, row in enumerate(values):
-        if i < len(values) and id_col < len(row) and str(row[id_col]).strip() == str(id_registro).strip():
-            target_idx = i
+# -----------------------------
+# Escrituras en lote
+# -----------------------------
+ROWS_ADD_CHUNK = 500    # filas por llamada rows/add (acota el tamaño del payload)
+GRAPH_BATCH_MAX = 20    # límite de Graph para $batch
+_RETRYABLE_STATUS = (424, 429, 503, 504)   # 424: falló una dependencia del mismo lote
+
+class AdaptiveThrottle:
+    """
+    Pausa compartida entre hilos que se ajusta con las respuestas de Graph:
+    sube (respetando Retry-After) cuando llega un 429/503 y baja de a poco con los éxitos.
+    """
+
+    def __init__(self, min_delay: float = 0.0, max_delay: float = 60.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = min_delay
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            d = self.delay
+        if d > 0:
+            time.sleep(d)
+
+    def on_throttled(self, retry_after: float | None = None) -> None:
+        with self._lock:
+            # si Graph indica Retry-After se usa tal cual; si no, se duplica la pausa
+            d = float(retry_after) if retry_after is not None else max(self.delay * 2, 0.5)
+            self.delay = min(max(d, self.min_delay), self.max_delay)
+
+    def on_success(self) -> None:
+        with self._lock:
+            d = self.delay / 2
+            self.delay = d if d >= 0.05 else self.min_delay
+
+@dataclass
+class BatchItemResult:
+    key: object             # índice de fila (o id de request) al que corresponde
+    status: int
+    body: dict | None = None
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+def _retry_after_s(headers: dict | None) -> float | None:
+    for k, v in (headers or {}).items():
+        if k.lower() == "retry-after":
+            try:
+                return float(v)
+            except (TypeError, ValueError):
+                return None
+    return None
+
+def graph_batch(
+    token: str,
+    requests_by_key: dict,
+    throttle: AdaptiveThrottle | None = None,
+    sequential: bool = False,
+    max_attempts: int = 5,
+) -> dict:
+    """
+    Ejecuta requests por Graph JSON $batch (de a GRAPH_BATCH_MAX).
+    - requests_by_key: {clave: {"method": ..., "url": "/sites/...", "body": {...}}}
+    - sequential: encadena con dependsOn (útil para escrituras sobre el mismo libro)
+    Reintenta solo los ítems 424/429/503/504. Devuelve {clave: BatchItemResult}.
+    """
+    throttle = throttle or AdaptiveThrottle()
+    order = {key: n for n, key in enumerate(requests_by_key)}
+    pending = list(requests_by_key)
+    results = {}
+
+    for attempt in range(max_attempts):
+        if not pending:
             break
+        retry = []
+        for start in range(0, len(pending), GRAPH_BATCH_MAX):
+            chunk = pending[start:start + GRAPH_BATCH_MAX]
+            reqs = []
+            for n, key in enumerate(chunk):
+                spec = requests_by_key[key]
+                req = {"id": str(n), "method": spec.get("method", "GET"), "url": spec["url"]}
+                if spec.get("body") is not None:
+                    req["body"] = spec["body"]
+                    req["headers"] = {"Content-Type": "application/json", **spec.get("headers", {})}
+                elif spec.get("headers"):
+                    req["headers"] = spec["headers"]
+                if sequential and n > 0:
+                    req["dependsOn"] = [str(n - 1)]
+                reqs.append(req)
 
-    if target_idx is None:
-        raise ValueError(f"No se encontró IdRegistro={id_registro} en la tabla.")
+            throttle.wait()
+            r = get_graph_client().post("/$batch", token, json={"requests": reqs})
 
-    # construir dict normalizado de updates
-    updates_norm = {}
-    for k, v in updates_by_app_key.items():
-        k0 = norm_key(k)
-        excel_norm = appkey_to_excelnorm.get(k0, k0)
-        updates_norm[excel_norm] = v
+            throttled, throttled_after = False, None
+            for resp in r.json().get("responses", []):
+                key = chunk[int(resp["id"])]
+                status = int(resp.get("status", 0))
+                body = resp.get("body") if isinstance(resp.get("body"), dict) else None
+                if status in _RETRYABLE_STATUS and attempt < max_attempts - 1:
+                    retry.append(key)
+                    if status != 424:
+                        throttled = True
+                        ra = _retry_after_s(resp.get("headers"))
+                        if ra is not None:
+                            throttled_after = max(throttled_after or 0, ra)
+                    continue
+                error = None
+                if not 200 <= status < 300:
+                    error = ((body or {}).get("error") or {}).get("message") or f"HTTP {status}"
+                results[key] = BatchItemResult(key, status, body, error)
 
-    # armar nueva fila completa preservando lo existente
-    current = list(values[target_idx])
-    # asegurar largo correcto (por si excel devuelve menos columnas)
-    if len(current) < len(headers):
-        current += [""] * (len(headers) - len(current))
+            if throttled:
+                throttle.on_throttled(throttled_after)
+            else:
+                throttle.on_success()
+        pending = sorted(retry, key=order.get)
 
-    # aplicar updates a índices
-    for hn, v in updates_norm.items():
-        if hn in headers_norm:
-            current[headers_norm.index(hn)] = v
+    return results
 
-    # escribir la fila completa usando rows/itemAt(index)/range
-    url = (
-        f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/items/{item_id}"
-        f"/workbook/tables/{table_name}/rows/itemAt(index={target_idx})/range"
-    )
-    r = requests.patch(
-        url,
-        headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
-        json={"values": [current]},
-        timeout=60
-    )
-    r.raise_for_status()
+def _excel_table_add_rows(token: str, site_id: str, item_id: str, table_name: str, rows_in_order: list[list]) -> list[int]:
+    # Inserta muchas filas con pocas llamadas rows/add; devuelve el índice de cada fila creada
+    url = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}/rows/add"
+    indexes = []
+    for start in range(0, len(rows_in_order), ROWS_ADD_CHUNK):
+        chunk = rows_in_order[start:start + ROWS_ADD_CHUNK]
+        r = _workbook_request("POST", url, token, site_id, item_id, json={"values": chunk})
+        first = (r.json() if r.content else {}).get("index")
+        indexes += [first + n if isinstance(first, int) else None for n in range(len(chunk))]
+    return indexes
+
+def patch_table_rows_by_index(
+    token: str,
+    site_id: str,
+    item_id: str,
+    table_name: str,
+    rows_by_index: dict[int, list],
+    throttle: AdaptiveThrottle | None = None,
+) -> dict[int, BatchItemResult]:
+    """PATCH de filas completas (rows/itemAt(index)/range) agrupadas en $batch. Devuelve resultado por índice."""
+    base = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}"
+    headers = _workbook_session_headers(token, site_id, item_id)
+    reqs = {
+        idx: {
+            "method": "PATCH",
+            "url": f"{base}/rows/itemAt(index={idx})/range",
+            "body": {"values": [row]},
+            "headers": headers,
+        }
+        for idx, row in rows_by_index.items()
+    }
+    return graph_batch(token, reqs, throttle=throttle, sequential=True)
+
+def get_table_rows_by_index(
+    token: str,
+    site_id: str,
+    item_id: str,
+    table_name: str,
+    indexes: list[int],
+    throttle: AdaptiveThrottle | None = None,
+) -> dict[int, list]:
+    """Lee varias filas sueltas con $batch. Devuelve {índice: valores} (omite las que fallan)."""
+    base = f"/sites/{site_id}/drive/items/{item_id}/workbook/tables/{table_name}"
+    headers = _workbook_session_headers(token, site_id, item_id)
+    reqs = {idx: {"method": "GET", "url": f"{base}/rows/itemAt(index={idx})/range", "headers": headers} for idx in indexes}
+    out = {}
+    for idx, res in graph_batch(token, reqs, throttle=throttle).items():
+        values = (res.body or {}).get("values") or []
+        if res.ok and values:
+            out[idx] = list(values[0])
+    return out
+
+def append_rows_to_sharepoint_excel(
+    secrets,
+    rows_by_app_key: list[dict],
+    table_name_key="table_name_hist",
+    appkey_to_excelnorm: dict | None = None,
+) -> list[int]:
+    """
+    Inserta muchas filas (claves técnicas del app) con una llamada rows/add por cada ROWS_ADD_CHUNK filas.
+    Devuelve el índice de fila de cada registro insertado.
+    """
+    if not rows_by_app_key:
+        return []
+
+    sp = secrets["sharepoint"]
+    table_name = sp.get(table_name_key)
+    if not table_name:
+        raise ValueError("Falta secrets['sharepoint'].table_name")
+
+    token, site_id, item_id = resolve_graph_context(sp)
+    schema = get_table_schema(token, site_id, item_id, table_name)
+
+    rows_norm = [app_row_to_excel_norm(r, appkey_to_excelnorm) for r in rows_by_app_key]
+    indexes = _excel_table_add_rows(token, site_id, item_id, table_name, [schema.row_from_norm(d) for d in rows_norm])
+
+    for d, idx in zip(rows_norm, indexes):
+        if idx is not None:
+            _patch_idregistro_index(item_id, table_name, str(d.get("idregistro", "")).strip(), idx)
+    return indexes
+
+def idregistro_exists(secrets, id_registro: str, table_name_key="table_name_hist") -> bool:
+    """¿Ya hay una fila con ese IdRegistro? Lee la columna fresca (sirve para no duplicar reintentos)."""
+    sp = secrets["sharepoint"]
+    table_name = sp.get(table_name_key)
+    if not table_name:
+        raise ValueError("Falta secrets['sharepoint'].table_name")
+
+    token, site_id, item_id = resolve_graph_context(sp)
+    schema = get_table_schema(token, site_id, item_id, table_name)
+    if schema.col("idregistro") is None:
+        raise ValueError("La tabla no tiene columna 'IdRegistro'.")
+    return str(id_registro).strip() in _rebuild_idregistro_index(token, site_id, item_id, table_name, schema)
+
+def update_rows_in_table_by_idregistro(
+    secrets,
+    updates_by_idregistro: dict[str, dict],
+    appkey_to_excelnorm: dict | None = None,
+    table_name_key="table_name_hist",
+    throttle: AdaptiveThrottle | None = None,
+) -> dict[str, BatchItemResult]:
+    """
+    Versión en lote de update_row_in_table_by_idregistro.
+    Ubica cada IdRegistro con el índice, lee las filas destino con $batch para confirmar la
+    IdRegistro y escribe con $batch solo las celdas cambiadas (null = no tocar, así no se pisa
+    lo que otro haya editado entre la lectura y la escritura). Devuelve el resultado por
+    IdRegistro (status 404 si no existe).
+    """
+    sp = secrets["sharepoint"]
+    table_name = sp.get(table_name_key)
+    if not table_name:
+        raise ValueError("Falta secrets['sharepoint'].table_name")
+
+    token, site_id, item_id = resolve_graph_context(sp)
+    schema = get_table_schema(token, site_id, item_id, table_name)
+    id_col = schema.col("idregistro")
+    if id_col is None:
+        raise ValueError("La tabla no tiene columna 'IdRegistro' (requerida para actualizar).")
+
+    throttle = throttle or AdaptiveThrottle()
+    updates = {str(k).strip(): v for k, v in updates_by_idregistro.items()}
+    results = {}
+
+    for attempt in range(2):
+        index = None
+        if attempt == 0:
+            with _row_indexes_lock:
+                index = _row_indexes.get((item_id, table_name))
+        if index is None:
+            index = _rebuild_idregistro_index(token, site_id, item_id, table_name, schema)
+
+        located = {rid: index[rid] for rid in updates if rid in index and rid not in results}
+        current = get_table_rows_by_index(token, site_id, item_id, table_name, list(located.values()), throttle)
+
+        # solo se escriben las filas cuya IdRegistro coincide; el resto se reubica en el 2do intento
+        rows_by_index, id_by_index = {}, {}
+        for rid, idx in located.items():
+            row = current.get(idx)
+            if row is None or id_col >= len(row) or str(row[id_col]).strip() != rid:
+                continue
+            updates_norm = app_row_to_excel_norm(updates[rid], appkey_to_excelnorm)
+            rows_by_index[idx] = schema.apply_updates([None] * len(schema.headers), updates_norm)
+            id_by_index[idx] = rid
+
+        for idx, res in patch_table_rows_by_index(token, site_id, item_id, table_name, rows_by_index, throttle).items():
+            results[id_by_index[idx]] = res
+
+        if len(results) == len(updates):
+            break
+
+    for rid in updates:
+        if rid not in results:
+            results[rid] = BatchItemResult(rid, 404, error=f"No se encontró IdRegistro={rid} en la tabla.")
+    return results
@@ -0,0 +1,316 @@
+"""
+Backend SQL (SQLAlchemy) con la misma API que storage_backends: SQLite en local,
+PostgreSQL en producción.
+
+Cada tabla de la app (table_name_key) es una tabla SQL cuyas columnas son los headers
+del Excel normalizados con norm_key (id_ue, fecha_de_recepcion, idregistro, ...), todas
+de texto, más "_pos" (autoincremental) que conserva el orden de inserción como el de la
+tabla de Excel. El header original de cada columna ("Id_UE", "Fecha de recepción", ...)
+se guarda en la tabla "_column_headers", y read_table/query_historial devuelven las
+columnas con esos headers: lo mismo que el adapter espera de Graph.
+
+Índices en id_ue (codigo, guardado ya normalizado), idregistro, responsable_institucional
+y fecha_de_recepcion: consultar el historial de un pliego o ubicar un IdRegistro no
+recorre la tabla.
+
+Las tablas se crean/cargan desde el Excel con scripts/sync_sql_sharepoint.py bootstrap,
+y el mismo script replica el SQL hacia la tabla de Excel (sync) para quien la sigue leyendo.
+"""
+import threading
+
+import pandas as pd
+
+try:
+    import sqlalchemy as sa
+except ImportError:
+    sa = None
+
+from sharepoint_excel import (
+    UpdateConflictError,
+    app_row_to_excel_norm,
+    norm_key,
+    _same_last_updated,
+)
+from adapters.historial_sharepoint import (
+    adaptar_historial_sharepoint,
+    normalizar_codigo_valor,
+    ultimas_posiciones,
+)
+
+# table_name_key -> tabla SQL
+DEFAULT_SQL_TABLES = {
+    "table_name_hist": "historial",
+    "table_name_ue": "unidades_ejecutoras",
+    "table_name_resp": "responsables",
+}
+
+POS_COL = "_pos"
+HEADERS_TABLE = "_column_headers"     # tabla SQL -> (columna normalizada, header original, orden)
+CODIGO_COL = "id_ue"
+INDEXED_COLUMNS = (CODIGO_COL, "idregistro", "responsable_institucional", "fecha_de_recepcion")
+INSERT_CHUNK = 1000
+
+
+def _sql_value(v):
+    """Valor de celda -> texto (NULL para vacíos), como se guarda en las columnas SQL."""
+    if v is None:
+        return None
+    try:
+        if pd.isna(v):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return str(v)
+
+
+class SqlBackend:
+    def __init__(self, url: str, tables: dict[str, str] | None = None):
+        if sa is None:
+            raise RuntimeError("SqlBackend requiere sqlalchemy (pip install sqlalchemy).")
+        self.tables = dict(DEFAULT_SQL_TABLES if tables is None else tables)
+        if url.startswith("sqlite"):
+            self.engine = sa.create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+            sa.event.listen(self.engine, "connect", self._sqlite_pragmas)
+        else:
+            self.engine = sa.create_engine(url, pool_pre_ping=True)
+        self._tables: dict[str, "sa.Table"] = {}
+        self._headers: dict[str, dict[str, str]] = {}
+        self._lock = threading.Lock()
+        self._headers_table = sa.Table(
+            HEADERS_TABLE,
+            sa.MetaData(),
+            sa.Column("tabla", sa.Text, primary_key=True),
+            sa.Column("columna", sa.Text, primary_key=True),
+            sa.Column("header", sa.Text, nullable=False),
+            sa.Column("orden", sa.Integer, nullable=False),
+        )
+
+    @staticmethod
+    def _sqlite_pragmas(dbapi_conn, _record) -> None:
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.close()
+
+    def _name(self, table_name_key: str) -> str:
+        name = self.tables.get(table_name_key)
+        if not name:
+            raise ValueError(f"No hay tabla SQL configurada para '{table_name_key}'.")
+        return name
+
+    def _table(self, table_name_key: str) -> "sa.Table":
+        with self._lock:
+            table = self._tables.get(table_name_key)
+        if table is not None:
+            return table
+        name = self._name(table_name_key)
+        try:
+            table = sa.Table(name, sa.MetaData(), autoload_with=self.engine)
+        except sa.exc.NoSuchTableError:
+            raise ValueError(
+                f"La tabla SQL '{name}' no existe; créala con scripts/sync_sql_sharepoint.py bootstrap."
+            ) from None
+        with self._lock:
+            self._tables[table_name_key] = table
+        return table
+
+    def _header_map(self, table_name_key: str) -> dict[str, str]:
+        """Columna SQL -> header original del Excel (las columnas sin registro quedan como están)."""
+        with self._lock:
+            headers = self._headers.get(table_name_key)
+        if headers is not None:
+            return headers
+        ht = self._headers_table
+        with self.engine.connect() as conn:
+            if sa.inspect(conn).has_table(HEADERS_TABLE):
+                stmt = sa.select(ht.c.columna, ht.c.header).where(ht.c.tabla == self._name(table_name_key))
+                headers = dict(conn.execute(stmt).all())
+            else:
+                headers = {}
+        with self._lock:
+            self._headers[table_name_key] = headers
+        return headers
+
+    # -----------------------------
+    # Creación / carga
+    # -----------------------------
+    def create_table(self, table_name_key: str, headers, replace: bool = False) -> "sa.Table":
+        """Crea la tabla con una columna de texto por header (normalizado) y sus índices."""
+        name = self._name(table_name_key)
+        cols, originales = [], []
+        for h in headers:
+            hn = norm_key(h)
+            if hn and hn != POS_COL and hn not in cols:
+                cols.append(hn)
+                originales.append(str(h).strip())
+
+        table = sa.Table(
+            name,
+            sa.MetaData(),
+            sa.Column(POS_COL, sa.Integer, primary_key=True, autoincrement=True),
+            *(sa.Column(c, sa.Text) for c in cols),
+        )
+        for c in INDEXED_COLUMNS:
+            if c in cols:
+                sa.Index(f"ix_{name}_{c}", table.c[c])
+
+        ht = self._headers_table
+        with self.engine.begin() as conn:
+            if replace:
+                table.drop(conn, checkfirst=True)
+            existia = sa.inspect(conn).has_table(name)
+            table.create(conn, checkfirst=True)
+            ht.create(conn, checkfirst=True)
+            if not existia:
+                conn.execute(ht.delete().where(ht.c.tabla == name))
+                conn.execute(
+                    ht.insert(),
+                    [{"tabla": name, "columna": c, "header": h, "orden": i} for i, (c, h) in enumerate(zip(cols, originales))],
+                )
+        with self._lock:
+            self._tables.pop(table_name_key, None)
+            self._headers.pop(table_name_key, None)
+        return self._table(table_name_key)
+
+    def load_dataframe(self, table_name_key: str, df: pd.DataFrame, replace: bool = True) -> int:
+        """Carga un DataFrame con los headers del Excel (p. ej. read_table de otro backend)."""
+        table = self.create_table(table_name_key, list(df.columns), replace=replace)
+        headers_norm = [norm_key(c) for c in df.columns]
+        rows = ({hn: v for hn, v in zip(headers_norm, values)} for values in df.itertuples(index=False, name=None))
+        return self._insert(table, rows)
+
+    def _prepare(self, table: "sa.Table", data_norm: dict) -> dict:
+        # como TableSchema.row_from_norm: las claves que no son columnas de la tabla se ignoran
+        row = {k: _sql_value(v) for k, v in data_norm.items() if k in table.c and k != POS_COL}
+        if CODIGO_COL in row and row[CODIGO_COL] is not None:
+            row[CODIGO_COL] = normalizar_codigo_valor(row[CODIGO_COL])
+        return row
+
+    def _insert(self, table: "sa.Table", rows_norm) -> int:
+        # executemany arma el INSERT con las claves de la primera fila: todas llevan las
+        # mismas columnas (None donde la fila no trae dato)
+        cols = [c.name for c in table.columns if c.name != POS_COL]
+        total, chunk = 0, []
+        with self.engine.begin() as conn:
+            for data_norm in rows_norm:
+                row = self._prepare(table, data_norm)
+                chunk.append({c: row.get(c) for c in cols})
+                if len(chunk) >= INSERT_CHUNK:
+                    conn.execute(table.insert(), chunk)
+                    total, chunk = total + len(chunk), []
+            if chunk:
+                conn.execute(table.insert(), chunk)
+                total += len(chunk)
+        return total
+
+    # -----------------------------
+    # API de backend
+    # -----------------------------
+    def warm_up(self, table_name_keys=None) -> None:
+        pass
+
+    def _frame(self, table_name_key: str, cols: list, result) -> pd.DataFrame:
+        # columnas con el header original del Excel (como las devuelve Graph)
+        headers = self._header_map(table_name_key)
+        rows = result if isinstance(result, list) else result.all()
+        df = pd.DataFrame(rows, columns=[headers.get(c.name, c.name) for c in cols], dtype=object)
+        return df.fillna("")
+
+    def read_table(self, table_name_key: str, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+        table = self._table(table_name_key)
+        wanted = {norm_key(c) for c in columns} if columns else None
+        cols = [c for c in table.columns if c.name != POS_COL and (wanted is None or c.name in wanted)]
+        with self.engine.connect() as conn:
+            result = conn.execute(sa.select(*cols).order_by(table.c[POS_COL]))
+            return self._frame(table_name_key, cols, result)
+
+    def iter_table(self, table_name_key: str, chunk: int = 500):
+        # ventanas por _pos (keyset): cada consulta usa la clave primaria, sin OFFSET
+        table = self._table(table_name_key)
+        cols = [c for c in table.columns if c.name != POS_COL]
+        pos, last = table.c[POS_COL], None
+        while True:
+            stmt = sa.select(pos, *cols).order_by(pos).limit(chunk)
+            if last is not None:
+                stmt = stmt.where(pos > last)
+            with self.engine.connect() as conn:
+                rows = conn.execute(stmt).all()
+            if rows:
+                last = rows[-1][0]
+            yield self._frame(table_name_key, cols, [r[1:] for r in rows])
+            if len(rows) < chunk:
+                return
+
+    def query_historial(self, codigo: str, limit: int = 5, table_name_key="table_name_hist") -> tuple[pd.DataFrame, int]:
+        table = self._table(table_name_key)
+        if CODIGO_COL not in table.c:
+            raise ValueError("La tabla de historial no tiene la columna 'Id_UE'.")
+        cols = [c for c in table.columns if c.name != POS_COL]
+        stmt = (
+            sa.select(*cols)
+            .where(table.c[CODIGO_COL] == normalizar_codigo_valor(codigo))
+            .order_by(table.c[POS_COL])
+        )
+        with self.engine.connect() as conn:
+            df = self._frame(table_name_key, cols, conn.execute(stmt))
+        if df.empty:
+            return df, 0
+        pos = ultimas_posiciones(adaptar_historial_sharepoint(df), range(len(df)), limit)
+        return df.iloc[pos], len(df)
+
+    def prefetch_historial(self, codigos: list[str], limit: int = 5, cancelled=None, table_name_key="table_name_hist") -> int:
+        # Las consultas por codigo usan el índice: no hay nada que adelantar
+        return len(codigos)
+
+    def append_row(self, row_by_app_key: dict, table_name_key="table_name_hist") -> None:
+        self.append_rows([row_by_app_key], table_name_key)
+
+    def append_rows(self, rows_by_app_key: list[dict], table_name_key="table_name_hist") -> None:
+        table = self._table(table_name_key)
+        self._insert(table, (app_row_to_excel_norm(r) for r in rows_by_app_key))
+
+    def has_idregistro(self, id_registro: str, table_name_key="table_name_hist") -> bool:
+        table = self._table(table_name_key)
+        if "idregistro" not in table.c:
+            raise ValueError("La tabla no tiene columna 'IdRegistro'.")
+        stmt = sa.select(table.c[POS_COL]).where(table.c.idregistro == str(id_registro).strip()).limit(1)
+        with self.engine.connect() as conn:
+            return conn.execute(stmt).first() is not None
+
+    def update_row_by_idregistro(
+        self,
+        updates_by_app_key: dict,
+        id_registro: str,
+        appkey_to_excelnorm: dict | None = None,
+        table_name_key="table_name_hist",
+        expected_last_updated=None,
+    ) -> None:
+        table = self._table(table_name_key)
+        if "idregistro" not in table.c:
+            raise ValueError("La tabla no tiene columna 'IdRegistro' (requerida para actualizar).")
+        lu = table.c.get("lastupdated")
+        if expected_last_updated is not None and lu is None:
+            raise ValueError("La tabla no tiene columna 'LastUpdated' (requerida para compare-and-set).")
+
+        id_registro = str(id_registro).strip()
+        values = self._prepare(table, app_row_to_excel_norm(updates_by_app_key, appkey_to_excelnorm))
+        values.pop("idregistro", None)
+
+        with self.engine.begin() as conn:
+            cols = [table.c[POS_COL]] + ([lu] if lu is not None else [])
+            stmt = sa.select(*cols).where(table.c.idregistro == id_registro).order_by(table.c[POS_COL]).limit(1)
+            found = conn.execute(stmt.with_for_update()).first()
+            if found is None:
+                raise ValueError(f"No se encontró IdRegistro={id_registro} en la tabla.")
+
+            where = table.c[POS_COL] == found[0]
+            if expected_last_updated is not None:
+                actual = found[1]
+                if not _same_last_updated("" if actual is None else actual, expected_last_updated):
+                    raise UpdateConflictError(id_registro, expected_last_updated, actual)
+                # compare-and-set atómico también donde no hay SELECT ... FOR UPDATE (SQLite)
+                where = where & (lu.is_(None) if actual is None else lu == actual)
+
+            if values and conn.execute(table.update().where(where).values(**values)).rowcount == 0:
+                actual = conn.execute(sa.select(lu).where(table.c[POS_COL] == found[0])).scalar()
+                raise UpdateConflictError(id_registro, expected_last_updated, actual)
@@ -0,0 +1,438 @@
+"""
+Backends de almacenamiento para las tablas de la app.
+
+Todos exponen la misma API que usa app.py:
+    read_table(table_name_key, columns=None) -> DataFrame con los headers reales
+    iter_table(table_name_key, chunk=500) -> DataFrames de hasta `chunk` filas (exportes sin la tabla entera en memoria)
+    query_historial(codigo, limit=5, table_name_key="table_name_hist") -> (últimos registros del pliego, total)
+    prefetch_historial(codigos, limit=5, cancelled=None, table_name_key="table_name_hist")
+    append_row(row_by_app_key, table_name_key="table_name_hist")
+    append_rows(rows_by_app_key, table_name_key="table_name_hist")
+    has_idregistro(id_registro, table_name_key="table_name_hist")
+    update_row_by_idregistro(updates_by_app_key, id_registro, appkey_to_excelnorm=None, table_name_key="table_name_hist",
+                             expected_last_updated=None)   (compare-and-set; UpdateConflictError si no coincide)
+
+- SharePointBackend: Graph (sharepoint_excel.py), con las cachés del proceso.
+- LocalWorkbookBackend: los .xlsx de data/ vía openpyxl (lectura read_only; las escrituras
+  editan solo las celdas de la hoja de la tabla). Sirve para pruebas de carga/benchmarks
+  sin red y como respaldo de lectura cuando Graph está degradado.
+- SqlBackend (sql_backend.py): SQLite/PostgreSQL vía SQLAlchemy, con índices.
+
+Se elige con secrets["sharepoint"]["backend"] = "sharepoint" (default) | "local" | "sql".
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+import requests
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter, range_boundaries
+
+from sharepoint_excel import (
+    TableSchema,
+    UpdateConflictError,
+    app_row_to_excel_norm,
+    norm_key,
+    resolve_graph_context,
+    read_table_columns_as_df,
+    enable_workbook_sessions,
+    append_row_to_sharepoint_excel,
+    append_rows_to_sharepoint_excel,
+    idregistro_exists,
+    update_row_in_table_by_idregistro,
+    _same_last_updated,
+)
+from sql_backend import SqlBackend
+from adapters.historial_sharepoint import (
+    historial_indexado,
+    normalizar_codigo_valor,
+    ultimas_posiciones,
+)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# table_name_key -> "archivo.xlsx" o "archivo.xlsx!Hoja" (sin hoja = primera hoja).
+# Las hojas tienen los headers del Excel de SharePoint:
+# - historial_it_pei.xlsx!Hoja1: las columnas de la tabla de historial, con Fecha Oficio,
+#   Número Oficio, IdRegistro, LastUpdated y UpdatedBy (vacías en los datos de ejemplo);
+#   Sheet1 es una copia antigua con nombres del app y no sirve para escribir;
+# - unidades_ejecutoras.xlsx: codigo, nombre, NG, nombre_sector, nombre_departamento,
+#   Responsable_Institucional, PEI ("S" en las UE que tienen registros en el historial de
+#   ejemplo) y Estado_PEI (vacío: el filtro "en proceso" no muestra opciones).
+DEFAULT_LOCAL_TABLES = {
+    "table_name_hist": "data/historial_it_pei.xlsx!Hoja1",
+    "table_name_ue": "data/unidades_ejecutoras.xlsx",
+    "table_name_resp": "data/responsables.xlsx",
+}
+
+
+class SharePointBackend:
+    def __init__(self, secrets):
+        self.secrets = secrets
+        self.sp = dict(secrets["sharepoint"])
+        # Sesión de libro compartida (evita que Excel Online abra el archivo en cada request)
+        enable_workbook_sessions(bool(self.sp.get("workbook_session", True)))
+
+    def warm_up(self, table_name_keys=("table_name_ue", "table_name_hist")) -> None:
+        """Pre-carga a la vez la versión del archivo y los headers de las tablas (opcional)."""
+        from graph_async import warm_table_schemas
+
+        try:
+            token, site_id, item_id = resolve_graph_context(self.sp)
+            warm_table_schemas(token, site_id, item_id, [self.sp[k] for k in table_name_keys if self.sp.get(k)])
+        except Exception:
+            pass    # cada lectura vuelve a pedir lo que falte
+
+    def read_table(self, table_name_key: str, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+        from historial_sync import get_historial_sync
+        from table_disk_cache import read_table_with_disk_cache
+
+        if table_name_key == "table_name_hist" and not columns:
+            # snapshot local que se sincroniza por incrementos
+            return get_historial_sync(self.sp, table_name_key).snapshot()
+
+        token, site_id, item_id = resolve_graph_context(self.sp)
+        return read_table_with_disk_cache(token, site_id, item_id, self.sp[table_name_key], columns)
+
+    def iter_table(self, table_name_key: str, chunk: int = 500):
+        # ventanas de filas por Graph (range de la tabla), sin bajar la tabla entera de una vez
+        table_name = self.sp.get(table_name_key)
+        if not table_name:
+            raise ValueError(f"Falta secrets['sharepoint'].{table_name_key}")
+        token, site_id, item_id = resolve_graph_context(self.sp)
+        start = 0
+        while True:
+            df = read_table_columns_as_df(token, site_id, item_id, table_name, row_start=start, row_count=chunk)
+            yield df
+            if len(df) < chunk:
+                return
+            start += chunk
+
+    def query_historial(self, codigo: str, limit: int = 5, table_name_key="table_name_hist") -> tuple[pd.DataFrame, int]:
+        from historial_sync import get_historial_sync
+
+        return get_historial_sync(self.sp, table_name_key).query(codigo, limit)
+
+    def prefetch_historial(self, codigos: list[str], limit: int = 5, cancelled=None, table_name_key="table_name_hist") -> int:
+        from historial_sync import get_historial_sync
+
+        return get_historial_sync(self.sp, table_name_key).prefetch(codigos, limit, cancelled)
+
+    def append_row(self, row_by_app_key: dict, table_name_key="table_name_hist") -> None:
+        from historial_sync import get_historial_sync
+
+        append_row_to_sharepoint_excel(self.secrets, row_by_app_key, table_name_key=table_name_key)
+        if table_name_key == "table_name_hist":
+            get_historial_sync(self.sp, table_name_key).apply_local_append(row_by_app_key)
+
+    def append_rows(self, rows_by_app_key: list[dict], table_name_key="table_name_hist") -> None:
+        from historial_sync import get_historial_sync
+
+        append_rows_to_sharepoint_excel(self.secrets, rows_by_app_key, table_name_key=table_name_key)
+        if table_name_key == "table_name_hist":
+            sync = get_historial_sync(self.sp, table_name_key)
+            for row in rows_by_app_key:
+                sync.apply_local_append(row)
+
+    def has_idregistro(self, id_registro: str, table_name_key="table_name_hist") -> bool:
+        return idregistro_exists(self.secrets, id_registro, table_name_key)
+
+    def update_row_by_idregistro(
+        self,
+        updates_by_app_key: dict,
+        id_registro: str,
+        appkey_to_excelnorm: dict | None = None,
+        table_name_key="table_name_hist",
+        expected_last_updated=None,
+    ) -> None:
+        from historial_sync import get_historial_sync
+
+        update_row_in_table_by_idregistro(
+            self.secrets,
+            updates_by_app_key=updates_by_app_key,
+            id_registro=id_registro,
+            appkey_to_excelnorm=appkey_to_excelnorm,
+            table_name_key=table_name_key,
+            expected_last_updated=expected_last_updated,
+        )
+        if table_name_key == "table_name_hist":
+            get_historial_sync(self.sp, table_name_key).apply_local_update(id_registro, updates_by_app_key, appkey_to_excelnorm)
+
+
+class LocalWorkbookBackend:
+    """
+    Tablas en libros .xlsx locales. Cada tabla es una hoja con los headers en la fila 1.
+    Las escrituras abren el libro completo, cambian solo las celdas afectadas de esa hoja
+    (fórmulas, formatos, validaciones, filas vacías y demás hojas quedan como estaban) y
+    lo reemplazan de forma atómica.
+    """
+
+    def __init__(self, tables: dict[str, str] | None = None, base_dir: str = BASE_DIR):
+        self.tables = dict(DEFAULT_LOCAL_TABLES if tables is None else tables)
+        self.base_dir = base_dir
+        self._cache: dict[tuple, tuple[float, pd.DataFrame]] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+
+    def warm_up(self, table_name_keys=None) -> None:
+        pass
+
+    def _location(self, table_name_key: str) -> tuple[str, str | None]:
+        spec = self.tables.get(table_name_key)
+        if not spec:
+            raise ValueError(f"No hay libro local configurado para '{table_name_key}'.")
+        path, _, sheet = spec.partition("!")
+        return os.path.join(self.base_dir, path), (sheet or None)
+
+    def _lock(self, path: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    @staticmethod
+    def _sheet(wb, sheet: str | None):
+        return wb[sheet] if sheet else wb.worksheets[0]
+
+    def read_table(self, table_name_key: str, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+        path, sheet = self._location(table_name_key)
+        mtime = os.path.getmtime(path)
+        key = (path, sheet, tuple(columns) if columns else None)
+        cached = self._cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = self._sheet(wb, sheet).iter_rows(values_only=True)
+            header_row = next(rows, None)
+            if header_row is None:
+                return pd.DataFrame()
+
+            headers = ["" if h is None else str(h).strip() for h in header_row]
+            wanted = {norm_key(c) for c in columns} if columns else None
+            cols = [i for i, h in enumerate(headers) if h and (wanted is None or norm_key(h) in wanted)]
+
+            data = []
+            for row in rows:
+                if row is None or all(v is None for v in row):
+                    continue
+                data.append(["" if i >= len(row) or row[i] is None else row[i] for i in cols])
+        finally:
+            wb.close()
+
+        df = pd.DataFrame(data, columns=[headers[i] for i in cols])
+        self._cache[key] = (mtime, df)
+        return df
+
+    def iter_table(self, table_name_key: str, chunk: int = 500):
+        # misma lectura que read_table (read_only, sin filas vacías) por bloques de filas
+        path, sheet = self._location(table_name_key)
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = self._sheet(wb, sheet).iter_rows(values_only=True)
+            headers = ["" if h is None else str(h).strip() for h in next(rows, None) or ()]
+            cols = [i for i, h in enumerate(headers) if h]
+            names = [headers[i] for i in cols]
+            data = []
+            for row in rows:
+                if row is None or all(v is None for v in row):
+                    continue
+                data.append(["" if i >= len(row) or row[i] is None else row[i] for i in cols])
+                if len(data) >= chunk:
+                    yield pd.DataFrame(data, columns=names)
+                    data = []
+            yield pd.DataFrame(data, columns=names)
+        finally:
+            wb.close()
+
+    def query_historial(self, codigo: str, limit: int = 5, table_name_key="table_name_hist") -> tuple[pd.DataFrame, int]:
+        df = self.read_table(table_name_key)
+        historial, indice = historial_indexado(df)
+        pos = indice.get(normalizar_codigo_valor(codigo), [])
+        return df.iloc[ultimas_posiciones(historial, pos, limit)], len(pos)
+
+    def prefetch_historial(self, codigos: list[str], limit: int = 5, cancelled=None, table_name_key="table_name_hist") -> int:
+        # Leer el libro y armar el índice por codigo es todo lo que se puede adelantar
+        historial_indexado(self.read_table(table_name_key))
+        return len(codigos)
+
+    def _schema(self, table_name_key: str) -> TableSchema:
+        path, sheet = self._location(table_name_key)
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            header_row = next(self._sheet(wb, sheet).iter_rows(max_row=1, values_only=True), ())
+        finally:
+            wb.close()
+        return TableSchema.from_headers(["" if h is None else str(h).strip() for h in header_row])
+
+    @contextmanager
+    def _editar(self, path: str, sheet: str | None):
+        """Entrega la hoja de la tabla para editar sus celdas y guarda el libro al salir (sin error)."""
+        wb = load_workbook(path)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            yield self._sheet(wb, sheet)
+            wb.save(tmp)
+            os.replace(tmp, path)
+        finally:
+            wb.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def _row_norm(schema: TableSchema, row_by_app_key: dict, appkey_to_excelnorm: dict | None = None) -> dict:
+        # una clave sin columna en la hoja se perdería en silencio: mejor fallar
+        data_norm = app_row_to_excel_norm(row_by_app_key, appkey_to_excelnorm)
+        faltan = schema.unknown_keys(data_norm)
+        if faltan:
+            raise ValueError(f"La hoja no tiene columnas para: {', '.join(faltan)} (headers: {', '.join(schema.headers)}).")
+        return data_norm
+
+    @staticmethod
+    def _ultima_fila(ws) -> int:
+        # última fila con algún valor (max_row cuenta también filas vacías con formato)
+        for r in range(ws.max_row, 1, -1):
+            if any(c.value is not None for c in ws[r]):
+                return r
+        return 1
+
+    def append_row(self, row_by_app_key: dict, table_name_key="table_name_hist") -> None:
+        self.append_rows([row_by_app_key], table_name_key)
+
+    def append_rows(self, rows_by_app_key: list[dict], table_name_key="table_name_hist") -> None:
+        path, sheet = self._location(table_name_key)
+        with self._lock(path):
+            schema = self._schema(table_name_key)
+            rows = [schema.row_from_norm(self._row_norm(schema, r)) for r in rows_by_app_key]
+            with self._editar(path, sheet) as ws:
+                last = r = self._ultima_fila(ws)
+                for row in rows:
+                    r += 1
+                    for c, v in enumerate(row, start=1):
+                        ws.cell(row=r, column=c, value=v)
+
+                # tablas de Excel de la hoja que terminaban en la última fila: se extienden
+                for table in ws.tables.values():
+                    min_col, min_row, max_col, max_row = range_boundaries(table.ref)
+                    if max_row == last:
+                        table.ref = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{r}"
+                        if table.autoFilter is not None:
+                            table.autoFilter.ref = table.ref
+
+    def has_idregistro(self, id_registro: str, table_name_key="table_name_hist") -> bool:
+        schema = self._schema(table_name_key)
+        id_col = schema.col("idregistro")
+        if id_col is None:
+            raise ValueError("La tabla no tiene columna 'IdRegistro'.")
+        ids = self.read_table(table_name_key, (schema.headers[id_col],)).iloc[:, 0].astype(str).str.strip()
+        return bool((ids == str(id_registro).strip()).any())
+
+    def update_row_by_idregistro(
+        self,
+        updates_by_app_key: dict,
+        id_registro: str,
+        appkey_to_excelnorm: dict | None = None,
+        table_name_key="table_name_hist",
+        expected_last_updated=None,
+    ) -> None:
+        path, sheet = self._location(table_name_key)
+        with self._lock(path):
+            schema = self._schema(table_name_key)
+            id_col = schema.col("idregistro")
+            if id_col is None:
+                raise ValueError("La tabla no tiene columna 'IdRegistro' (requerida para actualizar).")
+
+            lu_col = schema.col("lastupdated")
+            if expected_last_updated is not None and lu_col is None:
+                raise ValueError("La tabla no tiene columna 'LastUpdated' (requerida para compare-and-set).")
+
+            id_registro = str(id_registro).strip()
+            with self._editar(path, sheet) as ws:
+                fila = next(
+                    (cell.row for (cell,) in ws.iter_rows(min_row=2, min_col=id_col + 1, max_col=id_col + 1)
+                     if cell.value is not None and str(cell.value).strip() == id_registro),
+                    None,
+                )
+                if fila is None:
+                    raise ValueError(f"No se encontró IdRegistro={id_registro} en la tabla.")
+
+                # compare-and-set bajo el lock del archivo
+                if expected_last_updated is not None:
+                    actual = ws.cell(row=fila, column=lu_col + 1).value
+                    if not _same_last_updated("" if actual is None else actual, expected_last_updated):
+                        raise UpdateConflictError(id_registro, expected_last_updated, actual)
+
+                for hn, v in self._row_norm(schema, updates_by_app_key, appkey_to_excelnorm).items():
+                    c = schema.col(hn)
+                    if c is not None:
+                        ws.cell(row=fila, column=c + 1, value=v)
+
+
+class ReadFallbackBackend:
+    """Lee del backend principal y, si Graph falla, del respaldo local. Las escrituras van solo al principal."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    def read_table(self, table_name_key: str, columns: tuple[str, ...] | None = None) -> pd.DataFrame:
+        try:
+            return self.primary.read_table(table_name_key, columns)
+        except (requests.RequestException, RuntimeError):
+            return self.fallback.read_table(table_name_key, columns)
+
+    def iter_table(self, *args, **kwargs):
+        # exportes: siempre del principal (no se mezclan ventanas de dos fuentes)
+        return self.primary.iter_table(*args, **kwargs)
+
+    def query_historial(self, *args, **kwargs) -> tuple[pd.DataFrame, int]:
+        try:
+            return self.primary.query_historial(*args, **kwargs)
+        except (requests.RequestException, RuntimeError):
+            return self.fallback.query_historial(*args, **kwargs)
+
+    def warm_up(self, *args, **kwargs) -> None:
+        self.primary.warm_up(*args, **kwargs)
+
+    def prefetch_historial(self, *args, **kwargs) -> int:
+        return self.primary.prefetch_historial(*args, **kwargs)
+
+    def append_row(self, *args, **kwargs) -> None:
+        self.primary.append_row(*args, **kwargs)
+
+    def append_rows(self, *args, **kwargs) -> None:
+        self.primary.append_rows(*args, **kwargs)
+
+    def has_idregistro(self, *args, **kwargs) -> bool:
+        return self.primary.has_idregistro(*args, **kwargs)
+
+    def update_row_by_idregistro(self, *args, **kwargs) -> None:
+        self.primary.update_row_by_idregistro(*args, **kwargs)
+
+
+def get_backend(secrets):
+    """
+    Backend según secrets["sharepoint"]:
+      backend = "sharepoint" | "local" | "sql"
+      local_tables = {table_name_hist = "data/historial_it_pei.xlsx!Hoja1", ...}   (opcional)
+      local_fallback = true   (lecturas desde los libros locales si Graph falla)
+      sql_url = "sqlite:///data/it_pei.sqlite3" | "postgresql+psycopg2://..."   (backend "sql")
+      sql_tables = {table_name_hist = "historial", ...}   (opcional)
+    """
+    sp = secrets["sharepoint"]
+    kind = str(sp.get("backend", "sharepoint")).lower()
+    local_tables = dict(sp["local_tables"]) if sp.get("local_tables") else None
+
+    if kind == "local":
+        return LocalWorkbookBackend(local_tables)
+    if kind == "sql":
+        if not sp.get("sql_url"):
+            raise ValueError("Falta secrets['sharepoint'].sql_url")
+        return SqlBackend(sp["sql_url"], dict(sp["sql_tables"]) if sp.get("sql_tables") else None)
+    if kind != "sharepoint":
+        raise ValueError(f"Backend desconocido: {kind}")
+
+    backend = SharePointBackend(secrets)
+    if sp.get("local_fallback"):
+        return ReadFallbackBackend(backend, LocalWorkbookBackend(local_tables))
+    return backend
@@ -0,0 +1,168 @@
+"""
+Caché en disco (Arrow IPC, columnar) de tablas leídas de SharePoint.
+
+Cada snapshot se guarda como un archivo por (item_id, tabla, columnas) y versión del
+libro (cTag/eTag). Al arrancar se lee con memory map, sin esperar a Graph; luego se
+revalida en segundo plano con una llamada barata (solo eTag/cTag) y, si cambió, se
+descarga y se reemplaza el archivo para la próxima lectura.
+
+Si pyarrow no está instalado la caché queda desactivada y todo se lee de Graph.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+from sharepoint_excel import (
+    read_table_from_sharepoint_as_df_with_ids,
+    read_table_columns_as_df,
+    _graph_get_item_versions,
+)
+
+CACHE_DIR = os.environ.get("IT_PEI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "tables"))
+
+_revalidate_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="disk-cache")
+_revalidating: set[str] = set()
+_revalidating_lock = threading.Lock()
+
+
+def disk_cache_enabled() -> bool:
+    return pa is not None
+
+
+def _hash(*parts) -> str:
+    return hashlib.sha1("\x1f".join(str(p) for p in parts).encode()).hexdigest()[:16]
+
+
+def _key(item_id: str, table_name: str, columns: tuple[str, ...] | None) -> str:
+    return _hash(item_id, table_name, ",".join(columns) if columns else "*")
+
+
+def _version_tag(versions: dict) -> str | None:
+    # cTag solo cambia con el contenido; eTag también con metadata
+    return versions.get("cTag") or versions.get("eTag")
+
+
+def _paths_for(key: str) -> list[str]:
+    if not os.path.isdir(CACHE_DIR):
+        return []
+    return [os.path.join(CACHE_DIR, f) for f in os.listdir(CACHE_DIR) if f.startswith(key + "-") and f.endswith(".arrow")]
+
+
+def _to_arrow(df: pd.DataFrame) -> "pa.Table":
+    # Las columnas de Graph pueden mezclar números y texto: esas se guardan como texto
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        fixed = df.copy()
+        for c in fixed.columns:
+            try:
+                pa.array(fixed[c])
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                fixed[c] = fixed[c].map(lambda v: "" if v is None else str(v))
+        return pa.Table.from_pandas(fixed, preserve_index=False)
+
+
+def store_table_snapshot(item_id: str, table_name: str, tag: str, df: pd.DataFrame, columns=None) -> None:
+    """Guarda el snapshot (escritura atómica) y borra las versiones anteriores de la misma clave."""
+    if pa is None or not tag:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = _key(item_id, table_name, tuple(columns) if columns else None)
+    path = os.path.join(CACHE_DIR, f"{key}-{_hash(tag)}.arrow")
+
+    table = _to_arrow(df).replace_schema_metadata({b"tag": tag.encode(), b"table_name": table_name.encode()})
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with pa_ipc.new_file(tmp, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+
+    for old in _paths_for(key):
+        if old != path:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+def load_table_snapshot(item_id: str, table_name: str, columns=None) -> tuple[pd.DataFrame, str] | None:
+    """Último snapshot en disco para la clave (lectura con memory map). Devuelve (df, tag) o None."""
+    if pa is None:
+        return None
+    key = _key(item_id, table_name, tuple(columns) if columns else None)
+    paths = sorted(_paths_for(key), key=os.path.getmtime, reverse=True)
+    for path in paths:
+        try:
+            with pa.memory_map(path, "r") as source:
+                table = pa_ipc.open_file(source).read_all()
+                tag = (table.schema.metadata or {}).get(b"tag", b"").decode()
+                return table.to_pandas(), tag
+        except (OSError, pa.ArrowInvalid):
+            continue
+    return None
+
+
+def store_table_snapshot_async(item_id: str, table_name: str, tag: str, df: pd.DataFrame, columns=None) -> None:
+    if pa is not None and tag:
+        _revalidate_pool.submit(store_table_snapshot, item_id, table_name, tag, df, columns)
+
+
+def _fetch(token: str, site_id: str, item_id: str, table_name: str, columns) -> tuple[pd.DataFrame, str | None]:
+    tag = _version_tag(_graph_get_item_versions(token, site_id, item_id))
+    if columns:
+        df = read_table_columns_as_df(token, site_id, item_id, table_name, list(columns))
+    else:
+        df = read_table_from_sharepoint_as_df_with_ids(token, site_id, item_id, table_name)
+    return df, tag
+
+
+def _revalidate(token: str, site_id: str, item_id: str, table_name: str, columns, cached_tag: str, key: str) -> None:
+    try:
+        tag = _version_tag(_graph_get_item_versions(token, site_id, item_id))
+        if tag and tag != cached_tag:
+            df, tag = _fetch(token, site_id, item_id, table_name, columns)
+            store_table_snapshot(item_id, table_name, tag, df, columns)
+    except Exception:
+        pass    # la próxima lectura vuelve a intentar
+    finally:
+        with _revalidating_lock:
+            _revalidating.discard(key)
+
+
+def read_table_with_disk_cache(
+    token: str,
+    site_id: str,
+    item_id: str,
+    table_name: str,
+    columns: tuple[str, ...] | None = None,
+) -> pd.DataFrame:
+    """
+    Igual que read_table_from_sharepoint_as_df_with_ids / read_table_columns_as_df, pero
+    sirve primero el snapshot en disco (si existe) y lo revalida en segundo plano.
+    """
+    if pa is None:
+        return _fetch(token, site_id, item_id, table_name, columns)[0]
+
+    hit = load_table_snapshot(item_id, table_name, columns)
+    if hit is not None:
+        df, cached_tag = hit
+        key = _key(item_id, table_name, tuple(columns) if columns else None)
+        with _revalidating_lock:
+            start = key not in _revalidating
+            _revalidating.add(key)
+        if start:
+            _revalidate_pool.submit(_revalidate, token, site_id, item_id, table_name, columns, cached_tag, key)
+        return df
+
+    df, tag = _fetch(token, site_id, item_id, table_name, columns)
+    if tag:
+        store_table_snapshot(item_id, table_name, tag, df, columns)
+    return df
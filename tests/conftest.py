@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def graph_stub(monkeypatch):
+    """
+    Arranca scripts/graph_stub.py con las tablas dadas y apunta sharepoint_excel a él
+    (sin sesiones de libro ni caches de esquema/índice de otra prueba).
+    """
+    import sharepoint_excel as se
+    from scripts.graph_stub import GraphStub
+
+    started = []
+
+    def start(tables: dict, **kwargs) -> GraphStub:
+        stub = GraphStub(tables=tables, **kwargs).start()
+        started.append(stub)
+        monkeypatch.setattr(se, "_graph_client", se.GraphClient(base_url=stub.base_url))
+        monkeypatch.setattr(se, "resolve_graph_context", lambda sp: ("t", "site", "item"))
+        se.enable_workbook_sessions(False)
+        se.invalidate_table_schema()
+        se.invalidate_idregistro_index()
+        return stub
+
+    yield start
+    for stub in started:
+        stub.stop()
+    se.invalidate_table_schema()
+    se.invalidate_idregistro_index()
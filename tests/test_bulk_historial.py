@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from scripts.bulk_historial import columnas_sin_destino, iter_filas
+from sql_backend import SqlBackend
+from storage_backends import LocalWorkbookBackend
+
+
+def test_iter_filas_numera_como_el_archivo(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Id_UE", "Periodo PEI"])
+    ws.append(["1314", "2024-2026"])
+    ws.append([])
+    ws.append([None, ""])
+    ws.append(["1315", "2025-2027"])
+    path = tmp_path / "nuevos.xlsx"
+    wb.save(path)
+
+    assert [(linea, fila["id_ue"]) for linea, fila in iter_filas(str(path))] == [(2, "1314"), (5, "1315")]
+
+
+def test_iter_table_por_ventanas(tmp_path):
+    df = pd.DataFrame({"Id_UE": [str(i) for i in range(7)], "IdRegistro": [f"r{i}" for i in range(7)]})
+
+    sql = SqlBackend(f"sqlite:///{tmp_path / 'app.db'}")
+    sql.load_dataframe("table_name_hist", df)
+
+    wb = Workbook()
+    wb.active.append(list(df.columns))
+    for row in df.itertuples(index=False, name=None):
+        wb.active.append(list(row))
+    wb.save(tmp_path / "hist.xlsx")
+    local = LocalWorkbookBackend({"table_name_hist": "hist.xlsx"}, base_dir=str(tmp_path))
+
+    for backend in (sql, local):
+        ventanas = list(backend.iter_table("table_name_hist", chunk=3))
+        assert [len(v) for v in ventanas] == [3, 3, 1]
+        assert list(ventanas[0].columns) == ["Id_UE", "IdRegistro"]
+        assert pd.concat(ventanas)["IdRegistro"].tolist() == df["IdRegistro"].tolist()
+
+
+def test_columnas_sin_destino(tmp_path):
+    wb = Workbook()
+    wb.active.append(["Id_UE", "Periodo PEI", "IdRegistro", "LastUpdated", "UpdatedBy"])
+    wb.save(tmp_path / "hist.xlsx")
+    local = LocalWorkbookBackend({"table_name_hist": "hist.xlsx"}, base_dir=str(tmp_path))
+
+    # claves del app o del Excel, ya con alias
+    assert columnas_sin_destino(local, "table_name_hist", ["id_ue", "periodo_pei"]) == []
+    assert columnas_sin_destino(local, "table_name_hist", ["id_ue", "fecha_de_recepcion"]) == ["fecha_de_recepcion"]
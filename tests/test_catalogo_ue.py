@@ -0,0 +1,19 @@
+import pandas as pd
+
+from adapters.catalogo_ue import CatalogoUE
+
+
+def test_fila_del_catalogo_es_la_del_responsable():
+    df = pd.DataFrame({
+        "Id_UE": ["1314", "1314"],
+        "Nombre_Pliego": ["UE uno", "UE uno"],
+        "NG": ["Gobierno nacional", "Gobierno regional"],
+        "PEI": ["S", "S"],
+        "Responsable Institucional": ["Ana", "Luis"],
+        "Nombre_Departamento": ["Lima", "Lima"],
+    })
+    catalogo = CatalogoUE.desde_tabla(df)
+    opcion = catalogo.opciones("Luis")[0]
+    assert catalogo.fila("Luis", opcion)["NG"] == "Gobierno regional"
+    assert catalogo.fila("Ana", opcion)["NG"] == "Gobierno nacional"
+    assert catalogo.fila("Ana", opcion, solo_en_proceso=True) is None
@@ -0,0 +1,38 @@
+import requests
+
+import sharepoint_excel as se
+
+SECRETS = {"sharepoint": {"table_name_hist": "Historial"}}
+HEADERS = ["Id_UE", "Periodo PEI", "Estado", "IdRegistro"]
+SAVES = 10
+
+
+class SinPoolClient(se.GraphClient):
+    # una conexión nueva por request (como requests.get/post sueltos)
+    def request(self, method, path, token, headers=None, **kwargs):
+        h = {"Authorization": f"Bearer {token}", **(headers or {})}
+        r = requests.request(method, self.url(path), headers=h, **kwargs)
+        r.raise_for_status()
+        return r
+
+
+def _guardar(stub, n):
+    stub.reset_counters()
+    for i in range(n):
+        se.append_row_to_sharepoint_excel(SECRETS, {"codigo": "1314", "estado": "En proceso", "id_registro": f"r{i}"})
+    return stub.counters["connections"], stub.counters["requests"]
+
+
+def test_cliente_con_pool_reusa_una_conexion_entre_guardados(graph_stub):
+    stub = graph_stub({"Historial": {"headers": list(HEADERS), "rows": []}})
+    conns, reqs = _guardar(stub, SAVES)
+    assert len(stub.tables["Historial"]["rows"]) == SAVES
+    assert reqs >= SAVES
+    assert conns == 1
+
+
+def test_sin_pool_abre_una_conexion_por_request(graph_stub, monkeypatch):
+    stub = graph_stub({"Historial": {"headers": list(HEADERS), "rows": []}})
+    monkeypatch.setattr(se, "_graph_client", SinPoolClient(base_url=stub.base_url))
+    conns, reqs = _guardar(stub, SAVES)
+    assert conns == reqs >= SAVES
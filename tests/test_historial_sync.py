@@ -0,0 +1,57 @@
+import pandas as pd
+import pytest
+
+from historial_sync import HistorialSync
+
+
+def _sync():
+    sync = HistorialSync({"table_name_hist": "Historial"})
+    sync._set(pd.DataFrame({"Id_UE": ["1314"], "Estado": ["En revisión"], "Nota": [""], "IdRegistro": ["r1"]}))
+    return sync
+
+
+def test_append_no_duplica_una_fila_ya_sincronizada():
+    sync = _sync()
+    sync.apply_local_append({"codigo": "1314", "estado": "Emitido", "id_registro": "r1"})
+    sync.apply_local_append({"codigo": "1315", "estado": "Emitido", "id_registro": "r2"})
+    assert sync.df["IdRegistro"].tolist() == ["r1", "r2"]
+
+
+def test_update_usa_el_alias_del_llamador():
+    sync = _sync()
+    sync.apply_local_update("r1", {"comentario_libre": "ok"}, appkey_to_excelnorm={"comentario_libre": "nota"})
+    assert sync.df.loc[0, "Nota"] == "ok"
+
+
+@pytest.fixture
+def stub(graph_stub, monkeypatch):
+    import historial_sync
+
+    monkeypatch.setattr(historial_sync, "resolve_graph_context", lambda sp: ("t", "site", "item"))
+    return graph_stub({"Historial": {
+        "headers": ["Id_UE", "Fecha de recepción", "Estado", "IdRegistro"],
+        "rows": [["1314", "2024-01-10", "En revisión", "r1"], ["1315", "2024-01-11", "Emitido", "r2"]],
+    }})
+
+
+def test_consulta_por_pliego_ve_el_guardado_local_sin_cambio_de_ctag(stub):
+    # Sin snapshot (df None): el guardado llega al Excel pero el cTag aún no cambió
+    sync = HistorialSync({"table_name_hist": "Historial"})
+    df, total = sync.query("1314")
+    assert (df["Estado"].tolist(), total) == (["En revisión"], 1)
+
+    stub.tables["Historial"]["rows"][0][2] = "Emitido"
+    sync.apply_local_update("r1", {"estado": "Emitido"})
+    assert sync.query("1314")[0]["Estado"].tolist() == ["Emitido"]
+
+    stub.tables["Historial"]["rows"].append(["1314", "2024-02-01", "En revisión", "r3"])
+    sync.apply_local_append({"codigo": "1314", "fecha_recepcion": "2024-02-01", "id_registro": "r3"})
+    df, total = sync.query("1314")
+    assert total == 2 and "r3" in df["IdRegistro"].tolist()
+
+
+def test_update_local_solo_descarta_las_consultas_con_esa_fila(stub):
+    sync = HistorialSync({"table_name_hist": "Historial"})
+    sync.prefetch(["1314", "1315"])
+    sync.apply_local_update("r2", {"estado": "Observado"})
+    assert set(sync._consultas) == {("1314", 5)}
@@ -0,0 +1,112 @@
+import os
+import shutil
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font
+import pytest
+
+from adapters.catalogo_ue import CatalogoUE
+from adapters.historial_sharepoint import adaptar_historial_sharepoint, columnas_excel_para
+from sharepoint_excel import UpdateConflictError
+from storage_backends import LocalWorkbookBackend
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def libro(tmp_path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Historial"
+    ws.append(["Id_UE", "Estado", "Monto", "Doble", "IdRegistro", "LastUpdated"])
+    ws.append(["1314", "En revisión", 10, "=C2*2", "r1", "t1"])
+    ws.append([])   # fila vacía intermedia
+    ws.append(["1315", "Emitido", 20, "=C4*2", "r2", "t2"])
+    ws["B2"].font = Font(bold=True)
+    otra = wb.create_sheet("Resumen")
+    otra["A1"] = "Total"
+    otra["B1"] = "=SUM(Historial!C:C)"
+    path = tmp_path / "historial.xlsx"
+    wb.save(path)
+    return path
+
+
+@pytest.fixture
+def backend(libro):
+    return LocalWorkbookBackend({"table_name_hist": libro.name}, base_dir=str(libro.parent))
+
+
+def test_append_conserva_formulas_formatos_y_otras_hojas(libro, backend):
+    backend.append_row({"codigo": "1316", "estado": "Emitido", "id_registro": "r3", "last_updated": "t3"})
+
+    wb = load_workbook(libro)
+    ws = wb["Historial"]
+    assert ws["D2"].value == "=C2*2" and ws["D4"].value == "=C4*2"
+    assert ws["B2"].font.bold
+    assert all(c.value is None for c in ws[3])
+    assert [c.value for c in ws[5]][:2] == ["1316", "Emitido"] and ws["E5"].value == "r3"
+    assert wb["Resumen"]["B1"].value == "=SUM(Historial!C:C)"
+
+    assert backend.read_table("table_name_hist")["IdRegistro"].tolist() == ["r1", "r2", "r3"]
+
+
+def test_update_despues_de_fila_vacia(libro, backend):
+    backend.update_row_by_idregistro({"estado": "Observado"}, "r2", expected_last_updated="t2")
+    with pytest.raises(UpdateConflictError):
+        backend.update_row_by_idregistro({"estado": "X"}, "r1", expected_last_updated="viejo")
+
+    ws = load_workbook(libro)["Historial"]
+    assert [ws["B2"].value, ws["B4"].value] == ["En revisión", "Observado"]
+    assert ws["D4"].value == "=C4*2"
+
+
+# -----------------------------
+# Libros incluidos en data/
+# -----------------------------
+UE_COLUMNS = ("codigo", "nombre", "NG", "PEI", "Estado_PEI", "responsable_institucional", "nombre_departamento", "nombre_sector")
+
+
+@pytest.fixture
+def data_local(tmp_path):
+    shutil.copytree(os.path.join(ROOT, "data"), tmp_path / "data")
+    return LocalWorkbookBackend(base_dir=str(tmp_path))
+
+
+def test_libros_incluidos_alimentan_la_app(data_local):
+    catalogo = CatalogoUE.desde_tabla(data_local.read_table("table_name_ue", columnas_excel_para(UE_COLUMNS)))
+    assert catalogo.responsables
+    opcion = catalogo.opciones(catalogo.responsables[0])[0]
+    assert catalogo.fila(catalogo.responsables[0], opcion)["nombre_departamento"]
+
+    historial, total = data_local.query_historial("1314")
+    assert total > 0
+    assert adaptar_historial_sharepoint(historial)["codigo"].astype(str).eq("1314").all()
+
+
+def test_append_en_el_historial_incluido_guarda_todas_las_columnas(data_local):
+    n = len(data_local.read_table("table_name_hist"))
+    fila = {
+        "codigo": "9999", "nombre": "UE de prueba", "año": 2026, "periodo": "2026-2028", "tipo_pei": "FORMULADO",
+        "estado": "Emitido", "fecha_recepcion": "2026-01-15", "fecha_it": "2026-02-01", "numero_it": "001-2026",
+        "fecha_oficio": "2026-02-02", "numero_oficio": "OF-1",
+        "id_registro": "r-9999", "last_updated": "2026-02-01 10:00:00", "updated_by": "test",
+    }
+    data_local.append_row(fila)
+
+    df = data_local.read_table("table_name_hist")
+    assert len(df) == n + 1
+    guardada = adaptar_historial_sharepoint(df).iloc[-1]
+    for k in ("periodo", "tipo_pei", "fecha_recepcion", "fecha_it", "fecha_oficio", "id_registro", "last_updated"):
+        assert str(guardada[k]) == str(fila[k]), k
+    assert str(guardada["codigo"]) == "9999"
+    assert guardada["nombre_unidad_ejecutora"] == "UE de prueba"     # "nombre" del app -> Nombre_unidad_ejecutora
+
+    data_local.update_row_by_idregistro({"estado": "Observado"}, "r-9999", expected_last_updated="2026-02-01 10:00:00")
+    assert adaptar_historial_sharepoint(data_local.read_table("table_name_hist")).iloc[-1]["estado"] == "Observado"
+
+
+def test_append_con_columna_inexistente_falla_sin_escribir(data_local):
+    n = len(data_local.read_table("table_name_hist"))
+    with pytest.raises(ValueError, match="columna_que_no_existe"):
+        data_local.append_row({"codigo": "9999", "columna_que_no_existe": "x", "id_registro": "r1"})
+    assert len(data_local.read_table("table_name_hist")) == n
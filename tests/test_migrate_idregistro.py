@@ -0,0 +1,48 @@
+import pytest
+
+import sharepoint_excel as se
+from scripts import migrate_idregistro as mig
+
+SP = {"site_hostname": "h", "site_path": "/sites/x", "file_path": "/f.xlsx", "table_name": "Historial"}
+
+
+@pytest.fixture
+def stub(graph_stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(mig, "graph_get_token", lambda sp: "t")
+    monkeypatch.setattr(mig, "graph_get_site_id", lambda token, host, path: "site")
+    monkeypatch.setattr(mig, "graph_get_drive_item_id_by_path", lambda token, site_id, path: "item")
+    monkeypatch.setattr(mig, "CHECKPOINT_DIR", str(tmp_path))
+    return graph_stub({"Historial": {
+        "headers": ["Id_UE", "IdRegistro", "LastUpdated", "UpdatedBy"],
+        "rows": [["1314", "", "", ""], ["1315", "", "", ""]],
+    }})
+
+
+def _ids(stub):
+    return [r[1] for r in stub.tables["Historial"]["rows"]]
+
+
+def test_reanudar_tras_corrida_cortada_no_repite_uuid_si_se_corrieron_las_filas(stub, monkeypatch):
+    # 1ra corrida: escribe y se corta antes de verificar
+    def corte(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(mig, "get_table_rows_by_index", corte)
+    with pytest.raises(KeyboardInterrupt):
+        mig.migrate_fill_idregistro(SP, "", dry_run=False)
+    primeros = _ids(stub)
+    assert all(primeros)
+
+    # Entre corridas se inserta una fila vacía arriba: los UUID quedan una posición más abajo
+    stub.tables["Historial"]["rows"].insert(0, ["1316", "", "", ""])
+    monkeypatch.setattr(mig, "get_table_rows_by_index", se.get_table_rows_by_index)
+    mig.migrate_fill_idregistro(SP, "", dry_run=False)
+
+    ids = _ids(stub)
+    assert ids[1:] == primeros
+    assert ids[0] and ids[0] not in primeros
+    ckpt = mig.Checkpoint(mig.checkpoint_path("item", "Historial"))
+    assert {i: (e["id"], e["state"]) for i, e in ckpt.rows.items()} == {
+        0: (ids[0], "verified"),
+        1: (primeros[0], "verified"),
+    }
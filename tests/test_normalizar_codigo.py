@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from adapters.historial_sharepoint import normalizar_codigo, normalizar_codigo_valor
+
+VALORES = [
+    1314, 1314.0, " 1314 ", "1314.0", "1e3", 1.9, -1.9, "-0.5", 10**18,
+    10**20, -10**20, 2**63, 1e20, "100000000000000000000",
+    True, False, np.bool_(True),
+    "١٢٣", "１２３", "1_000",
+    None, np.nan, pd.NA, "", "abc", " x1 ", float("inf"), "inf", "nan",
+]
+
+
+def test_paridad_con_normalizar_codigo_valor():
+    s = pd.Series(VALORES, dtype=object)
+    esperado = [normalizar_codigo_valor(v) for v in VALORES]
+    assert normalizar_codigo(s).astype(str).tolist() == esperado
@@ -0,0 +1,31 @@
+import time
+
+import pandas as pd
+
+from shared_table_cache import SharedTableCache
+
+
+def test_get_no_altera_el_snapshot_compartido():
+    cache = SharedTableCache(lambda key: pd.DataFrame({"codigo": ["1314", "1315"], "n": [1, 2]}))
+    a = cache.get("t")
+    a.loc[0, "n"] = 99
+    a["codigo"] = "x"
+    assert cache.get("t")["n"].tolist() == [1, 2]
+    assert cache.get("t")["codigo"].tolist() == ["1314", "1315"]
+
+
+def test_version_sube_con_cada_snapshot():
+    cargas = iter(range(10))
+    cache = SharedTableCache(lambda key: pd.DataFrame({"n": [next(cargas)]}))
+    v1, _ = cache.get_versioned("t")
+    assert cache.get_versioned("t")[0] == v1
+
+    cache.invalidate("t")
+    v, df = cache.get_versioned("t")       # sirve el snapshot anterior y refresca en segundo plano
+    assert v == v1 and df["n"].tolist() == [0]
+    for _ in range(200):
+        v2, df2 = cache.get_versioned("t")
+        if v2 != v1:
+            break
+        time.sleep(0.01)
+    assert v2 == v1 + 1 and df2["n"].tolist() == [1]
@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+import sharepoint_excel as se
+
+SECRETS = {"sharepoint": {"table_name_hist": "Historial"}}
+HEADERS = ["Id_UE", "Estado", "Nota", "IdRegistro", "LastUpdated"]
+
+
+def _tabla(*rows):
+    return {"Historial": {"headers": list(HEADERS), "rows": [list(r) for r in rows]}}
+
+
+def test_update_en_lote_no_pisa_celdas_editadas_entre_lectura_y_escritura(graph_stub, monkeypatch):
+    stub = graph_stub(_tabla(["1314", "En revisión", "", "r1", ""]))
+    rows = stub.tables["Historial"]["rows"]
+    leer = se.get_table_rows_by_index
+
+    def leer_y_editar(*args, **kwargs):
+        out = leer(*args, **kwargs)
+        rows[0][2] = "nota de otro usuario"
+        return out
+
+    monkeypatch.setattr(se, "get_table_rows_by_index", leer_y_editar)
+    results = se.update_rows_in_table_by_idregistro(SECRETS, {"r1": {"estado": "Emitido"}})
+    assert results["r1"].ok
+    assert rows[0] == ["1314", "Emitido", "nota de otro usuario", "r1", ""]
+
+
+def test_cas_reubica_la_fila_si_se_corrio_el_indice(graph_stub):
+    stub = graph_stub(_tabla(["1314", "En revisión", "", "r1", ""], ["1315", "En revisión", "", "r2", ""]))
+    rows = stub.tables["Historial"]["rows"]
+    se.update_row_in_table_by_idregistro(SECRETS, {"nota": "a"}, "r2")    # arma el índice: r2 -> 1
+
+    rows.insert(0, ["1316", "En revisión", "", "r3", ""])
+    se.update_row_in_table_by_idregistro(SECRETS, {"estado": "Emitido"}, "r2")
+    assert [r[1] for r in rows] == ["En revisión", "En revisión", "Emitido"]
+    assert rows[2][3] == "r2"
+
+
+def test_cas_rechaza_si_last_updated_no_coincide(graph_stub):
+    stub = graph_stub(_tabla(["1314", "En revisión", "", "r1", "2024-05-01 10:00:00"]))
+    with pytest.raises(se.UpdateConflictError) as e:
+        se.update_row_in_table_by_idregistro(
+            SECRETS, {"estado": "Emitido"}, "r1", expected_last_updated="2024-05-01 09:00:00"
+        )
+    assert e.value.actual == "2024-05-01 10:00:00"
+    assert stub.tables["Historial"]["rows"][0][1] == "En revisión"
+
+
+def test_cas_acepta_last_updated_como_serial_de_excel(graph_stub):
+    serial = (pd.Timestamp("2024-05-01 10:00:00") - pd.Timestamp("1899-12-30")) / pd.Timedelta(days=1)
+    stub = graph_stub(_tabla(["1314", "En revisión", "", "r1", serial]))
+    se.update_row_in_table_by_idregistro(
+        SECRETS, {"estado": "Emitido"}, "r1", expected_last_updated="2024-05-01 10:00:00"
+    )
+    assert stub.tables["Historial"]["rows"][0][1] == "Emitido"
+
+
+def test_same_last_updated_texto_vs_serial():
+    serial = (pd.Timestamp("2024-05-01 10:00:00") - pd.Timestamp("1899-12-30")) / pd.Timedelta(days=1)
+    assert se._same_last_updated(serial, "2024-05-01 10:00:00")
+    assert se._same_last_updated(" 2024-05-01 10:00:00", "2024-05-01T10:00:00")
+    assert not se._same_last_updated(serial, "2024-05-01 10:01:00")
+    assert not se._same_last_updated("", "2024-05-01 10:00:00")
+    assert not se._same_last_updated("pendiente", "2024-05-01 10:00:00")
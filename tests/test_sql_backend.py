@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from adapters.catalogo_ue import CatalogoUE
+from adapters.historial_sharepoint import adaptar_historial_sharepoint, columnas_excel_para
+from sql_backend import SqlBackend
+
+# mismas columnas que pide app.py (UE_COLUMNS)
+UE_COLUMNS = ("codigo", "nombre", "NG", "PEI", "Estado_PEI", "responsable_institucional", "nombre_departamento", "nombre_sector")
+
+
+@pytest.fixture
+def backend(tmp_path):
+    store = SqlBackend(f"sqlite:///{tmp_path / 'app.db'}")
+    store.load_dataframe("table_name_ue", pd.DataFrame({
+        "Id_UE": ["1314", "1315.0", "1316"],
+        "Nombre_Pliego": ["UE uno", "UE dos", "UE tres"],
+        "NG": ["GN", "GR", "GL"],
+        "PEI": ["S", "s", "N"],
+        "Estado_PEI": ["En proceso", "Vigente", ""],
+        "Responsable Institucional": ["Ana", "Ana", "Luis"],
+        "Nombre_Departamento": ["Lima", "Cusco", "Puno"],
+        "Nombre_Sector": ["Salud", "Salud", "Educación"],
+    }))
+    store.load_dataframe("table_name_hist", pd.DataFrame({
+        "Id_UE": ["1314", "1314.0", "1315"],
+        "Fecha de recepción": ["2024-01-10", "2024-03-05", "2024-02-01"],
+        "Estado": ["En revisión", "Emitido", "En revisión"],
+        "IdRegistro": ["r1", "r2", "r3"],
+        "LastUpdated": ["t1", "t2", "t3"],
+    }))
+    return store
+
+
+def test_read_table_devuelve_headers_del_excel(backend):
+    df = backend.read_table("table_name_ue", columnas_excel_para(UE_COLUMNS))
+    assert "PEI" in df.columns and "Id_UE" in df.columns and "Responsable Institucional" in df.columns
+
+    catalogo = CatalogoUE.desde_tabla(df)
+    assert catalogo.responsables == ["Ana"]
+    assert catalogo.opciones("Ana") == ["1314 - UE uno - Lima", "1315 - UE dos - Cusco"]
+    assert catalogo.opciones("Ana", solo_en_proceso=True) == ["1314 - UE uno - Lima"]
+
+
+def test_query_historial_se_adapta_como_graph(backend):
+    df, total = backend.query_historial("1314.0")
+    assert total == 2
+    assert list(df.columns) == ["Id_UE", "Fecha de recepción", "Estado", "IdRegistro", "LastUpdated"]
+
+    historial = adaptar_historial_sharepoint(df)
+    assert historial["codigo"].astype(str).tolist() == ["1314", "1314"]
+    assert historial["id_registro"].tolist() == ["r1", "r2"]
+    assert historial["fecha_recepcion"].tolist() == ["2024-01-10", "2024-03-05"]
+
+
+def test_escrituras_con_claves_del_app(backend):
+    backend.append_row({"codigo": "1316", "estado": "Emitido", "id_registro": "r4", "last_updated": "t4"})
+    backend.update_row_by_idregistro({"estado": "Observado"}, "r1", expected_last_updated="t1")
+
+    historial = adaptar_historial_sharepoint(backend.read_table("table_name_hist"))
+    assert historial.set_index("id_registro").loc[["r1", "r4"], "estado"].tolist() == ["Observado", "Emitido"]
+
+
+def test_append_rows_con_claves_distintas(backend):
+    backend.append_rows([
+        {"codigo": "2", "id_registro": "r5"},
+        {"codigo": "3", "estado": "x", "id_registro": "r6", "last_updated": "t6"},
+    ])
+    df = backend.read_table("table_name_hist").set_index("IdRegistro")
+    assert df.loc["r6", ["Id_UE", "Estado", "LastUpdated"]].tolist() == ["3", "x", "t6"]
+    assert df.loc["r5", ["Id_UE", "Estado"]].tolist() == ["2", ""]
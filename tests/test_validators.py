@@ -0,0 +1,33 @@
+import pandas as pd
+
+from validators import validar_dataframe, validar_formulario
+
+EMITIDO = {"periodo": "2024-2028", "estado": "Emitido", "expediente": "E-1", "numero_it": "IT-1", "fecha_it": "2024-05-01"}
+
+
+def test_formulario_valida_el_texto_tal_cual():
+    # None llega como texto: formato inválido (no "obligatorio"), y cuenta como expediente completo
+    assert validar_formulario({"periodo": None}) == ["Periodo PEI debe tener el formato YYYY-YYYY (ej. 2028-2033)."]
+    assert validar_formulario({**EMITIDO, "expediente": None}) == []
+    assert validar_formulario({**EMITIDO, "expediente": " ", "fecha_it": None}) == [
+        "Para Estado=Emitido debes completar Expediente (SGD).",
+        "Para Estado=Emitido debes completar Fecha de I.T.",
+    ]
+
+
+def test_dataframe_equivale_al_formulario_con_vacios_como_texto():
+    filas = [
+        EMITIDO,
+        {**EMITIDO, "periodo": None, "expediente": float("nan")},
+        {**EMITIDO, "periodo": "2024", "numero_it": None, "fecha_it": pd.NaT},
+        {"periodo": "", "estado": "En revisión"},
+    ]
+    df = pd.DataFrame(filas, index=[10, 11, 12, 13])
+    reporte = validar_dataframe(df)
+
+    esperado = []
+    for i, fila in zip(df.index, df.to_dict("records")):
+        fila = {k: "" if not isinstance(v, str) and pd.isna(v) else v for k, v in fila.items()}
+        esperado += [(i, e) for e in validar_formulario(fila)]
+    assert list(zip(reporte["fila"], reporte["error"])) == esperado
+    assert reporte["fila"].tolist() == [11, 11, 12, 12, 12, 13]
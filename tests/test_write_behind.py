@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+import write_behind
+from sharepoint_excel import UpdateConflictError
+from write_behind import COMMITTED, PENDING, WriteBehindQueue
+
+
+class FakeBackend:
+    """Una tabla en memoria con compare-and-set por LastUpdated."""
+
+    def __init__(self, rows):
+        self.rows = rows      # id_registro -> {"estado":..., "last_updated":...}
+
+    def update_row_by_idregistro(self, updates_by_app_key, id_registro, appkey_to_excelnorm=None,
+                                 table_name_key="table_name_hist", expected_last_updated=None):
+        row = self.rows[id_registro]
+        if expected_last_updated is not None and row["last_updated"] != expected_last_updated:
+            raise UpdateConflictError(id_registro, expected_last_updated, row["last_updated"])
+        row.update(updates_by_app_key)
+
+    def has_idregistro(self, id_registro, table_name_key="table_name_hist"):
+        return id_registro in self.rows
+
+    def append_rows(self, rows, table_name_key="table_name_hist"):
+        for r in rows:
+            self.rows[r["id_registro"]] = r
+
+
+@pytest.fixture
+def backend():
+    return FakeBackend({"r1": {"estado": "En revisión", "last_updated": "t0"}})
+
+
+@pytest.fixture
+def queue(tmp_path, backend, monkeypatch):
+    monkeypatch.setattr(write_behind, "RETRY_BASE_S", 0.0)
+    return WriteBehindQueue(backend, path=str(tmp_path / "journal.sqlite3"))
+
+
+def test_error_tras_claim_devuelve_las_filas_a_la_cola(queue, monkeypatch):
+    wid = queue.submit_update("r1", {"estado": "Emitido", "last_updated": "t1"}, expected_last_updated="t0")
+
+    def falla(row):
+        raise RuntimeError("se cayó el worker")
+    monkeypatch.setattr(queue, "_send_update", falla)
+    with pytest.raises(RuntimeError):
+        queue.drain_once()
+
+    st = queue.status([wid])[wid]
+    assert (st["status"], st["attempts"], st["error"]) == (PENDING, 1, "se cayó el worker")
+
+
+def test_segundo_guardado_se_encadena_al_que_esta_en_envio(queue, backend):
+    a = queue.submit_update("r1", {"estado": "Observado", "last_updated": "t1"}, expected_last_updated="t0")
+    (en_envio,) = queue._claim(10)                # el worker tomó el primero
+
+    b = queue.submit_update("r1", {"estado": "Emitido", "last_updated": "t2"}, expected_last_updated="t0")
+    assert b != a
+    with queue._lock:
+        guardado = queue._db.execute("SELECT expected_last_updated FROM writes WHERE id=?", (b,)).fetchone()[0]
+    assert json.loads(guardado) == "t1"
+
+    # mientras el primero no termina, el segundo espera (sin gastar intentos)
+    assert queue.drain_once()
+    assert queue.status([b])[b]["status"] == PENDING and queue.status([b])[b]["attempts"] == 0
+
+    queue._send_update(en_envio)
+    assert queue.drain_once()
+    assert {w: s["status"] for w, s in queue.status([a, b]).items()} == {a: COMMITTED, b: COMMITTED}
+    assert backend.rows["r1"] == {"estado": "Emitido", "last_updated": "t2"}
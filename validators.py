@@ -1,7 +1,75 @@
 import re
 
+import numpy as np
+import pandas as pd
+
 PERIODO_REGEX = re.compile(r"^\d{4}-\d{4}$")
 
+# Reglas en el orden en que se informan: (campo, mensaje)
+MENSAJES = (
+    ("periodo", "Periodo PEI es obligatorio."),
+    ("periodo", "Periodo PEI debe tener el formato YYYY-YYYY (ej. 2028-2033)."),
+    ("expediente", "Para Estado=Emitido debes completar Expediente (SGD)."),
+    ("numero_it", "Para Estado=Emitido debes completar Número de I.T."),
+    ("fecha_it", "Para Estado=Emitido debes completar Fecha de I.T."),
+)
+
+def _texto(df: pd.DataFrame, col: str) -> pd.Series:
+    # Columna como texto sin espacios ("" si falta la columna o el valor)
+    if col not in df.columns:
+        return pd.Series("", index=df.index, dtype="string")
+    return df[col].astype("string").str.strip().fillna("")
+
+def validar_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aplica las reglas de validar_formulario a todas las filas de un DataFrame con las
+    columnas del app (como lo deja adaptar_historial_sharepoint), con operaciones por columna.
+    Devuelve un reporte con una fila por error: fila (índice de df), campo, error;
+    ordenado por fila y, dentro de cada fila, en el orden de validar_formulario.
+
+    Diferencia con validar_formulario: aquí una celda vacía (None/NaN/NaT) cuenta como ""
+    (p. ej. periodo None -> "obligatorio"), mientras que validar_formulario valida el texto
+    del valor tal cual llega del formulario (str(None) -> error de formato). Es decir,
+    equivale a validar_formulario sobre cada fila con los vacíos de pandas pasados a "".
+    """
+    periodo = _texto(df, "periodo")
+    sin_periodo = periodo.eq("")
+    mal_periodo = ~sin_periodo & ~periodo.str.fullmatch(PERIODO_REGEX.pattern).fillna(False)
+
+    # Regla que ya tienes: si Estado=Emitido, exige campos
+    emitido = df["estado"].eq("Emitido").fillna(False) if "estado" in df.columns else pd.Series(False, index=df.index)
+    if "fecha_it" in df.columns:
+        # como `not fecha_it`: vacío es None/NaN/NaT o ""
+        fecha = df["fecha_it"]
+        sin_fecha = fecha.isna() | fecha.eq("").fillna(False)
+    else:
+        sin_fecha = pd.Series(True, index=df.index)
+
+    masks = (
+        sin_periodo,
+        mal_periodo,
+        emitido & _texto(df, "expediente").eq(""),
+        emitido & _texto(df, "numero_it").eq(""),
+        emitido & sin_fecha,
+    )
+
+    filas, reglas = [], []
+    for n, mask in enumerate(masks):
+        pos = np.flatnonzero(mask.to_numpy(dtype=bool))
+        filas.append(pos)
+        reglas.append(np.full(len(pos), n))
+    filas, reglas = np.concatenate(filas), np.concatenate(reglas)
+    orden = np.lexsort((reglas, filas))
+    filas, reglas = filas[orden], reglas[orden]
+
+    campos = np.array([c for c, _ in MENSAJES], dtype=object)
+    mensajes = np.array([m for _, m in MENSAJES], dtype=object)
+    return pd.DataFrame({
+        "fila": df.index.to_numpy()[filas],
+        "campo": campos[reglas],
+        "error": mensajes[reglas],
+    })
+
 def validar_formulario(datos: dict) -> list[str]:
     errores = []
 
@@ -0,0 +1,377 @@
+"""
+Escritura diferida (write-behind) de los guardados del formulario.
+
+El submit solo registra la escritura en un journal local (SQLite en modo WAL) y vuelve
+de inmediato; un hilo de fondo lo vacía hacia el backend (SharePoint o libros locales):
+- los append pendientes de una misma tabla salen juntos (una llamada rows/add);
+- las actualizaciones repetidas del mismo IdRegistro se fusionan en una sola (y si la
+  fila todavía no se insertó, se fusionan en el append); si la anterior ya está en
+  envío, la nueva se encadena: espera a que termine y su compare-and-set parte del
+  LastUpdated que escribe esa anterior;
+- los errores transitorios se reintentan con backoff; un conflicto (compare-and-set)
+  o un IdRegistro inexistente quedan como fallidos, con su mensaje;
+- el IdRegistro de cada append es su clave de idempotencia: si un envío quedó en duda
+  (error a mitad de camino, reinicio del proceso), antes de reenviarlo se verifica si la
+  fila ya existe, para no duplicarla.
+
+Estados de cada escritura: pending -> sending -> committed | failed | conflict.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+
+from sharepoint_excel import UpdateConflictError, _same_last_updated
+
+JOURNAL_PATH = os.environ.get(
+    "IT_PEI_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "write_journal.sqlite3"),
+)
+
+BATCH_SIZE = 20             # escrituras que toma el worker por vuelta
+MAX_ATTEMPTS = 5
+RETRY_BASE_S = 2.0          # backoff: 2, 4, 8, ... s
+
+PENDING, SENDING, COMMITTED, FAILED, CONFLICT = "pending", "sending", "committed", "failed", "conflict"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS writes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    session_id TEXT,
+    kind TEXT NOT NULL,                 -- append | update
+    table_name_key TEXT NOT NULL,
+    id_registro TEXT NOT NULL,
+    payload TEXT NOT NULL,              -- JSON con claves técnicas del app
+    expected_last_updated TEXT,         -- JSON (compare-and-set de updates)
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS writes_status ON writes(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS writes_registro ON writes(table_name_key, id_registro, status);
+CREATE INDEX IF NOT EXISTS writes_session ON writes(session_id, id);
+"""
+
+
+class WriteBehindQueue:
+    def __init__(self, backend, path: str = JOURNAL_PATH, appkey_to_excelnorm: dict | None = None):
+        self.backend = backend
+        self.path = path
+        self.appkey_to_excelnorm = appkey_to_excelnorm
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        # lo que quedó "enviando" al caer el proceso está en duda: se reintenta verificando
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET status=?, attempts=attempts+1, updated_at=? WHERE status=?",
+                (PENDING, time.time(), SENDING),
+            )
+
+    # -----------------------------
+    # Encolar (desde la sesión de Streamlit)
+    # -----------------------------
+    def submit_append(self, row_by_app_key: dict, table_name_key="table_name_hist", session_id: str | None = None) -> int:
+        """Encola una fila nueva (debe traer id_registro). Devuelve el id de la escritura."""
+        id_registro = str(row_by_app_key.get("id_registro") or "").strip()
+        if not id_registro:
+            raise ValueError("La fila a insertar debe traer 'id_registro' (clave de idempotencia).")
+        return self._insert("append", table_name_key, id_registro, row_by_app_key, None, session_id, f"append:{id_registro}")
+
+    def submit_update(
+        self,
+        id_registro: str,
+        updates_by_app_key: dict,
+        expected_last_updated=None,
+        table_name_key="table_name_hist",
+        session_id: str | None = None,
+    ) -> int:
+        """
+        Encola una actualización. Si ya hay una pendiente (o un append pendiente) para ese
+        IdRegistro, se fusiona con ella y se devuelve el id de esa escritura. Si la anterior
+        ya se está enviando (o quedó en duda), la nueva espera a que termine y se compara
+        contra el LastUpdated que esa anterior escribe.
+        """
+        id_registro = str(id_registro).strip()
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # solo escrituras que aún no se intentaron: un envío en duda no se modifica
+                prev = self._db.execute(
+                    "SELECT id, payload FROM writes WHERE table_name_key=? AND id_registro=? AND status=? "
+                    "AND attempts=0 ORDER BY id DESC LIMIT 1",
+                    (table_name_key, id_registro, PENDING),
+                ).fetchone()
+                if prev is not None:
+                    merged = {**json.loads(prev["payload"]), **updates_by_app_key}
+                    self._db.execute(
+                        "UPDATE writes SET payload=?, updated_at=? WHERE id=?",
+                        (json.dumps(merged, default=str), now, prev["id"]),
+                    )
+                    self._db.execute("COMMIT")
+                    self._wake.set()
+                    return prev["id"]
+
+                # escritura anterior en envío: la nueva parte del estado que esa deja
+                inflight = self._db.execute(
+                    "SELECT payload, expected_last_updated FROM writes WHERE table_name_key=? AND id_registro=? "
+                    "AND status IN (?, ?) ORDER BY id DESC LIMIT 1",
+                    (table_name_key, id_registro, PENDING, SENDING),
+                ).fetchone()
+                if inflight is not None and expected_last_updated is not None:
+                    base = None if inflight["expected_last_updated"] is None else json.loads(inflight["expected_last_updated"])
+                    escrito = json.loads(inflight["payload"]).get("last_updated")
+                    if escrito is not None and (base is None or _same_last_updated(base, expected_last_updated)):
+                        expected_last_updated = escrito
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return self._insert("update", table_name_key, id_registro, updates_by_app_key, expected_last_updated, session_id, f"update:{uuid4()}")
+
+    def _insert(self, kind, table_name_key, id_registro, payload, expected, session_id, idem_key) -> int:
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO writes (idem_key, session_id, kind, table_name_key, id_registro, payload, "
+                "expected_last_updated, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(idem_key) DO NOTHING",
+                (
+                    idem_key, session_id, kind, table_name_key, id_registro,
+                    json.dumps(payload, default=str),
+                    None if expected is None else json.dumps(expected, default=str),
+                    PENDING, now, now,
+                ),
+            )
+            write_id = cur.lastrowid if cur.rowcount else self._db.execute(
+                "SELECT id FROM writes WHERE idem_key=?", (idem_key,)
+            ).fetchone()["id"]
+        self._wake.set()
+        return write_id
+
+    # -----------------------------
+    # Estado (para la UI)
+    # -----------------------------
+    def status(self, write_ids: list[int]) -> dict[int, dict]:
+        if not write_ids:
+            return {}
+        marks = ",".join("?" * len(write_ids))
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, kind, id_registro, status, attempts, error, updated_at FROM writes WHERE id IN ({marks})",
+                list(write_ids),
+            ).fetchall()
+        return {r["id"]: dict(r) for r in rows}
+
+    def session_writes(self, session_id: str, limit: int = 10) -> list[dict]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, kind, id_registro, status, attempts, error, created_at, updated_at "
+                "FROM writes WHERE session_id=? ORDER BY id DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def retry(self, write_id: int) -> None:
+        """Vuelve a encolar una escritura fallida."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET status=?, next_attempt_at=0, error=NULL, updated_at=? WHERE id=? AND status=?",
+                (PENDING, time.time(), write_id, FAILED),
+            )
+        self._wake.set()
+
+    # -----------------------------
+    # Worker
+    # -----------------------------
+    def start(self) -> "WriteBehindQueue":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                busy = self.drain_once()
+            except Exception:
+                busy = False     # p. ej. journal bloqueado: se reintenta en la próxima vuelta
+            if not busy:
+                self._wake.wait(1.0)
+                self._wake.clear()
+
+    def _claim(self, limit: int) -> list[sqlite3.Row]:
+        # pending -> sending de forma atómica (otro proceso con el mismo journal no las toma)
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT * FROM writes WHERE status=? AND next_attempt_at<=? ORDER BY id LIMIT ?",
+                    (PENDING, now, limit),
+                ).fetchall()
+                if rows:
+                    marks = ",".join("?" * len(rows))
+                    self._db.execute(
+                        f"UPDATE writes SET status=?, updated_at=? WHERE id IN ({marks})",
+                        [SENDING, now, *[r["id"] for r in rows]],
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
+
+    def _finish(self, row: sqlite3.Row, status: str, error: str | None = None) -> None:
+        now = time.time()
+        with self._lock:
+            if status == PENDING:
+                attempts = row["attempts"] + 1
+                if attempts >= MAX_ATTEMPTS:
+                    status = FAILED
+                self._db.execute(
+                    "UPDATE writes SET status=?, attempts=?, next_attempt_at=?, error=?, updated_at=? WHERE id=?",
+                    (status, attempts, now + RETRY_BASE_S * (2 ** (attempts - 1)), error, now, row["id"]),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE writes SET status=?, error=?, updated_at=? WHERE id=?",
+                    (status, error, now, row["id"]),
+                )
+
+    def _release(self, rows: list[sqlite3.Row], error: str) -> None:
+        # las que siguen "enviando" tras un error inesperado vuelven a la cola (en duda: attempts+1)
+        now = time.time()
+        marks = ",".join("?" * len(rows))
+        with self._lock:
+            self._db.execute(
+                f"UPDATE writes SET status=CASE WHEN attempts+1>=? THEN ? ELSE ? END, attempts=attempts+1, "
+                f"next_attempt_at=?, error=?, updated_at=? WHERE id IN ({marks}) AND status=?",
+                [MAX_ATTEMPTS, FAILED, PENDING, now + RETRY_BASE_S, error, now, *[r["id"] for r in rows], SENDING],
+            )
+
+    def drain_once(self) -> bool:
+        """Envía un lote del journal. Devuelve True si había algo para enviar."""
+        rows = self._claim(BATCH_SIZE)
+        if not rows:
+            return False
+
+        error = "interrumpido antes de terminar el envío"
+        try:
+            # primero los append, para que las actualizaciones de filas recién creadas las encuentren
+            appends: dict[str, list[sqlite3.Row]] = {}
+            for row in rows:
+                if row["kind"] == "append":
+                    appends.setdefault(row["table_name_key"], []).append(row)
+            for table_name_key, group in appends.items():
+                self._send_appends(table_name_key, group)
+
+            for row in rows:
+                if row["kind"] == "update":
+                    self._send_update(row)
+        except BaseException as e:
+            error = str(e) or type(e).__name__
+            raise
+        finally:
+            self._release(rows, error)
+        return True
+
+    def _previa_pendiente(self, row: sqlite3.Row, kinds=("append", "update")) -> bool:
+        # escritura anterior del mismo IdRegistro que todavía no terminó
+        marks = ",".join("?" * len(kinds))
+        with self._lock:
+            return self._db.execute(
+                f"SELECT 1 FROM writes WHERE kind IN ({marks}) AND table_name_key=? AND id_registro=? "
+                "AND status IN (?, ?) AND id<? LIMIT 1",
+                (*kinds, row["table_name_key"], row["id_registro"], PENDING, SENDING, row["id"]),
+            ).fetchone() is not None
+
+    def _defer(self, row: sqlite3.Row) -> None:
+        # vuelve a la cola sin contar como intento (espera a la escritura anterior)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE writes SET status=?, next_attempt_at=?, updated_at=? WHERE id=?",
+                (PENDING, now + RETRY_BASE_S, now, row["id"]),
+            )
+
+    def _send_appends(self, table_name_key: str, group: list[sqlite3.Row]) -> None:
+        todo = []
+        for row in group:
+            if row["attempts"] > 0:
+                # envío en duda: si la fila ya está en la tabla no se vuelve a insertar
+                try:
+                    if self.backend.has_idregistro(row["id_registro"], table_name_key):
+                        self._finish(row, COMMITTED)
+                        continue
+                except Exception as e:
+                    self._finish(row, PENDING, str(e))
+                    continue
+            todo.append(row)
+        if not todo:
+            return
+
+        try:
+            self.backend.append_rows([json.loads(r["payload"]) for r in todo], table_name_key)
+        except ValueError as e:
+            for row in todo:
+                self._finish(row, FAILED, str(e))
+            return
+        except Exception as e:
+            for row in todo:
+                self._finish(row, PENDING, str(e))
+            return
+        for row in todo:
+            self._finish(row, COMMITTED)
+
+    def _send_update(self, row: sqlite3.Row) -> None:
+        if self._previa_pendiente(row):
+            self._defer(row)     # encadenada: sale cuando termine la anterior del mismo IdRegistro
+            return
+        payload = json.loads(row["payload"])
+        expected = None if row["expected_last_updated"] is None else json.loads(row["expected_last_updated"])
+        try:
+            self.backend.update_row_by_idregistro(
+                updates_by_app_key=payload,
+                id_registro=row["id_registro"],
+                appkey_to_excelnorm=self.appkey_to_excelnorm,
+                table_name_key=row["table_name_key"],
+                expected_last_updated=expected,
+            )
+        except UpdateConflictError as e:
+            # reintento de un envío en duda que sí se aplicó: LastUpdated ya es el nuestro
+            if row["attempts"] > 0 and _same_last_updated(e.actual, payload.get("last_updated")):
+                self._finish(row, COMMITTED)
+            else:
+                self._finish(row, CONFLICT, str(e))
+        except ValueError as e:
+            # la fila puede no existir todavía porque su append sigue en cola
+            self._finish(row, PENDING if self._previa_pendiente(row, ("append",)) else FAILED, str(e))
+        except Exception as e:
+            self._finish(row, PENDING, str(e))
+        else:
+            self._finish(row, COMMITTED)